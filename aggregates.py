@@ -0,0 +1,324 @@
+import os
+from decimal import Decimal
+
+import click
+import mysql.connector
+
+
+# ##############################################################################
+# INCREMENTAL AGGREGATE TABLES
+# ##############################################################################
+#
+# customer_paid_totals and product_order_totals hold the running sums behind the
+# top_customers and popular_products reports, and product_paid_revenue holds each
+# product's share of paid invoice amounts (split across an order's lines by line
+# value) for warehouse_revenue. The order routes apply deltas to them in the same
+# transaction as the write, so the reports read one row per customer/product
+# instead of summing all of history.
+#
+# The tables are opt-in: run `flask aggregates rebuild` once, then set
+# AGGREGATE_TABLES=1. Until then every function here is a no-op.
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS customer_paid_totals (
+        Customer_ID INT NOT NULL PRIMARY KEY,
+        Total_Paid DECIMAL(14, 2) NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS product_order_totals (
+        Product_ID INT NOT NULL PRIMARY KEY,
+        Total_Quantity BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS product_paid_revenue (
+        Product_ID INT NOT NULL PRIMARY KEY,
+        Revenue DECIMAL(18, 4) NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+# Add `quantity` * the product's UnitPrice to the paid total of the customer behind
+# every Paid invoice of an order.
+_PAID_DELTA_FOR_ORDER = """
+    INSERT INTO customer_paid_totals (Customer_ID, Total_Paid)
+    SELECT o.Customer_ID, %s * p.UnitPrice
+    FROM Orders o
+    JOIN Invoices i ON o.Order_ID = i.Order_ID
+    JOIN Products p ON p.Product_ID = %s
+    WHERE o.Order_ID = %s AND i.Status = 'Paid'
+    ON DUPLICATE KEY UPDATE Total_Paid = Total_Paid + VALUES(Total_Paid)
+"""
+
+_QUANTITY_DELTA = """
+    INSERT INTO product_order_totals (Product_ID, Total_Quantity)
+    VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE Total_Quantity = Total_Quantity + VALUES(Total_Quantity)
+"""
+
+# Add `quantity` * UnitPrice to a product's revenue once for every Paid invoice of an order.
+_REVENUE_DELTA_FOR_ORDER = """
+    INSERT INTO product_paid_revenue (Product_ID, Revenue)
+    SELECT p.Product_ID, %s * p.UnitPrice
+    FROM Invoices i
+    JOIN Products p ON p.Product_ID = %s
+    WHERE i.Order_ID = %s AND i.Status = 'Paid'
+    ON DUPLICATE KEY UPDATE Revenue = Revenue + VALUES(Revenue)
+"""
+
+# Spread `sign` * an invoice's amount over its order's lines in proportion to
+# line value (Quantity * UnitPrice).
+_REVENUE_DELTA_FOR_INVOICE = """
+    INSERT INTO product_paid_revenue (Product_ID, Revenue)
+    SELECT oi.Product_ID, %s * i.Amount * (oi.Quantity * p.UnitPrice) / t.Order_Value
+    FROM Invoices i
+    JOIN order_items oi ON i.Order_ID = oi.Order_ID
+    JOIN Products p ON oi.Product_ID = p.Product_ID
+    JOIN (
+        SELECT oi2.Order_ID, SUM(oi2.Quantity * p2.UnitPrice) AS Order_Value
+        FROM order_items oi2
+        JOIN Products p2 ON oi2.Product_ID = p2.Product_ID
+        WHERE oi2.Order_ID = (SELECT Order_ID FROM Invoices WHERE Invoice_ID = %s)
+        GROUP BY oi2.Order_ID
+    ) t ON i.Order_ID = t.Order_ID
+    WHERE i.Invoice_ID = %s AND t.Order_Value > 0
+    ON DUPLICATE KEY UPDATE Revenue = Revenue + VALUES(Revenue)
+"""
+
+_EXPECTED_CUSTOMERS = """
+    SELECT o.Customer_ID, SUM(i.Amount)
+    FROM Orders o
+    JOIN Invoices i ON o.Order_ID = i.Order_ID
+    WHERE i.Status = 'Paid'
+    GROUP BY o.Customer_ID
+"""
+
+_EXPECTED_PRODUCTS = """
+    SELECT Product_ID, SUM(Quantity)
+    FROM order_items
+    GROUP BY Product_ID
+"""
+
+# Paid amounts are pre-aggregated per order and split by line value, so every
+# order line contributes exactly once.
+_EXPECTED_REVENUE = """
+    SELECT lv.Product_ID, SUM(po.Paid_Amount * lv.Line_Value / ov.Order_Value)
+    FROM (
+        SELECT Order_ID, SUM(Amount) AS Paid_Amount
+        FROM Invoices
+        WHERE Status = 'Paid'
+        GROUP BY Order_ID
+    ) po
+    JOIN (
+        SELECT oi.Order_ID, oi.Product_ID, oi.Quantity * p.UnitPrice AS Line_Value
+        FROM order_items oi
+        JOIN Products p ON oi.Product_ID = p.Product_ID
+    ) lv ON po.Order_ID = lv.Order_ID
+    JOIN (
+        SELECT oi.Order_ID, SUM(oi.Quantity * p.UnitPrice) AS Order_Value
+        FROM order_items oi
+        JOIN Products p ON oi.Product_ID = p.Product_ID
+        GROUP BY oi.Order_ID
+    ) ov ON po.Order_ID = ov.Order_ID
+    WHERE ov.Order_Value > 0
+    GROUP BY lv.Product_ID
+"""
+
+
+def enabled():
+    """True when the routes should maintain, and the reports read, the aggregate tables."""
+    return os.environ.get('AGGREGATE_TABLES', '0') == '1'
+
+
+# --- deltas, applied inside the caller's transaction ----------------------
+
+def item_added(cursor, order_id, product_id, quantity):
+    """Records `quantity` more of a product on an order, valued at its current UnitPrice."""
+    if not enabled():
+        return
+    cursor.execute(_QUANTITY_DELTA, (product_id, quantity))
+    cursor.execute(_PAID_DELTA_FOR_ORDER, (quantity, product_id, order_id))
+    cursor.execute(_REVENUE_DELTA_FOR_ORDER, (quantity, product_id, order_id))
+
+
+def item_removed(cursor, order_id, product_id, quantity):
+    """Reverses item_added() for a line that is being deleted."""
+    item_added(cursor, order_id, product_id, -quantity)
+
+
+def items_changed(cursor, order_id, customer_id, changes, paid_invoices):
+    """Bulk form of item_added()/item_removed() for many lines of one order.
+
+    `changes` is a list of (product_id, quantity_delta, amount_delta) and
+    `paid_invoices` the number of Paid invoices on the order, which the caller
+    has already read (and locked) in this transaction. Runs at most three
+    statements regardless of the number of lines.
+    """
+    if not enabled() or not changes:
+        return
+    cursor.executemany(_QUANTITY_DELTA, [(product_id, quantity) for product_id, quantity, _ in changes])
+    if not paid_invoices:
+        return
+    cursor.execute("""
+        INSERT INTO customer_paid_totals (Customer_ID, Total_Paid)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE Total_Paid = Total_Paid + VALUES(Total_Paid)
+    """, (customer_id, paid_invoices * sum(amount for _, _, amount in changes)))
+    cursor.executemany("""
+        INSERT INTO product_paid_revenue (Product_ID, Revenue)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE Revenue = Revenue + VALUES(Revenue)
+    """, [(product_id, paid_invoices * amount) for product_id, _, amount in changes])
+
+
+def order_deleted(cursor, order_id):
+    """Subtracts an order's lines and paid invoices. Call before deleting its rows."""
+    if not enabled():
+        return
+    cursor.execute("""
+        INSERT INTO product_order_totals (Product_ID, Total_Quantity)
+        SELECT Product_ID, -SUM(Quantity)
+        FROM order_items
+        WHERE Order_ID = %s
+        GROUP BY Product_ID
+        ON DUPLICATE KEY UPDATE Total_Quantity = Total_Quantity + VALUES(Total_Quantity)
+    """, (order_id,))
+    cursor.execute("""
+        INSERT INTO customer_paid_totals (Customer_ID, Total_Paid)
+        SELECT o.Customer_ID, -SUM(i.Amount)
+        FROM Orders o
+        JOIN Invoices i ON o.Order_ID = i.Order_ID
+        WHERE o.Order_ID = %s AND i.Status = 'Paid'
+        GROUP BY o.Customer_ID
+        ON DUPLICATE KEY UPDATE Total_Paid = Total_Paid + VALUES(Total_Paid)
+    """, (order_id,))
+    cursor.execute("""
+        INSERT INTO product_paid_revenue (Product_ID, Revenue)
+        SELECT oi.Product_ID, -po.Paid_Amount * (oi.Quantity * p.UnitPrice) / t.Order_Value
+        FROM (
+            SELECT Order_ID, SUM(Amount) AS Paid_Amount
+            FROM Invoices
+            WHERE Order_ID = %s AND Status = 'Paid'
+            GROUP BY Order_ID
+        ) po
+        JOIN order_items oi ON po.Order_ID = oi.Order_ID
+        JOIN Products p ON oi.Product_ID = p.Product_ID
+        JOIN (
+            SELECT oi2.Order_ID, SUM(oi2.Quantity * p2.UnitPrice) AS Order_Value
+            FROM order_items oi2
+            JOIN Products p2 ON oi2.Product_ID = p2.Product_ID
+            WHERE oi2.Order_ID = %s
+            GROUP BY oi2.Order_ID
+        ) t ON po.Order_ID = t.Order_ID
+        WHERE t.Order_Value > 0
+        ON DUPLICATE KEY UPDATE Revenue = Revenue + VALUES(Revenue)
+    """, (order_id, order_id))
+
+
+def invoice_status_changed(cursor, invoice_id, old_status, new_status):
+    """Moves an invoice's amount into or out of its customer's and products' paid totals."""
+    if not enabled() or (old_status == 'Paid') == (new_status == 'Paid'):
+        return
+    sign = 1 if new_status == 'Paid' else -1
+    cursor.execute("""
+        INSERT INTO customer_paid_totals (Customer_ID, Total_Paid)
+        SELECT o.Customer_ID, %s * i.Amount
+        FROM Invoices i
+        JOIN Orders o ON i.Order_ID = o.Order_ID
+        WHERE i.Invoice_ID = %s
+        ON DUPLICATE KEY UPDATE Total_Paid = Total_Paid + VALUES(Total_Paid)
+    """, (sign, invoice_id))
+    cursor.execute(_REVENUE_DELTA_FOR_INVOICE, (sign, invoice_id, invoice_id))
+
+
+# --- rebuild / verify -----------------------------------------------------
+
+def rebuild(cnx):
+    """Recomputes every aggregate table from scratch in one transaction."""
+    cursor = cnx.cursor()
+    try:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        cnx.start_transaction()
+        cursor.execute("DELETE FROM customer_paid_totals")
+        cursor.execute("INSERT INTO customer_paid_totals (Customer_ID, Total_Paid)" + _EXPECTED_CUSTOMERS)
+        customers = cursor.rowcount
+        cursor.execute("DELETE FROM product_order_totals")
+        cursor.execute("INSERT INTO product_order_totals (Product_ID, Total_Quantity)" + _EXPECTED_PRODUCTS)
+        products = cursor.rowcount
+        cursor.execute("DELETE FROM product_paid_revenue")
+        cursor.execute("INSERT INTO product_paid_revenue (Product_ID, Revenue)" + _EXPECTED_REVENUE)
+        cnx.commit()
+        return customers, products
+    finally:
+        cursor.close()
+
+
+def verify(cnx):
+    """Compares the stored totals with a full recomputation.
+
+    Returns a list of (table, id, stored, expected) for every key that differs
+    by more than the table's tolerance. Revenue shares are fractional, so they
+    are compared to the cent.
+    """
+    checks = [
+        ('customer_paid_totals', "SELECT Customer_ID, Total_Paid FROM customer_paid_totals",
+         _EXPECTED_CUSTOMERS, 0),
+        ('product_order_totals', "SELECT Product_ID, Total_Quantity FROM product_order_totals",
+         _EXPECTED_PRODUCTS, 0),
+        ('product_paid_revenue', "SELECT Product_ID, Revenue FROM product_paid_revenue",
+         _EXPECTED_REVENUE, Decimal('0.01')),
+    ]
+    mismatches = []
+    cursor = cnx.cursor()
+    try:
+        for table, stored_query, expected_query, tolerance in checks:
+            cursor.execute(stored_query)
+            # Rows whose running total fell back to zero are equivalent to absent rows.
+            stored = {key: value for key, value in cursor.fetchall() if value}
+            cursor.execute(expected_query)
+            expected = {key: value for key, value in cursor.fetchall() if value}
+            for key in sorted(set(stored) | set(expected)):
+                if abs(stored.get(key, 0) - expected.get(key, 0)) > tolerance:
+                    mismatches.append((table, key, stored.get(key, 0), expected.get(key, 0)))
+    finally:
+        cursor.close()
+    return mismatches
+
+
+def init_app(app, db_config):
+    """Registers the `flask aggregates` command group."""
+
+    @app.cli.group('aggregates')
+    def aggregates_cli():
+        """Maintains the incremental report aggregate tables."""
+
+    @aggregates_cli.command('rebuild')
+    def rebuild_command():
+        """Creates the aggregate tables and recomputes them from history.
+
+        Run while order writes are paused; deltas committed during the rebuild
+        can be lost.
+        """
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            customers, products = rebuild(cnx)
+        finally:
+            cnx.close()
+        click.echo(f"Rebuilt {customers} customer totals and {products} product totals.")
+
+    @aggregates_cli.command('verify')
+    def verify_command():
+        """Reports any drift between the aggregate tables and the base tables."""
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            mismatches = verify(cnx)
+        finally:
+            cnx.close()
+        for table, key, stored, expected in mismatches:
+            click.echo(f"{table} {key}: stored {stored}, expected {expected}")
+        if mismatches:
+            raise click.ClickException(f"{len(mismatches)} aggregate rows differ; run `flask aggregates rebuild`.")
+        click.echo("Aggregate tables match the base tables.")
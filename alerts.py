@@ -0,0 +1,445 @@
+import collections
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+
+import click
+import mysql.connector
+from flask import Response, g, has_request_context, request
+
+from cache import TTLCache
+
+
+# ##############################################################################
+# LOW-STOCK ALERTS
+# ##############################################################################
+#
+# Every stock mutation (allocation.py) is passed to stock_changed() inside the
+# transaction that made it, as (warehouse, product, stock before, stock after).
+# The threshold listener compares each change with the row's reorder level, and
+# a change that crosses it writes a 'low' or 'restocked' alert to the
+# stock_alerts outbox in the same transaction. Alerts therefore commit or roll
+# back with the stock they describe, and detection costs O(changes) instead of
+# a scan of warehouse_inventory.
+#
+# Reorder levels come from stock_thresholds: a (product, warehouse) row, else
+# the product's Warehouse_ID 0 row, else LOW_STOCK_THRESHOLD (100, the low_stock
+# report's cut-off). `flask alerts threshold` sets them.
+#
+# One dispatcher thread per worker reads the last ALERT_LOOKBACK_SECONDS of the
+# outbox every ALERT_POLL_SECONDS (and right after a request raised an alert),
+# pushes new alerts to /alerts/stream subscribers (Server-Sent Events) and hands
+# undelivered ones to the ALERT_SINKS. Delivery is at least once: a worker
+# leases an alert (Claimed_Until) before handing it over and marks it delivered
+# only after every sink took it. If a sink fails the lease is pushed out by
+# ALERT_RETRY_SECONDS and any worker retries it then, as it does when a worker
+# died holding a lease. A sink may therefore see an alert twice.
+#
+# Alerts are opt-in: run `flask schema migrate` (0004 and 0007 add the tables),
+# then set STOCK_ALERTS=1. Until then stock_changed() does nothing.
+
+LOW_STOCK_THRESHOLD = int(os.environ.get('LOW_STOCK_THRESHOLD', 100))
+ALERT_POLL_SECONDS = float(os.environ.get('ALERT_POLL_SECONDS', 2))
+ALERT_LOOKBACK_SECONDS = int(os.environ.get('ALERT_LOOKBACK_SECONDS', 60))
+# How long a delivery may take before another worker may retry it, and how long
+# to wait after a sink failed.
+ALERT_CLAIM_SECONDS = int(os.environ.get('ALERT_CLAIM_SECONDS', 60))
+ALERT_RETRY_SECONDS = int(os.environ.get('ALERT_RETRY_SECONDS', 30))
+# Streams end after this long and the browser reconnects (with Last-Event-ID).
+# A stream holds a whole sync worker, so sync workers (SERVE_MODE=sync) refuse
+# it and the dashboard polls /alerts/recent instead; the cap below WEB_TIMEOUT
+# keeps a stream from getting its worker killed all the same.
+ALERT_STREAM_SECONDS = min(int(os.environ.get('ALERT_STREAM_SECONDS', 300)),
+                           max(int(os.environ.get('WEB_TIMEOUT', 60)) - 15, 5))
+# How many alerts /alerts/recent returns, and how often the dashboard asks.
+ALERT_RECENT_LIMIT = 20
+ALERT_REFRESH_SECONDS = 15
+
+log = logging.getLogger('scm.stock_alerts')
+
+# Reorder levels change rarely; each worker keeps a product's for a minute.
+_threshold_cache = TTLCache(max_entries=4096)
+THRESHOLD_TTL = 60
+
+
+def enabled():
+    return os.environ.get('STOCK_ALERTS', '0') == '1'
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+# --- events, inside the writing transaction ---------------------------------
+
+_listeners = []
+
+
+def add_listener(listener):
+    """Calls listener(cursor, changes) for every stock mutation, in its transaction."""
+    _listeners.append(listener)
+    return listener
+
+
+def stock_changed(cursor, changes):
+    """Emits [(warehouse_id, product_id, before, after)] to the listeners."""
+    if not enabled() or not changes:
+        return
+    for listener in _listeners:
+        listener(cursor, changes)
+
+
+def reorder_levels(cursor, product_ids):
+    """Returns {product_id: {warehouse_id: level}}; warehouse 0 is the product default."""
+    levels, missing = {}, []
+    for product_id in product_ids:
+        cached = _threshold_cache.get(product_id)
+        if cached is None:
+            missing.append(product_id)
+        else:
+            levels[product_id] = cached
+    if missing:
+        placeholders = ", ".join(["%s"] * len(missing))
+        cursor.execute(f"""
+            SELECT Product_ID, Warehouse_ID, Reorder_Level
+            FROM stock_thresholds
+            WHERE Product_ID IN ({placeholders})
+        """, missing)
+        found = {product_id: {} for product_id in missing}
+        for row in cursor.fetchall():
+            found[row['Product_ID']][row['Warehouse_ID']] = row['Reorder_Level']
+        for product_id, product_levels in found.items():
+            _threshold_cache.set(product_id, product_levels, THRESHOLD_TTL)
+        levels.update(found)
+    return levels
+
+
+@add_listener
+def check_thresholds(cursor, changes):
+    """Writes an alert for every change that crosses its row's reorder level."""
+    levels = reorder_levels(cursor, sorted({product_id for _, product_id, _, _ in changes}))
+    alerts = []
+    for warehouse_id, product_id, before, after in changes:
+        product_levels = levels.get(product_id, {})
+        level = product_levels.get(warehouse_id, product_levels.get(0, LOW_STOCK_THRESHOLD))
+        if before >= level > after:
+            kind = 'low'
+        elif before < level <= after:
+            kind = 'restocked'
+        else:
+            continue
+        alerts.append((uuid.uuid4().hex, warehouse_id, product_id, kind, after, level, _now()))
+    if alerts:
+        cursor.executemany("""
+            INSERT INTO stock_alerts (Alert_ID, Warehouse_ID, Product_ID, Kind, Stock, Reorder_Level, Created_At)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, alerts)
+        if has_request_context():
+            g.stock_alerts_raised = True
+
+
+# --- sinks ------------------------------------------------------------------
+
+SINKS = {}
+
+
+def register_sink(name):
+    """Decorator: makes sink(alert) selectable by name in ALERT_SINKS."""
+    def decorator(sink):
+        SINKS[name] = sink
+        return sink
+    return decorator
+
+
+@register_sink('log')
+def log_sink(alert):
+    log.warning("Stock %s: product %s in warehouse %s at %s (reorder level %s)",
+                alert['Kind'], alert['Product_ID'], alert['Warehouse_ID'], alert['Stock'], alert['Reorder_Level'])
+
+
+@register_sink('webhook')
+def webhook_sink(alert):
+    url = os.environ.get('ALERT_WEBHOOK_URL')
+    if not url:
+        raise RuntimeError("ALERT_WEBHOOK_URL is not set")
+    body = json.dumps(alert, default=str).encode()
+    post = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(post, timeout=5) as response:
+        response.read()
+
+
+def sinks():
+    names = [name.strip() for name in os.environ.get('ALERT_SINKS', 'log').split(',') if name.strip()]
+    unknown = [name for name in names if name not in SINKS]
+    if unknown:
+        raise ValueError(f"Unknown ALERT_SINKS {', '.join(unknown)}; choose from {', '.join(SINKS)}")
+    return [SINKS[name] for name in names]
+
+
+_CLAIM = """
+    UPDATE stock_alerts SET Claimed_Until = %s
+    WHERE Alert_ID = %s AND Delivered_At IS NULL AND (Claimed_Until IS NULL OR Claimed_Until < %s)
+"""
+
+# Columns handed to sinks and subscribers.
+ALERT_COLUMNS = "Alert_ID, Warehouse_ID, Product_ID, Kind, Stock, Reorder_Level, Created_At, Delivered_At"
+
+
+def deliver(cnx, alert_rows):
+    """Leases each undelivered alert and hands it to the sinks.
+
+    Returns (delivered, failed) counts; alerts leased by another worker are
+    skipped. A failed alert is retried after ALERT_RETRY_SECONDS.
+    """
+    targets = sinks()
+    delivered = failed = 0
+    cursor = cnx.cursor()
+    try:
+        for alert in alert_rows:
+            if alert['Delivered_At'] is not None:
+                continue
+            now = _now()
+            cursor.execute(_CLAIM, (now + datetime.timedelta(seconds=ALERT_CLAIM_SECONDS), alert['Alert_ID'], now))
+            cnx.commit()
+            if cursor.rowcount != 1:
+                continue  # delivered, or leased by another worker
+            try:
+                for sink in targets:
+                    sink(alert)
+            except Exception:
+                log.exception("Alert sink %s failed for alert %s; retrying in %ss", sink.__name__,
+                              alert['Alert_ID'], ALERT_RETRY_SECONDS)
+                cursor.execute("UPDATE stock_alerts SET Claimed_Until = %s WHERE Alert_ID = %s",
+                               (_now() + datetime.timedelta(seconds=ALERT_RETRY_SECONDS), alert['Alert_ID']))
+                failed += 1
+            else:
+                cursor.execute("UPDATE stock_alerts SET Delivered_At = %s WHERE Alert_ID = %s",
+                               (_now(), alert['Alert_ID']))
+                delivered += 1
+            cnx.commit()
+    finally:
+        cursor.close()
+    return delivered, failed
+
+
+# --- dispatcher and Server-Sent Events --------------------------------------
+
+class Dispatcher:
+    """Per-worker thread that feeds new outbox rows to subscribers and sinks."""
+
+    def __init__(self, db_config, recent=100):
+        self.db_config = db_config
+        self.recent = collections.deque(maxlen=recent)
+        self._seen = {}            # Alert_ID -> Created_At, for the lookback window
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._cnx = None
+        self.pid = os.getpid()
+        threading.Thread(target=self._run, name='stock-alerts', daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def subscribe(self, last_event_id=None):
+        """Returns a queue of alerts, primed with the recent ones after `last_event_id`."""
+        subscriber = queue.Queue(maxsize=1000)
+        with self._lock:
+            replay = list(self.recent)
+            self._subscribers.add(subscriber)
+        ids = [alert['Alert_ID'] for alert in replay]
+        if last_event_id in ids:
+            replay = replay[ids.index(last_event_id) + 1:]
+        for alert in replay:
+            subscriber.put_nowait(alert)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def latest(self, limit):
+        """Returns the newest `limit` recent alerts, oldest first."""
+        with self._lock:
+            return list(self.recent)[-limit:]
+
+    def _run(self):
+        while True:
+            self._wake.wait(ALERT_POLL_SECONDS)
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception:
+                log.exception("Stock alert dispatch failed")
+                if self._cnx is not None:
+                    try:
+                        self._cnx.close()
+                    except Exception:
+                        pass
+                    self._cnx = None
+
+    def poll(self):
+        if self._cnx is None:
+            self._cnx = mysql.connector.connect(**self.db_config)
+        now = _now()
+        since = now - datetime.timedelta(seconds=ALERT_LOOKBACK_SECONDS)
+        cursor = self._cnx.cursor(dictionary=True)
+        try:
+            # The recent alerts for subscribers, plus older ones still owed to
+            # the sinks whose lease ran out (a failed or abandoned delivery).
+            cursor.execute(f"""
+                SELECT {ALERT_COLUMNS}
+                FROM stock_alerts
+                WHERE Created_At >= %s
+                   OR (Delivered_At IS NULL AND (Claimed_Until IS NULL OR Claimed_Until < %s))
+                ORDER BY Created_At, Alert_ID
+            """, (since, now))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        # End the read transaction, so the next poll sees newer commits.
+        self._cnx.commit()
+
+        new = [row for row in rows if row['Alert_ID'] not in self._seen and str(row['Created_At']) >= str(since)]
+        for row in new:
+            self._seen[row['Alert_ID']] = row['Created_At']
+        self._seen = {alert_id: created for alert_id, created in self._seen.items()
+                      if str(created) >= str(since)}
+        if new:
+            with self._lock:
+                self.recent.extend(new)
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                for row in new:
+                    try:
+                        subscriber.put_nowait(row)
+                    except queue.Full:
+                        break  # a stalled client; it catches up from `recent` on reconnect
+        deliver(self._cnx, rows)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def dispatcher(db_config):
+    """Returns this worker's dispatcher, starting it on first use (and after a fork)."""
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.pid != os.getpid():
+        with _dispatcher_lock:
+            if _dispatcher is None or _dispatcher.pid != os.getpid():
+                _dispatcher = Dispatcher(db_config)
+    return _dispatcher
+
+
+def streaming_supported(environ):
+    """True if the server runs requests on threads or greenlets, so a stream does not hold a whole worker."""
+    return bool(environ.get('wsgi.multithread'))
+
+
+def _payload(alert):
+    return {key: (str(value) if isinstance(value, datetime.datetime) else value) for key, value in alert.items()
+            if key != 'Delivered_At'}
+
+
+def sse_event(alert):
+    return f"id: {alert['Alert_ID']}\nevent: stock-alert\ndata: {json.dumps(_payload(alert))}\n\n"
+
+
+def init_app(app, db_config):
+    """Wakes the dispatcher after requests that raised alerts, serves /alerts/* and `flask alerts`."""
+
+    @app.after_request
+    def dispatch_raised_alerts(response):
+        if g.pop('stock_alerts_raised', False):
+            dispatcher(db_config).wake()
+        return response
+
+    @app.route('/alerts/stream')
+    def alerts_stream():
+        """Streams stock alerts to the dashboard as Server-Sent Events."""
+        if not enabled():
+            return Response("Stock alerts are off (STOCK_ALERTS=1).\n", status=404, mimetype='text/plain')
+        if not streaming_supported(request.environ):
+            # 204 tells EventSource not to reconnect; the dashboard polls /alerts/recent.
+            return Response(status=204)
+        feed = dispatcher(db_config)
+        subscriber = feed.subscribe(request.headers.get('Last-Event-ID'))
+
+        def events():
+            try:
+                yield "retry: 5000\n\n"
+                ends_at = time.monotonic() + ALERT_STREAM_SECONDS
+                while time.monotonic() < ends_at:
+                    try:
+                        yield sse_event(subscriber.get(timeout=15))
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+            finally:
+                feed.unsubscribe(subscriber)
+
+        return Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/alerts/recent')
+    def alerts_recent():
+        """Returns the latest stock alerts as JSON, newest last, for dashboards that cannot stream."""
+        if not enabled():
+            return Response("Stock alerts are off (STOCK_ALERTS=1).\n", status=404, mimetype='text/plain')
+        recent = dispatcher(db_config).latest(ALERT_RECENT_LIMIT)
+        return Response(json.dumps([_payload(alert) for alert in recent]), mimetype='application/json',
+                        headers={'Cache-Control': 'no-cache'})
+
+    @app.cli.group('alerts')
+    def alerts_cli():
+        """Manages reorder levels and delivers stock alerts."""
+
+    @alerts_cli.command('threshold')
+    @click.argument('product_id', type=int)
+    @click.argument('level', type=int)
+    @click.option('--warehouse', 'warehouse_id', type=int, default=0,
+                  help="Only this warehouse (default: every warehouse of the product).")
+    def threshold_command(product_id, level, warehouse_id):
+        """Sets a product's reorder level."""
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            cursor = cnx.cursor()
+            cursor.execute("""
+                INSERT INTO stock_thresholds (Product_ID, Warehouse_ID, Reorder_Level)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE Reorder_Level = VALUES(Reorder_Level)
+            """, (product_id, warehouse_id, level))
+            cnx.commit()
+            cursor.close()
+        finally:
+            cnx.close()
+        where = f"warehouse {warehouse_id}" if warehouse_id else "every warehouse"
+        click.echo(f"Reorder level of product {product_id} in {where} is {level} (workers pick it up within "
+                   f"{THRESHOLD_TTL}s).")
+
+    @alerts_cli.command('deliver')
+    def deliver_command():
+        """Hands every undelivered alert to the sinks now, e.g. after an outage."""
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            cursor = cnx.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT {ALERT_COLUMNS}
+                FROM stock_alerts
+                WHERE Delivered_At IS NULL
+                ORDER BY Created_At
+            """)
+            rows = cursor.fetchall()
+            cursor.close()
+            cnx.commit()
+            delivered, failed = deliver(cnx, rows)
+        finally:
+            cnx.close()
+        click.echo(f"{delivered} alert(s) delivered, {failed} failed (retried after {ALERT_RETRY_SECONDS}s), "
+                   f"{len(rows) - delivered - failed} being delivered by a worker.")
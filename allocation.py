@@ -0,0 +1,238 @@
+import os
+
+import click
+import mysql.connector
+
+import alerts
+
+
+# ##############################################################################
+# INVENTORY ALLOCATION
+# ##############################################################################
+#
+# Adding a line to an order reserves its quantity from warehouse_inventory, and
+# removing the line (or deleting the order) puts it back. What was taken from
+# which warehouse is recorded per line in order_allocations, so a release
+# restores exactly those shelves. Everything runs in the caller's transaction,
+# and every stock change is reported to alerts.stock_changed().
+#
+# ALLOCATION_POLICY picks the fulfilling warehouses:
+#   most_stock - the warehouse holding the most, then the next, until covered
+#   nearest    - warehouses in the customer's city first (Warehouses.Location
+#                found in Customers.Address), then by stock
+#   split      - spread over every stocking warehouse in proportion to its stock
+# An add is refused when all warehouses together hold less than the quantity.
+#
+# Concurrency: a product's stock rows are locked with SELECT ... FOR UPDATE in
+# Warehouse_ID order, and releases update them in the same order, so orders
+# competing for a hot product wait on each other instead of deadlocking. The
+# routes allocate as their last statement, so those rows stay locked only until
+# the commit.
+#
+# Allocation is opt-in: run `flask schema migrate` (0003 adds the table), then
+# set ALLOCATION_POLICY. Until then every function here is a no-op.
+
+POLICIES = ('most_stock', 'nearest', 'split')
+
+_LOCK_STOCK = """
+    SELECT Warehouse_ID, Stock
+    FROM warehouse_inventory
+    WHERE Product_ID = %s
+    ORDER BY Warehouse_ID
+    FOR UPDATE
+"""
+
+# Read without locking, before the stock rows are locked.
+_LOCATIONS = """
+    SELECT w.Warehouse_ID, w.Location, c.Address
+    FROM warehouse_inventory wi
+    JOIN Warehouses w ON wi.Warehouse_ID = w.Warehouse_ID
+    JOIN Orders o ON o.Order_ID = %s
+    JOIN Customers c ON o.Customer_ID = c.Customer_ID
+    WHERE wi.Product_ID = %s
+"""
+
+# The Stock guard is redundant while the rows are locked; it keeps a bug from
+# ever writing negative stock.
+_TAKE = """
+    UPDATE warehouse_inventory SET Stock = Stock - %s
+    WHERE Warehouse_ID = %s AND Product_ID = %s AND Stock >= %s
+"""
+
+_RESTORE = """
+    INSERT INTO warehouse_inventory (Warehouse_ID, Product_ID, Stock)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE Stock = Stock + VALUES(Stock)
+"""
+
+_RECORD = """
+    INSERT INTO order_allocations (Order_ID, Product_ID, Warehouse_ID, Quantity)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE Quantity = Quantity + VALUES(Quantity)
+"""
+
+
+class OutOfStock(Exception):
+    """Raised when the warehouses together hold less than the quantity ordered."""
+
+    def __init__(self, product_id, requested, available):
+        super().__init__(f"Only {available} of product #{product_id} in stock ({requested} requested).")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+
+
+def policy():
+    """Returns the configured policy, or None when allocation is off."""
+    return os.environ.get('ALLOCATION_POLICY', '').strip().lower() or None
+
+
+def enabled():
+    return policy() is not None
+
+
+def plan(product_id, quantity, stock, local=(), policy_name='most_stock'):
+    """Splits `quantity` over warehouses. Returns [(warehouse_id, quantity)].
+
+    `stock` is [(warehouse_id, available)] and `local` the ids of warehouses in
+    the customer's city. Raises OutOfStock if the total is short.
+    """
+    stock = [(warehouse_id, available) for warehouse_id, available in stock if available > 0]
+    total = sum(available for _, available in stock)
+    if total < quantity:
+        raise OutOfStock(product_id, quantity, total)
+
+    if policy_name == 'split':
+        # Largest remainder: floor shares first, then one more to the biggest fractions.
+        shares = {warehouse_id: quantity * available // total for warehouse_id, available in stock}
+        remainders = sorted(stock, key=lambda row: (-(quantity * row[1] % total), row[0]))
+        for warehouse_id, _ in remainders[:quantity - sum(shares.values())]:
+            shares[warehouse_id] += 1
+        return [(warehouse_id, share) for warehouse_id, share in shares.items() if share]
+
+    if policy_name == 'nearest':
+        order = sorted(stock, key=lambda row: (row[0] not in local, -row[1], row[0]))
+    else:
+        order = sorted(stock, key=lambda row: (-row[1], row[0]))
+    taken, remaining = [], quantity
+    for warehouse_id, available in order:
+        if remaining == 0:
+            break
+        take = min(available, remaining)
+        taken.append((warehouse_id, take))
+        remaining -= take
+    return taken
+
+
+def _local_warehouses(cursor, order_id, product_id):
+    cursor.execute(_LOCATIONS, (order_id, product_id))
+    return {row['Warehouse_ID'] for row in cursor.fetchall()
+            if row['Location'] and row['Address'] and row['Location'].strip().lower() in row['Address'].lower()}
+
+
+def allocate(cursor, order_id, product_id, quantity):
+    """Reserves `quantity` of a product for an order line. Raises OutOfStock."""
+    policy_name = policy()
+    if not policy_name or quantity <= 0:
+        return []
+    product_id = int(product_id)  # add_item passes the form value
+    local = _local_warehouses(cursor, order_id, product_id) if policy_name == 'nearest' else ()
+
+    cursor.execute(_LOCK_STOCK, (product_id,))
+    stock = [(row['Warehouse_ID'], row['Stock']) for row in cursor.fetchall()]
+    taken = plan(product_id, quantity, stock, local, policy_name)
+
+    cursor.executemany(_TAKE, [(take, warehouse_id, product_id, take) for warehouse_id, take in taken])
+    if cursor.rowcount != len(taken):
+        raise OutOfStock(product_id, quantity, sum(available for _, available in stock))
+    cursor.executemany(_RECORD, [(order_id, product_id, warehouse_id, take) for warehouse_id, take in taken])
+
+    before = dict(stock)
+    alerts.stock_changed(cursor, [(warehouse_id, product_id, before[warehouse_id], before[warehouse_id] - take)
+                                  for warehouse_id, take in taken])
+    return taken
+
+
+def _release(cursor, where, params):
+    cursor.execute(f"""
+        SELECT Product_ID, Warehouse_ID, Quantity
+        FROM order_allocations
+        WHERE {where}
+        ORDER BY Product_ID, Warehouse_ID
+        FOR UPDATE
+    """, params)
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+    cursor.executemany(_RESTORE, [(row['Warehouse_ID'], row['Product_ID'], row['Quantity']) for row in rows])
+    cursor.execute(f"DELETE FROM order_allocations WHERE {where}", params)
+
+    if alerts.enabled():
+        restored = {(row['Warehouse_ID'], row['Product_ID']): row['Quantity'] for row in rows}
+        keys = ", ".join(["(%s, %s)"] * len(restored))
+        cursor.execute(f"SELECT Warehouse_ID, Product_ID, Stock FROM warehouse_inventory "
+                       f"WHERE (Warehouse_ID, Product_ID) IN ({keys})", [value for key in restored for value in key])
+        alerts.stock_changed(cursor, [
+            (row['Warehouse_ID'], row['Product_ID'], row['Stock'] - restored[row['Warehouse_ID'], row['Product_ID']],
+             row['Stock']) for row in cursor.fetchall()])
+    return sum(row['Quantity'] for row in rows)
+
+
+def release(cursor, order_id, product_id):
+    """Returns a line's reserved stock to its warehouses. Returns the quantity restored."""
+    if not enabled():
+        return 0
+    return _release(cursor, "Order_ID = %s AND Product_ID = %s", (order_id, product_id))
+
+
+def release_order(cursor, order_id):
+    """Returns the reserved stock of every line of an order. Call before deleting them."""
+    if not enabled():
+        return 0
+    return _release(cursor, "Order_ID = %s", (order_id,))
+
+
+# --- checks -----------------------------------------------------------------
+
+def check(cnx):
+    """Returns a list of (problem, key, detail) for negative stock and over-allocated lines."""
+    problems = []
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SELECT Warehouse_ID, Product_ID, Stock FROM warehouse_inventory WHERE Stock < 0")
+        for warehouse_id, product_id, stock in cursor.fetchall():
+            problems.append(('negative stock', (warehouse_id, product_id), stock))
+        cursor.execute("""
+            SELECT a.Order_ID, a.Product_ID, SUM(a.Quantity), MAX(oi.Quantity)
+            FROM order_allocations a
+            LEFT JOIN order_items oi ON a.Order_ID = oi.Order_ID AND a.Product_ID = oi.Product_ID
+            GROUP BY a.Order_ID, a.Product_ID
+            HAVING MAX(oi.Quantity) IS NULL OR SUM(a.Quantity) > MAX(oi.Quantity)
+        """)
+        for order_id, product_id, allocated, ordered in cursor.fetchall():
+            problems.append(('over-allocated line', (order_id, product_id), f"{allocated} allocated, {ordered} ordered"))
+    finally:
+        cursor.close()
+    return problems
+
+
+def init_app(app, db_config):
+    """Checks ALLOCATION_POLICY and registers the `flask allocation` command group."""
+    if policy() not in (None,) + POLICIES:
+        raise ValueError(f"ALLOCATION_POLICY must be one of {', '.join(POLICIES)} (got {policy()!r})")
+
+    @app.cli.group('allocation')
+    def allocation_cli():
+        """Inspects inventory allocations."""
+
+    @allocation_cli.command('check')
+    def check_command():
+        """Lists negative stock and lines with more allocated than ordered."""
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            problems = check(cnx)
+        finally:
+            cnx.close()
+        for problem, key, detail in problems:
+            click.echo(f"{problem} {key}: {detail}")
+        click.echo(f"{len(problems)} problem(s)." if problems else "Stock and allocations are consistent.")
@@ -1,9 +1,31 @@
 import mysql.connector
+import base64
+import csv
 import datetime
+import functools
+import hashlib
+import io
+import json
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import (Flask, Response, jsonify, make_response, render_template, request, redirect, url_for, flash,
+                   send_file, session, stream_template, stream_with_context)
 from mysql.connector import errorcode
 import os
+import time
+import zlib
+
+import aggregates
+import alerts
+import allocation
+import db
+import dispatch
+import forecast
+import imports
+import profiler
+import replenishment
+import schema
+import statements
+from cache import LocalVersions, SharedVersions, TTLCache, VersionedCache
 
 app = Flask(__name__)
 
@@ -24,15 +46,40 @@ DB_CONFIG = {
     'password': os.environ.get('DB_PASSWORD'),
     'host': os.environ.get('DB_HOST'),
     'database': os.environ.get('DB_NAME'),
-    'port': int(os.environ.get('DB_PORT', 3306))  # <-- Add this line
+    'port': int(os.environ.get('DB_PORT', 3306)),  # <-- Add this line
+    # Pure-Python driver, for event-loop workers (see gunicorn.conf.py)
+    'use_pure': os.environ.get('DB_USE_PURE') == '1',
 }
 
+# Connections come from a per-worker pool (sized by the DB_POOL_* env vars) and
+# are held for the whole request, then returned on teardown. GETs of these
+# read-only pages go to the DB_REPLICA_HOSTS replicas, when configured.
+db.init_app(app, DB_CONFIG, replica_routes=(
+    'customer_list', 'product_list', 'supplier_list', 'manufacturer_list', 'warehouse_list', 'vehicle_list',
+    'order_list', 'order_detail', 'product_search', 'run_report', 'export_report', 'export_table'))
+aggregates.init_app(app, DB_CONFIG)
+# Stock reservation for order lines, when ALLOCATION_POLICY is set.
+allocation.init_app(app, DB_CONFIG)
+# Low-stock alerts from those stock changes, streamed at /alerts/stream (STOCK_ALERTS=1;
+# threads/gevent workers) or polled from /alerts/recent.
+alerts.init_app(app, DB_CONFIG)
+# `flask schema migrate` applies migrations/; `flask schema advise` checks query plans.
+schema.init_app(app, DB_CONFIG)
+# `flask forecast run` fits demand models; the demand_forecast report shows them.
+forecast.init_app(app, DB_CONFIG, on_complete=lambda *tables: invalidate_tables(*tables))
+# `flask replenish run` turns demand and stock into reorder points (reorder_recommendations report).
+replenishment.init_app(app, DB_CONFIG, on_complete=lambda *tables: invalidate_tables(*tables))
+# `flask dispatch plan` packs pending orders onto available vehicles (dispatch_plan report).
+dispatch.init_app(app, DB_CONFIG, on_complete=lambda *tables: invalidate_tables(*tables))
+# Per-statement timing, the slow-query log and /_metrics. EXPLAIN is only ever
+# captured for the report pages (PROFILE_EXPLAIN=1).
+profiler.init_app(app, DB_CONFIG, explain_routes=('run_report', 'export_report'))
+
 
 def get_db_connection():
-    """Establishes a connection to the MySQL database."""
+    """Borrows the request's pooled connection and opens a dictionary cursor on it."""
     try:
-        # This line works perfectly now because DB_CONFIG is set from env vars
-        cnx = mysql.connector.connect(**DB_CONFIG)
+        cnx = db.get_connection(DB_CONFIG)
         cursor = cnx.cursor(dictionary=True)
         return cnx, cursor
     except mysql.connector.Error as err:
@@ -47,11 +94,333 @@ def get_db_connection():
 
 
 def close_connection(cnx, cursor):
-    """Closes the database connection and cursor."""
+    """Closes the cursor. The connection goes back to the pool at request teardown."""
     if cursor:
         cursor.close()
-    if cnx:
-        cnx.close()
+
+
+# ##############################################################################
+# NAMED STATEMENTS
+# ##############################################################################
+
+# The fixed SQL of the lookup and order-line paths. Each pooled connection
+# prepares these once and reuses them across requests (see statements.py).
+STATEMENTS = {
+    'customer.get': "SELECT * FROM Customers WHERE Customer_ID = %s",
+    'product.get': "SELECT * FROM Products WHERE Product_ID = %s",
+    'supplier.get': "SELECT * FROM Suppliers WHERE Supplier_ID = %s",
+    'manufacturer.get': "SELECT * FROM Manufacturers WHERE Manufacturer_ID = %s",
+    'warehouse.get': "SELECT * FROM Warehouses WHERE Warehouse_ID = %s",
+    'vehicle.get': "SELECT * FROM Vehicles WHERE Vehicle_ID = %s",
+    # Selecting from Products both checks the product exists and makes the
+    # quantity increment atomic under concurrency.
+    'order_item.add': """
+        INSERT INTO order_items (Order_ID, Product_ID, Quantity)
+        SELECT %s, Product_ID, %s FROM Products WHERE Product_ID = %s
+        ON DUPLICATE KEY UPDATE Quantity = Quantity + VALUES(Quantity)
+    """,
+    'order_item.lock': """
+        SELECT Quantity FROM order_items
+        WHERE Order_ID = %s AND Product_ID = %s
+        FOR UPDATE
+    """,
+    'order_item.delete': "DELETE FROM order_items WHERE Order_ID = %s AND Product_ID = %s",
+    # Line changes are priced on the server: quantity delta, product, order.
+    'invoice.add_line': """
+        UPDATE Invoices
+        SET Amount = Amount + %s * (SELECT UnitPrice FROM Products WHERE Product_ID = %s)
+        WHERE Order_ID = %s
+    """,
+    'invoice.lock_for_order': "SELECT Invoice_ID, Status FROM Invoices WHERE Order_ID = %s FOR UPDATE",
+    'invoice.set_status': "UPDATE Invoices SET Status = %s WHERE Order_ID = %s",
+}
+statements.register(STATEMENTS)
+
+
+# ##############################################################################
+# LIST PAGINATION HELPERS
+# ##############################################################################
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    """Packs the sort-key values of a boundary row into an opaque URL token."""
+    raw = json.dumps(values, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Reverses encode_cursor(). Raises ValueError on a malformed token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as err:
+        raise ValueError(f"Invalid page cursor: {err}") from err
+    if not isinstance(values, list):
+        raise ValueError("Invalid page cursor")
+    return values
+
+
+def list_filters(search_column=None, **equals):
+    """Builds WHERE fragments from the request's query string.
+
+    `q` becomes a prefix match on `search_column` (so it can use the column's
+    index) and every keyword maps a query-string argument to a column that must
+    match it exactly. Empty arguments are ignored.
+    """
+    filters = []
+    q = request.args.get('q', '').strip()
+    if search_column and q:
+        escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        filters.append((f"{search_column} LIKE %s", [escaped + '%']))
+    for arg, column in equals.items():
+        value = request.args.get(arg, '').strip()
+        if value:
+            filters.append((f"{column} = %s", [value]))
+    return filters
+
+
+def _keyset_condition(order_keys, boundary, backwards):
+    """Expands (k1, k2, ...) past `boundary` into OR-ed prefix comparisons."""
+    clauses, params = [], []
+    for i, (column, _, direction) in enumerate(order_keys):
+        descending = (direction == 'DESC') != backwards
+        parts = [f"{col} = %s" for col, _, _ in order_keys[:i]]
+        parts.append(f"{column} {'<' if descending else '>'} %s")
+        clauses.append("(" + " AND ".join(parts) + ")")
+        params.extend(boundary[:i + 1])
+    return "(" + " OR ".join(clauses) + ")", params
+
+
+def keyset_page(cursor, select_sql, order_keys, filters=()):
+    """Fetches one page of a list using keyset (cursor) pagination.
+
+    `select_sql` is the SELECT ... FROM ... JOIN part of the query, without
+    WHERE or ORDER BY. `order_keys` is a list of (sql_column, row_key,
+    'ASC'|'DESC') whose last entry must be unique, e.g. the primary key. The
+    page boundary is read from the `after`/`before` query arguments, so each
+    page costs one index range scan no matter how deep into the table it is.
+    """
+    page_size = request.args.get('page_size', DEFAULT_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    after = request.args.get('after')
+    before = request.args.get('before')
+
+    where = [fragment for fragment, _ in filters]
+    params = [value for _, values in filters for value in values]
+
+    backwards = False
+    token = before or after
+    if token:
+        try:
+            boundary = decode_cursor(token)
+            if len(boundary) != len(order_keys):
+                raise ValueError("Page cursor does not match this list")
+        except ValueError as err:
+            flash(f"{err}. Showing the first page.", "warning")
+            after = before = None
+        else:
+            backwards = bool(before)
+            condition, condition_params = _keyset_condition(order_keys, boundary, backwards)
+            where.append(condition)
+            params.extend(condition_params)
+
+    order_by = []
+    for column, _, direction in order_keys:
+        if backwards:
+            direction = 'ASC' if direction == 'DESC' else 'DESC'
+        order_by.append(f"{column} {direction}")
+
+    query = select_sql
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY " + ", ".join(order_by) + " LIMIT %s"
+    cursor.execute(query, params + [page_size + 1])
+    rows = cursor.fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    def boundary_of(row):
+        return encode_cursor([row[key] for _, key, _ in order_keys])
+
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    args.pop('page_size', None)
+    if page_size != DEFAULT_PAGE_SIZE:
+        args['page_size'] = page_size
+
+    page = {'rows': rows, 'page_size': page_size, 'next_url': None, 'prev_url': None}
+    if rows and (backwards or has_more):
+        page['next_url'] = url_for(request.endpoint, after=boundary_of(rows[-1]), **args)
+    if rows and (after or (backwards and has_more)):
+        page['prev_url'] = url_for(request.endpoint, before=boundary_of(rows[0]), **args)
+    return page
+
+
+# ##############################################################################
+# TABLE VERSIONS
+# ##############################################################################
+
+# A write counter per table, bumped by invalidate_tables() after every committed
+# write; the reference-data, page and report caches key their entries on it. The
+# counters live in a memory-mapped file on local disk (REFDATA_VERSION_FILE,
+# default under the instance folder), so a write handled by one gunicorn worker
+# or `flask` command is seen by every other process on the host. Where that file
+# cannot be used (no fcntl on Windows, a read-only instance folder) the counters
+# are per process, and the page cache and 304s are switched off since other
+# workers would keep serving pages from before a write.
+REFDATA_VERSION_FILE = os.environ.get('REFDATA_VERSION_FILE', os.path.join(app.instance_path, 'table_versions'))
+try:
+    os.makedirs(os.path.dirname(REFDATA_VERSION_FILE), exist_ok=True)
+    table_versions = SharedVersions(REFDATA_VERSION_FILE)
+except (ImportError, OSError) as err:
+    app.logger.warning("Table versions are per process (%s); page caching is off.", err)
+    table_versions = LocalVersions()
+
+
+# ##############################################################################
+# REFERENCE DATA CACHE
+# ##############################################################################
+
+# Dropdown choices and product lookups are cached per worker under the version
+# of the table they come from.
+refdata_cache = VersionedCache(table_versions,
+                               ttl=int(os.environ.get('REFDATA_CACHE_TTL', 300)),
+                               max_entries=int(os.environ.get('REFDATA_CACHE_MAX_ENTRIES', 1024)),
+                               max_cost=int(os.environ.get('REFDATA_CACHE_MAX_ROWS', 200000)))
+
+
+def cached_choices(cursor, table, key_column):
+    """Returns a table's (key_column, Name) rows ordered by name, for dropdowns."""
+    def load():
+        cursor.execute(f"SELECT {key_column}, Name FROM {table} ORDER BY Name")
+        return cursor.fetchall()
+    return refdata_cache.get_or_load(table, 'choices', load)
+
+
+@app.route('/_cache/refdata')
+def refdata_cache_stats():
+    """Reports hit/miss counts and size of this worker's reference-data cache."""
+    stats = refdata_cache.stats()
+    stats['pid'] = os.getpid()
+    stats['shared_versions'] = isinstance(table_versions, SharedVersions)
+    return stats
+
+
+# ##############################################################################
+# PAGE CACHE
+# ##############################################################################
+
+# List and report pages carry an ETag built from the versions of the tables they
+# read, so a browser revalidating an unchanged page gets 304 Not Modified without
+# a query or a render. The rendered content block of each page is also kept in a
+# bounded LRU under that ETag and wrapped in base.html again (for the flash
+# messages) on a hit. PAGE_CACHE_TTL bounds how long writes made outside the app,
+# or CURDATE() moving on, can go unnoticed.
+# Only with versions shared between the workers (see TABLE VERSIONS).
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 300))
+PAGE_CACHE_ENABLED = isinstance(table_versions, SharedVersions)
+page_cache = TTLCache(max_entries=int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 512)),
+                      max_cost=int(os.environ.get('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024)))
+
+# base.html wraps the content block in these markers.
+PAGE_CONTENT_START = '<!--page-content-->'
+PAGE_CONTENT_END = '<!--/page-content-->'
+
+
+def page_etag(tables):
+    """Returns the current URL's ETag given the tables its page reads."""
+    # The TTL bucket changes every ETag at least once per PAGE_CACHE_TTL.
+    state = [table_versions.token, request.full_path, int(time.time() // PAGE_CACHE_TTL)]
+    state += [f"{table}={table_versions.get(table)}" for table in tables]
+    return hashlib.blake2b("|".join(map(str, state)).encode(), digest_size=12).hexdigest()
+
+
+def store_page_fragment(response, key, rendered_at):
+    """Caches the content block of a rendered page, once the whole body has been produced."""
+    def store(html):
+        start, end = html.find(PAGE_CONTENT_START), html.find(PAGE_CONTENT_END)
+        if start != -1 and end != -1:
+            fragment = html[start + len(PAGE_CONTENT_START):end]
+            page_cache.set(key, (fragment, rendered_at), PAGE_CACHE_TTL, cost=max(len(fragment), 1))
+
+    if not response.is_streamed:
+        store(response.get_data(as_text=True))
+        return
+
+    def capture(chunks):
+        parts, size = [], 0
+        for chunk in chunks:
+            if parts is not None:
+                parts.append(chunk.decode() if isinstance(chunk, bytes) else chunk)
+                size += len(chunk)
+                if size > page_cache.max_cost:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            store("".join(parts))
+
+    response.response = capture(response.response)
+
+
+def cached_page(tables):
+    """Adds ETag/Last-Modified validation and fragment caching to a GET page.
+
+    `tables` lists the tables the page reads, or is a function of the view's
+    arguments that returns them.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            # Pending flash messages are part of the page, so it cannot be validated.
+            if '_flashes' in session or not PAGE_CACHE_ENABLED:
+                return view(**kwargs)
+            etag = page_etag(tables(**kwargs) if callable(tables) else tables)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            key = (request.full_path, etag)
+            cached = page_cache.get(key)
+            if cached is not None:
+                fragment, rendered_at = cached
+                response = make_response(render_template('_cached_page.html', fragment=fragment))
+            else:
+                rendered_at = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+                response = make_response(view(**kwargs))
+                if response.status_code != 200 or response.mimetype != 'text/html':
+                    return response
+                if not db.served_by_primary():
+                    # A lagging replica may predate the versions in the ETag, so the
+                    # page is neither cached nor given a validator.
+                    response.cache_control.no_cache = True
+                    return response
+                store_page_fragment(response, key, rendered_at)
+            response.set_etag(etag)
+            response.last_modified = rendered_at
+            response.cache_control.no_cache = True
+            # Answers If-Modified-Since; a streamed page was rendered just now, so never matches.
+            return response.make_conditional(request) if cached is not None else response
+        return wrapper
+    return decorator
+
+
+@app.route('/_cache/pages')
+def page_cache_stats():
+    """Reports hit/miss counts and size of this worker's rendered-page cache."""
+    stats = page_cache.stats()
+    stats['pid'] = os.getpid()
+    stats['enabled'] = PAGE_CACHE_ENABLED
+    return stats
+
+
 @app.context_processor
 def inject_datetime():
     """Makes the datetime module available to all templates."""
@@ -64,7 +433,9 @@ def inject_datetime():
 @app.route('/')
 def index():
     """Renders the main dashboard page."""
-    return render_template('index.html')
+    return render_template('index.html', stock_alerts=alerts.enabled(),
+                           stock_alert_stream=alerts.streaming_supported(request.environ),
+                           stock_alert_refresh=alerts.ALERT_REFRESH_SECONDS)
 
 
 # ##############################################################################
@@ -72,16 +443,19 @@ def index():
 # ##############################################################################
 
 @app.route('/customers')
+@cached_page(('Customers',))
 def customer_list():
-    """Displays a list of all customers."""
+    """Displays one page of customers, optionally filtered by a name prefix."""
     cnx, cursor = get_db_connection()
     if cnx is None:
         return redirect(url_for('index'))
 
     try:
-        cursor.execute("SELECT * FROM Customers ORDER BY Name")
-        customers = cursor.fetchall()
-        return render_template('customer_list.html', customers=customers)
+        page = keyset_page(
+            cursor, "SELECT * FROM Customers",
+            [('Name', 'Name', 'ASC'), ('Customer_ID', 'Customer_ID', 'ASC')],
+            list_filters('Name'))
+        return render_template('customer_list.html', customers=page['rows'], page=page)
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
         return redirect(url_for('index'))
@@ -106,6 +480,7 @@ def customer_add():
             query = "INSERT INTO Customers (Customer_ID, Name, Address, Contact) VALUES (%s, %s, %s, %s)"
             cursor.execute(query, (customer_id, name, address, contact))
             cnx.commit()
+            invalidate_tables('Customers')
             flash(f"Customer '{name}' added successfully!", "success")
             return redirect(url_for('customer_list'))
         except mysql.connector.Error as err:
@@ -133,6 +508,7 @@ def customer_edit(customer_id):
             query = "UPDATE Customers SET Name = %s, Address = %s, Contact = %s WHERE Customer_ID = %s"
             cursor.execute(query, (name, address, contact, customer_id))
             cnx.commit()
+            invalidate_tables('Customers')
             flash(f"Customer '{name}' updated successfully!", "success")
             return redirect(url_for('customer_list'))
         except mysql.connector.Error as err:
@@ -141,8 +517,7 @@ def customer_edit(customer_id):
             close_connection(cnx, cursor)
 
     try:
-        cursor.execute("SELECT * FROM Customers WHERE Customer_ID = %s", (customer_id,))
-        customer = cursor.fetchone()
+        customer = statements.query_one(cnx, 'customer.get', (customer_id,))
         if not customer:
             flash("Customer not found!", "warning")
             return redirect(url_for('customer_list'))
@@ -165,6 +540,7 @@ def customer_delete(customer_id):
     try:
         cursor.execute("DELETE FROM Customers WHERE Customer_ID = %s", (customer_id,))
         cnx.commit()
+        invalidate_tables('Customers')
         flash("Customer deleted successfully!", "success")
     except mysql.connector.Error as err:
         flash(f"Error deleting customer: {err}. (Check for related orders first)", "danger")
@@ -179,8 +555,9 @@ def customer_delete(customer_id):
 # ##############################################################################
 
 @app.route('/products')
+@cached_page(('Products', 'Manufacturers'))
 def product_list():
-    """Displays a list of all products with their manufacturer name."""
+    """Displays one page of products with their manufacturer name."""
     cnx, cursor = get_db_connection()
     if cnx is None:
         return redirect(url_for('index'))
@@ -190,11 +567,12 @@ def product_list():
             SELECT p.*, m.Name as Manufacturer_Name 
             FROM Products p
             LEFT JOIN Manufacturers m ON p.Manufacturer_ID = m.Manufacturer_ID
-            ORDER BY p.Name
         """
-        cursor.execute(query)
-        products = cursor.fetchall()
-        return render_template('product_list.html', products=products)
+        page = keyset_page(
+            cursor, query,
+            [('p.Name', 'Name', 'ASC'), ('p.Product_ID', 'Product_ID', 'ASC')],
+            list_filters('p.Name', manufacturer_id='p.Manufacturer_ID'))
+        return render_template('product_list.html', products=page['rows'], page=page)
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
         return redirect(url_for('index'))
@@ -202,6 +580,44 @@ def product_list():
         close_connection(cnx, cursor)
 
 
+# Most matches returned by the product typeahead.
+PRODUCT_SEARCH_LIMIT = 20
+
+
+@app.route('/products/search')
+def product_search():
+    """Returns products whose name starts with `q`, as JSON for typeahead pickers."""
+    filters = list_filters('Name')
+    if not filters:
+        return jsonify([])
+    limit = max(1, min(request.args.get('limit', PRODUCT_SEARCH_LIMIT, type=int), PRODUCT_SEARCH_LIMIT))
+
+    cnx, cursor = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': "Database unavailable"}), 503
+
+    (condition, params), = filters
+
+    def load():
+        # A prefix range on the Name index; never scans the whole catalog.
+        cursor.execute(f"""
+            SELECT Product_ID, Name, SKU, UnitPrice
+            FROM Products
+            WHERE {condition}
+            ORDER BY Name
+            LIMIT %s
+        """, params + [limit])
+        return cursor.fetchall()
+
+    try:
+        # Hot prefixes are served from the cache until a product changes.
+        return jsonify(refdata_cache.get_or_load('Products', ('search', params[0], limit), load))
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"Database error: {err}"}), 500
+    finally:
+        close_connection(cnx, cursor)
+
+
 @app.route('/products/add', methods=['GET', 'POST'])
 def product_add():
     """Handles adding a new product."""
@@ -220,6 +636,7 @@ def product_add():
                 request.form['manufacturer_id']
             ))
             cnx.commit()
+            invalidate_tables('Products')
             flash(f"Product '{request.form['name']}' added successfully!", "success")
             return redirect(url_for('product_list'))
         except mysql.connector.Error as err:
@@ -229,8 +646,7 @@ def product_add():
             close_connection(cnx, cursor)
 
     try:
-        cursor.execute("SELECT Manufacturer_ID, Name FROM Manufacturers ORDER BY Name")
-        manufacturers = cursor.fetchall()
+        manufacturers = cached_choices(cursor, 'Manufacturers', 'Manufacturer_ID')
         return render_template('product_form.html', manufacturers=manufacturers, form_title="Add New Product")
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
@@ -240,6 +656,14 @@ def product_add():
             close_connection(cnx, cursor)
 
 
+# product_edit's reads when the manufacturer dropdown is not cached: the
+# product, then the same rows cached_choices() would load.
+PRODUCT_EDIT_QUERIES = """
+    SELECT * FROM Products WHERE Product_ID = %s;
+    SELECT Manufacturer_ID, Name FROM Manufacturers ORDER BY Name
+"""
+
+
 @app.route('/products/edit/<int:product_id>', methods=['GET', 'POST'])
 def product_edit(product_id):
     """Handles editing an existing product."""
@@ -262,6 +686,7 @@ def product_edit(product_id):
                 product_id
             ))
             cnx.commit()
+            invalidate_tables('Products')
             flash(f"Product '{request.form['name']}' updated successfully!", "success")
             return redirect(url_for('product_list'))
         except mysql.connector.Error as err:
@@ -270,15 +695,23 @@ def product_edit(product_id):
             close_connection(cnx, cursor)
 
     try:
-        cursor.execute("SELECT * FROM Products WHERE Product_ID = %s", (product_id,))
-        product = cursor.fetchone()
+        # The manufacturer dropdown is almost always a cache hit, leaving one
+        # prepared statement. On a miss both reads go in one round trip.
+        batched = {}
+
+        def load_manufacturers():
+            cursor.execute(PRODUCT_EDIT_QUERIES, (product_id,))
+            (_, batched['product']), (_, manufacturers) = cursor.fetchsets()
+            return manufacturers
+
+        manufacturers = refdata_cache.get_or_load('Manufacturers', 'choices', load_manufacturers)
+        if 'product' in batched:
+            product = batched['product'][0] if batched['product'] else None
+        else:
+            product = statements.query_one(cnx, 'product.get', (product_id,))
         if not product:
             flash("Product not found!", "warning")
             return redirect(url_for('product_list'))
-
-        cursor.execute("SELECT Manufacturer_ID, Name FROM Manufacturers ORDER BY Name")
-        manufacturers = cursor.fetchall()
-
         return render_template('product_form.html', product=product, manufacturers=manufacturers,
                                form_title="Edit Product")
     except mysql.connector.Error as err:
@@ -299,6 +732,7 @@ def product_delete(product_id):
     try:
         cursor.execute("DELETE FROM Products WHERE Product_ID = %s", (product_id,))
         cnx.commit()
+        invalidate_tables('Products')
         flash("Product deleted successfully!", "success")
     except mysql.connector.Error as err:
         flash(f"Error deleting product: {err}. (Check for related orders first)", "danger")
@@ -313,16 +747,19 @@ def product_delete(product_id):
 # ##############################################################################
 
 @app.route('/suppliers')
+@cached_page(('Suppliers',))
 def supplier_list():
-    """Displays a list of all suppliers."""
+    """Displays one page of suppliers, optionally filtered by a name prefix."""
     cnx, cursor = get_db_connection()
     if cnx is None:
         return redirect(url_for('index'))
 
     try:
-        cursor.execute("SELECT * FROM Suppliers ORDER BY Name")
-        suppliers = cursor.fetchall()
-        return render_template('supplier_list.html', suppliers=suppliers)
+        page = keyset_page(
+            cursor, "SELECT * FROM Suppliers",
+            [('Name', 'Name', 'ASC'), ('Supplier_ID', 'Supplier_ID', 'ASC')],
+            list_filters('Name'))
+        return render_template('supplier_list.html', suppliers=page['rows'], page=page)
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
         return redirect(url_for('index'))
@@ -345,6 +782,7 @@ def supplier_add():
                 request.form['address']
             ))
             cnx.commit()
+            invalidate_tables('Suppliers')
             flash(f"Supplier '{request.form['name']}' added successfully!", "success")
             return redirect(url_for('supplier_list'))
         except mysql.connector.Error as err:
@@ -372,6 +810,7 @@ def supplier_edit(supplier_id):
                 supplier_id
             ))
             cnx.commit()
+            invalidate_tables('Suppliers')
             flash(f"Supplier '{request.form['name']}' updated successfully!", "success")
             return redirect(url_for('supplier_list'))
         except mysql.connector.Error as err:
@@ -380,8 +819,7 @@ def supplier_edit(supplier_id):
             close_connection(cnx, cursor)
 
     try:
-        cursor.execute("SELECT * FROM Suppliers WHERE Supplier_ID = %s", (supplier_id,))
-        supplier = cursor.fetchone()
+        supplier = statements.query_one(cnx, 'supplier.get', (supplier_id,))
         if not supplier:
             flash("Supplier not found!", "warning")
             return redirect(url_for('supplier_list'))
@@ -402,6 +840,7 @@ def supplier_delete(supplier_id):
     try:
         cursor.execute("DELETE FROM Suppliers WHERE Supplier_ID = %s", (supplier_id,))
         cnx.commit()
+        invalidate_tables('Suppliers')
         flash("Supplier deleted successfully!", "success")
     except mysql.connector.Error as err:
         flash(f"Error deleting supplier: {err}. (Check for related manufacturers first)", "danger")
@@ -415,14 +854,17 @@ def supplier_delete(supplier_id):
 # ##############################################################################
 
 @app.route('/manufacturers')
+@cached_page(('Manufacturers',))
 def manufacturer_list():
-    """Displays a list of all manufacturers."""
+    """Displays one page of manufacturers, optionally filtered by a name prefix."""
     cnx, cursor = get_db_connection()
     if cnx is None: return redirect(url_for('index'))
     try:
-        cursor.execute("SELECT * FROM Manufacturers ORDER BY Name")
-        manufacturers = cursor.fetchall()
-        return render_template('manufacturer_list.html', manufacturers=manufacturers)
+        page = keyset_page(
+            cursor, "SELECT * FROM Manufacturers",
+            [('Name', 'Name', 'ASC'), ('Manufacturer_ID', 'Manufacturer_ID', 'ASC')],
+            list_filters('Name'))
+        return render_template('manufacturer_list.html', manufacturers=page['rows'], page=page)
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
         return redirect(url_for('index'))
@@ -445,6 +887,7 @@ def manufacturer_add():
                 request.form['address']
             ))
             cnx.commit()
+            invalidate_tables('Manufacturers')
             flash(f"Manufacturer '{request.form['name']}' added successfully!", "success")
             return redirect(url_for('manufacturer_list'))
         except mysql.connector.Error as err:
@@ -472,6 +915,7 @@ def manufacturer_edit(manufacturer_id):
                 manufacturer_id
             ))
             cnx.commit()
+            invalidate_tables('Manufacturers')
             flash(f"Manufacturer '{request.form['name']}' updated successfully!", "success")
             return redirect(url_for('manufacturer_list'))
         except mysql.connector.Error as err:
@@ -480,8 +924,7 @@ def manufacturer_edit(manufacturer_id):
             close_connection(cnx, cursor)
 
     try:
-        cursor.execute("SELECT * FROM Manufacturers WHERE Manufacturer_ID = %s", (manufacturer_id,))
-        manufacturer = cursor.fetchone()
+        manufacturer = statements.query_one(cnx, 'manufacturer.get', (manufacturer_id,))
         if not manufacturer:
             flash("Manufacturer not found!", "warning")
             return redirect(url_for('manufacturer_list'))
@@ -502,6 +945,7 @@ def manufacturer_delete(manufacturer_id):
     try:
         cursor.execute("DELETE FROM Manufacturers WHERE Manufacturer_ID = %s", (manufacturer_id,))
         cnx.commit()
+        invalidate_tables('Manufacturers')
         flash("Manufacturer deleted successfully!", "success")
     except mysql.connector.Error as err:
         flash(f"Error deleting manufacturer: {err}. (Check for related products/suppliers first)", "danger")
@@ -515,14 +959,17 @@ def manufacturer_delete(manufacturer_id):
 # ##############################################################################
 
 @app.route('/warehouses')
+@cached_page(('Warehouses',))
 def warehouse_list():
-    """Displays a list of all warehouses."""
+    """Displays one page of warehouses, optionally filtered by a name prefix."""
     cnx, cursor = get_db_connection()
     if cnx is None: return redirect(url_for('index'))
     try:
-        cursor.execute("SELECT * FROM Warehouses ORDER BY Name")
-        warehouses = cursor.fetchall()
-        return render_template('warehouse_list.html', warehouses=warehouses)
+        page = keyset_page(
+            cursor, "SELECT * FROM Warehouses",
+            [('Name', 'Name', 'ASC'), ('Warehouse_ID', 'Warehouse_ID', 'ASC')],
+            list_filters('Name'))
+        return render_template('warehouse_list.html', warehouses=page['rows'], page=page)
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
         return redirect(url_for('index'))
@@ -545,6 +992,7 @@ def warehouse_add():
                 request.form['capacity']
             ))
             cnx.commit()
+            invalidate_tables('Warehouses')
             flash(f"Warehouse '{request.form['name']}' added successfully!", "success")
             return redirect(url_for('warehouse_list'))
         except mysql.connector.Error as err:
@@ -572,6 +1020,7 @@ def warehouse_edit(warehouse_id):
                 warehouse_id
             ))
             cnx.commit()
+            invalidate_tables('Warehouses')
             flash(f"Warehouse '{request.form['name']}' updated successfully!", "success")
             return redirect(url_for('warehouse_list'))
         except mysql.connector.Error as err:
@@ -580,8 +1029,7 @@ def warehouse_edit(warehouse_id):
             close_connection(cnx, cursor)
 
     try:
-        cursor.execute("SELECT * FROM Warehouses WHERE Warehouse_ID = %s", (warehouse_id,))
-        warehouse = cursor.fetchone()
+        warehouse = statements.query_one(cnx, 'warehouse.get', (warehouse_id,))
         if not warehouse:
             flash("Warehouse not found!", "warning")
             return redirect(url_for('warehouse_list'))
@@ -602,6 +1050,7 @@ def warehouse_delete(warehouse_id):
     try:
         cursor.execute("DELETE FROM Warehouses WHERE Warehouse_ID = %s", (warehouse_id,))
         cnx.commit()
+        invalidate_tables('Warehouses')
         flash("Warehouse deleted successfully!", "success")
     except mysql.connector.Error as err:
         flash(f"Error deleting warehouse: {err}. (Check for inventory first)", "danger")
@@ -615,14 +1064,18 @@ def warehouse_delete(warehouse_id):
 # ##############################################################################
 
 @app.route('/vehicles')
+@cached_page(('Vehicles',))
 def vehicle_list():
-    """Displays a list of all vehicles."""
+    """Displays one page of vehicles, filterable by type, status and plate prefix."""
     cnx, cursor = get_db_connection()
     if cnx is None: return redirect(url_for('index'))
     try:
-        cursor.execute("SELECT * FROM Vehicles ORDER BY Type, License_Plate")
-        vehicles = cursor.fetchall()
-        return render_template('vehicle_list.html', vehicles=vehicles)
+        page = keyset_page(
+            cursor, "SELECT * FROM Vehicles",
+            [('Type', 'Type', 'ASC'), ('License_Plate', 'License_Plate', 'ASC'),
+             ('Vehicle_ID', 'Vehicle_ID', 'ASC')],
+            list_filters('License_Plate', type='Type', status='Status'))
+        return render_template('vehicle_list.html', vehicles=page['rows'], page=page)
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
         return redirect(url_for('index'))
@@ -646,6 +1099,7 @@ def vehicle_add():
                 request.form['status']
             ))
             cnx.commit()
+            invalidate_tables('Vehicles')
             flash(f"Vehicle '{request.form['license_plate']}' added successfully!", "success")
             return redirect(url_for('vehicle_list'))
         except mysql.connector.Error as err:
@@ -674,6 +1128,7 @@ def vehicle_edit(vehicle_id):
                 vehicle_id
             ))
             cnx.commit()
+            invalidate_tables('Vehicles')
             flash(f"Vehicle '{request.form['license_plate']}' updated successfully!", "success")
             return redirect(url_for('vehicle_list'))
         except mysql.connector.Error as err:
@@ -682,8 +1137,7 @@ def vehicle_edit(vehicle_id):
             close_connection(cnx, cursor)
 
     try:
-        cursor.execute("SELECT * FROM Vehicles WHERE Vehicle_ID = %s", (vehicle_id,))
-        vehicle = cursor.fetchone()
+        vehicle = statements.query_one(cnx, 'vehicle.get', (vehicle_id,))
         if not vehicle:
             flash("Vehicle not found!", "warning")
             return redirect(url_for('vehicle_list'))
@@ -704,6 +1158,7 @@ def vehicle_delete(vehicle_id):
     try:
         cursor.execute("DELETE FROM Vehicles WHERE Vehicle_ID = %s", (vehicle_id,))
         cnx.commit()
+        invalidate_tables('Vehicles')
         flash("Vehicle deleted successfully!", "success")
     except mysql.connector.Error as err:
         flash(f"Error deleting vehicle: {err}. (Check for related shipments first)", "danger")
@@ -747,6 +1202,7 @@ def order_add():
             cursor.execute(query_invoice, (invoice_id, new_order_id, 0.00, 'Pending', due_date))
 
             cnx.commit()
+            invalidate_tables('Orders', 'Invoices')
             flash("New order created. You can now add products.", "success")
             # Redirect to the detail page to add items
             return redirect(url_for('order_detail', order_id=new_order_id))
@@ -764,8 +1220,7 @@ def order_add():
         return redirect(url_for('index'))
 
     try:
-        cursor.execute("SELECT Customer_ID, Name FROM Customers ORDER BY Name")
-        customers = cursor.fetchall()
+        customers = cached_choices(cursor, 'Customers', 'Customer_ID')
         return render_template('order_form.html', customers=customers, form_title="Create New Order")
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
@@ -789,48 +1244,33 @@ def order_add_item(order_id):
             flash("Quantity must be a positive number.", "warning")
             return redirect(url_for('order_detail', order_id=order_id))
 
-        # 1. Get the product's unit price (ASSUMES UnitPrice column exists!)
-        cursor.execute("SELECT UnitPrice FROM Products WHERE Product_ID = %s", (product_id,))
-        product = cursor.fetchone()
+        def add_item(tx):
+            # 1. Upsert the line, if the product exists
+            if statements.execute(cnx, 'order_item.add', (order_id, quantity, product_id)) == 0:
+                return False
 
-        if not product:
-            flash("Product not found!", "danger")
-            return redirect(url_for('order_detail', order_id=order_id))
+            # 2. Update the Invoice Amount, pricing the line on the server
+            statements.execute(cnx, 'invoice.add_line', (quantity, product_id, order_id))
 
-        unit_price = product['UnitPrice']
-        item_total = unit_price * quantity
+            # 3. Keep the report aggregates in step, in the same transaction
+            aggregates.item_added(tx, order_id, product_id, quantity)
 
-        # 2. Add item to order_items (use ON DUPLICATE KEY UPDATE to handle adding same item)
-        query_item = """
-            INSERT INTO order_items (Order_ID, Product_ID, Quantity) 
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE Quantity = Quantity + %s
-        """
-        # Note: If updating, the invoice logic will only add the *new* quantity's price.
-        # For simplicity here, we assume a new item or simple addition.
-        # A more complex app would check if the item exists first.
-        # Let's simplify: check first.
-
-        cursor.execute("SELECT * FROM order_items WHERE Order_ID = %s AND Product_ID = %s", (order_id, product_id))
-        existing_item = cursor.fetchone()
-
-        if existing_item:
-            # Item exists, update its quantity
-            new_quantity = existing_item['Quantity'] + quantity
-            cursor.execute("UPDATE order_items SET Quantity = %s WHERE Order_ID = %s AND Product_ID = %s",
-                           (new_quantity, order_id, product_id))
-        else:
-            # New item, insert it
-            cursor.execute("INSERT INTO order_items (Order_ID, Product_ID, Quantity) VALUES (%s, %s, %s)",
-                           (order_id, product_id, quantity))
+            # 4. Reserve the stock last, so the product's inventory rows stay
+            #    locked for as little of the transaction as possible
+            allocation.allocate(tx, order_id, product_id, quantity)
+            return True
 
-        # 3. Update the Invoice Amount
-        query_invoice = "UPDATE Invoices SET Amount = Amount + %s WHERE Order_ID = %s"
-        cursor.execute(query_invoice, (item_total, order_id))
+        # Retried as a whole on deadlock/write conflict, so concurrent clerks
+        # adding to the same order never lose quantities.
+        if not db.run_in_transaction(cnx, add_item):
+            flash("Product not found!", "danger")
+            return redirect(url_for('order_detail', order_id=order_id))
 
-        cnx.commit()
+        invalidate_tables('order_items', 'Invoices', 'warehouse_inventory')
         flash(f"Item added to order. Invoice updated.", "success")
 
+    except allocation.OutOfStock as err:
+        flash(f"Item not added: {err}", "warning")
     except mysql.connector.Error as err:
         flash(f"Error adding item: {err}", "danger")
     finally:
@@ -847,34 +1287,297 @@ def order_remove_item(order_id, product_id):
         return redirect(url_for('order_list'))
 
     try:
-        # 1. Get item quantity and unit price before deleting
-        query_get = """
-            SELECT oi.Quantity, p.UnitPrice 
-            FROM order_items oi
-            JOIN Products p ON oi.Product_ID = p.Product_ID
-            WHERE oi.Order_ID = %s AND oi.Product_ID = %s
-        """
-        cursor.execute(query_get, (order_id, product_id))
-        item = cursor.fetchone()
+        def remove_item(tx):
+            # 1. Lock the line so a concurrent add cannot change its quantity
+            #    between reading it and deleting it
+            item = statements.query_one(cnx, 'order_item.lock', (order_id, product_id))
+
+            if not item:
+                return False
+
+            # 2. Delete the item
+            statements.execute(cnx, 'order_item.delete', (order_id, product_id))
 
-        if not item:
+            # 3. Update the Invoice Amount, pricing the line on the server
+            statements.execute(cnx, 'invoice.add_line', (-item['Quantity'], product_id, order_id))
+
+            # 4. Keep the report aggregates in step, in the same transaction
+            aggregates.item_removed(tx, order_id, product_id, item['Quantity'])
+
+            # 5. Put the line's reserved stock back where it came from
+            allocation.release(tx, order_id, product_id)
+            return True
+
+        if not db.run_in_transaction(cnx, remove_item):
             flash("Item not found on this order.", "warning")
             return redirect(url_for('order_detail', order_id=order_id))
 
-        # 2. Calculate amount to remove
-        total_to_remove = item['Quantity'] * item['UnitPrice']
+        invalidate_tables('order_items', 'Invoices', 'warehouse_inventory')
+        flash("Item removed from order. Invoice updated.", "success")
 
-        # 3. Delete the item
-        cursor.execute("DELETE FROM order_items WHERE Order_ID = %s AND Product_ID = %s", (order_id, product_id))
+    except mysql.connector.Error as err:
+        flash(f"Error removing item: {err}", "danger")
+    finally:
+        close_connection(cnx, cursor)
+
+    return redirect(url_for('order_detail', order_id=order_id))
+
+
+# Upper bound on lines per bulk request, to keep one transaction's locks short.
+BULK_ITEMS_MAX_LINES = int(os.environ.get('BULK_ITEMS_MAX_LINES', 5000))
 
-        # 4. Update the Invoice Amount
-        cursor.execute("UPDATE Invoices SET Amount = Amount - %s WHERE Order_ID = %s", (total_to_remove, order_id))
+
+def parse_bulk_lines():
+    """Reads order lines from a JSON or CSV request body.
+
+    JSON may be a list of lines or {"lines": [...]}; CSV needs a header row.
+    Each line has product_id, quantity and an optional action ('add' or
+    'remove', default 'add'). Raises ValueError if the body is unreadable.
+    """
+    if request.mimetype == 'text/csv':
+        return list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('lines')
+    if not isinstance(payload, list):
+        raise ValueError("Expected a JSON list of lines, {\"lines\": [...]}, or a text/csv body")
+    return payload
+
+
+def _bulk_int(value, field):
+    """Parses an integer from a JSON number or CSV text; raises ValueError for anything else."""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{field} must be an integer")
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            pass
+    raise ValueError(f"{field} must be an integer")
+
+
+def validate_bulk_line(raw):
+    """Normalizes one bulk line to (action, product_id, quantity); raises ValueError."""
+    if not isinstance(raw, dict):
+        raise ValueError("line must be an object")
+    action = raw.get('action', 'add')
+    if not isinstance(action, str) or action.strip().lower() not in ('add', 'remove'):
+        raise ValueError(f"action must be 'add' or 'remove' (got {action!r})")
+    action = action.strip().lower()
+    product_id = _bulk_int(raw.get('product_id'), 'product_id')
+    if action == 'remove':
+        return action, product_id, None
+    quantity = _bulk_int(raw.get('quantity'), 'quantity')
+    if quantity <= 0:
+        raise ValueError("quantity must be a positive number")
+    return action, product_id, quantity
+
+
+@app.route('/orders/<int:order_id>/items/bulk', methods=['POST'])
+def order_bulk_items(order_id):
+    """Adds and removes many order lines in one transaction and reports on each line.
+
+    Removes are applied before adds, so removing and re-adding a product in one
+    request replaces its line. With ?all_or_nothing=1 any rejected line aborts
+    the whole request.
+    """
+    try:
+        raw_lines = parse_bulk_lines()
+    except (ValueError, csv.Error) as err:
+        return jsonify(error=str(err)), 400
+    if len(raw_lines) > BULK_ITEMS_MAX_LINES:
+        return jsonify(error=f"At most {BULK_ITEMS_MAX_LINES} lines per request"), 413
+    all_or_nothing = request.args.get('all_or_nothing') == '1'
+
+    parsed = []
+    for number, raw in enumerate(raw_lines, start=1):
+        try:
+            parsed.append((number, validate_bulk_line(raw), None))
+        except ValueError as err:
+            parsed.append((number, None, str(err)))
+    product_ids = sorted({line[1] for _, line, _ in parsed if line})
+
+    cnx, cursor = get_db_connection()
+    if cnx is None:
+        return jsonify(error="Database unavailable"), 503
+
+    def apply_lines(tx):
+        # Results are rebuilt on every attempt, since a deadlock retry starts over.
+        results = []
+        for number, line, error in parsed:
+            if line:
+                action, product_id, quantity = line
+                results.append({'line': number, 'action': action, 'product_id': product_id,
+                                'quantity': quantity})
+            else:
+                results.append({'line': number, 'status': 'rejected', 'error': error})
+
+        # 1. Check the order exists and lock its invoices for the Amount update
+        tx.execute("""
+            SELECT o.Customer_ID, i.Status
+            FROM Orders o
+            LEFT JOIN Invoices i ON o.Order_ID = i.Order_ID
+            WHERE o.Order_ID = %s
+            FOR UPDATE
+        """, (order_id,))
+        invoices = tx.fetchall()
+        if not invoices:
+            return None
+
+        # 2. Validate every product and read its price in one IN (...) query.
+        #    The rows are locked (in id order, like the inventory rows below) so
+        #    the prices the invoice and aggregates are charged at cannot change
+        #    before this commits.
+        prices, current = {}, {}
+        if product_ids:
+            placeholders = ", ".join(["%s"] * len(product_ids))
+            tx.execute(f"""
+                SELECT Product_ID, UnitPrice FROM Products
+                WHERE Product_ID IN ({placeholders})
+                ORDER BY Product_ID
+                FOR UPDATE
+            """, product_ids)
+            prices = {row['Product_ID']: row['UnitPrice'] for row in tx.fetchall()}
+
+            # 3. Lock the order's existing lines for these products
+            tx.execute(f"""
+                SELECT Product_ID, Quantity FROM order_items
+                WHERE Order_ID = %s AND Product_ID IN ({placeholders})
+                FOR UPDATE
+            """, [order_id] + product_ids)
+            current = {row['Product_ID']: row['Quantity'] for row in tx.fetchall()}
+
+        removes, removes_line, adds = {}, {}, {}
+        for result in results:
+            if 'status' in result:
+                continue
+            product_id = result['product_id']
+            if product_id not in prices:
+                result.update(status='rejected', error="product not found")
+            elif result['action'] == 'remove':
+                if product_id in removes:
+                    result.update(status='rejected',
+                                  error=f"duplicate line: product already removed on line {removes_line[product_id]}")
+                elif product_id in current:
+                    removes[product_id], removes_line[product_id] = current[product_id], result['line']
+                    result.update(status='removed', quantity=current[product_id])
+                else:
+                    result.update(status='rejected', error="product is not on this order")
+            else:
+                adds[product_id] = adds.get(product_id, 0) + result['quantity']
+                result['status'] = 'added'
+
+        if all_or_nothing and any(r['status'] == 'rejected' for r in results):
+            for result in results:
+                if result['status'] != 'rejected':
+                    result['status'] = 'skipped'
+            return results, 0
+
+        # 4. Release the removed lines' stock and reserve the added quantities,
+        #    product by product in id order so concurrent requests lock inventory
+        #    rows in the same order. A short product rejects its lines.
+        for product_id in sorted(removes):
+            allocation.release(tx, order_id, product_id)
+        for product_id in sorted(adds):
+            try:
+                allocation.allocate(tx, order_id, product_id, adds[product_id])
+            except allocation.OutOfStock as err:
+                if all_or_nothing:
+                    raise
+                del adds[product_id]
+                for result in results:
+                    if result.get('product_id') == product_id and result['status'] == 'added':
+                        result.update(status='rejected', error=str(err))
+
+        # 5. Apply all removes with one DELETE and all adds with one batched upsert
+        if removes:
+            placeholders = ", ".join(["%s"] * len(removes))
+            tx.execute(f"DELETE FROM order_items WHERE Order_ID = %s AND Product_ID IN ({placeholders})",
+                       [order_id] + list(removes))
+        if adds:
+            tx.executemany("""
+                INSERT INTO order_items (Order_ID, Product_ID, Quantity)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE Quantity = Quantity + VALUES(Quantity)
+            """, [(order_id, product_id, quantity) for product_id, quantity in adds.items()])
+
+        # 6. Update the Invoice Amount once for the whole batch
+        changes = [(p, -q, -q * prices[p]) for p, q in removes.items()]
+        changes += [(p, q, q * prices[p]) for p, q in adds.items()]
+        invoice_delta = sum(amount for _, _, amount in changes)
+        if changes:
+            tx.execute("UPDATE Invoices SET Amount = Amount + %s WHERE Order_ID = %s", (invoice_delta, order_id))
+
+        # 7. Keep the report aggregates in step, in the same transaction
+        paid_invoices = sum(1 for row in invoices if row['Status'] == 'Paid')
+        aggregates.items_changed(tx, order_id, invoices[0]['Customer_ID'], changes, paid_invoices)
+        return results, invoice_delta
+
+    try:
+        outcome = db.run_in_transaction(cnx, apply_lines)
+    except allocation.OutOfStock as err:
+        return jsonify(error=f"Nothing applied: {err}"), 409
+    except mysql.connector.Error as err:
+        return jsonify(error=f"Error applying lines: {err}"), 500
+    finally:
+        close_connection(cnx, cursor)
+
+    if outcome is None:
+        return jsonify(error=f"Order #{order_id} not found"), 404
+
+    results, invoice_delta = outcome
+    applied = sum(1 for r in results if r['status'] in ('added', 'removed'))
+    if applied:
+        invalidate_tables('order_items', 'Invoices', 'warehouse_inventory')
+
+    body = {
+        'order_id': order_id,
+        'applied': applied,
+        'rejected': sum(1 for r in results if r['status'] == 'rejected'),
+        'invoice_delta': str(invoice_delta),
+        'lines': results,
+    }
+    return jsonify(body), (200 if applied or not results else 422)
+
+
+INVOICE_STATUSES = ('Pending', 'Paid', 'Cancelled')
+
+
+@app.route('/orders/<int:order_id>/invoice_status', methods=['POST'])
+def order_invoice_status(order_id):
+    """Changes the status of an order's invoice (e.g. marks it Paid)."""
+    new_status = request.form.get('status')
+    if new_status not in INVOICE_STATUSES:
+        flash("Unknown invoice status.", "warning")
+        return redirect(url_for('order_detail', order_id=order_id))
+
+    cnx, cursor = get_db_connection()
+    if cnx is None:
+        return redirect(url_for('order_list'))
+
+    try:
+        # 1. Lock the invoice so the aggregate delta matches the status we replace
+        invoices = statements.query(cnx, 'invoice.lock_for_order', (order_id,))
+
+        if not invoices:
+            flash("This order has no invoice.", "warning")
+            return redirect(url_for('order_detail', order_id=order_id))
+
+        # 2. Move each invoice's amount into or out of the customer's paid total
+        for invoice in invoices:
+            aggregates.invoice_status_changed(cursor, invoice['Invoice_ID'], invoice['Status'], new_status)
+
+        # 3. Update the status
+        statements.execute(cnx, 'invoice.set_status', (new_status, order_id))
 
         cnx.commit()
-        flash("Item removed from order. Invoice updated.", "success")
+        invalidate_tables('Invoices')
+        flash(f"Invoice marked as {new_status}.", "success")
 
     except mysql.connector.Error as err:
-        flash(f"Error removing item: {err}", "danger")
+        flash(f"Error updating invoice: {err}", "danger")
     finally:
         close_connection(cnx, cursor)
 
@@ -892,6 +1595,12 @@ def order_delete(order_id):
         # We must delete from "child" tables first to avoid foreign key errors.
         # These tables all have an Order_ID that references the Orders table.
 
+        # 0. Take the order's lines and paid invoices out of the report aggregates
+        aggregates.order_deleted(cursor, order_id)
+
+        # 0b. Return the stock its lines had reserved
+        allocation.release_order(cursor, order_id)
+
         # 1. Delete from order_items
         cursor.execute("DELETE FROM order_items WHERE Order_ID = %s", (order_id,))
 
@@ -906,6 +1615,7 @@ def order_delete(order_id):
 
         # If all deletes succeed, commit the transaction
         cnx.commit()
+        invalidate_tables('order_items', 'Invoices', 'Shipments', 'Orders', 'warehouse_inventory')
         flash(f"Order #{order_id} and all related records deleted successfully!", "success")
 
     except mysql.connector.Error as err:
@@ -917,8 +1627,9 @@ def order_delete(order_id):
     return redirect(url_for('order_list'))
 
 @app.route('/orders')
+@cached_page(('Orders', 'Customers', 'Invoices'))
 def order_list():
-    """Displays a list of all orders with customer and invoice info."""
+    """Displays one page of orders (newest first) with customer and invoice info."""
     cnx, cursor = get_db_connection()
     if cnx is None:
         return redirect(url_for('index'))
@@ -930,11 +1641,13 @@ def order_list():
             FROM Orders o
             LEFT JOIN Customers c ON o.Customer_ID = c.Customer_ID
             LEFT JOIN Invoices i ON o.Order_ID = i.Order_ID
-            ORDER BY o.Date DESC
         """
-        cursor.execute(query)
-        orders = cursor.fetchall()
-        return render_template('order_list.html', orders=orders)
+        page = keyset_page(
+            cursor, query,
+            [('o.Date', 'Date', 'DESC'), ('o.Order_ID', 'Order_ID', 'DESC')],
+            list_filters('c.Name', status='o.Status', invoice_status='i.Status',
+                         customer_id='o.Customer_ID'))
+        return render_template('order_list.html', orders=page['rows'], page=page)
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
         return redirect(url_for('index'))
@@ -942,6 +1655,37 @@ def order_list():
         close_connection(cnx, cursor)
 
 
+# The order page's three reads, sent as one multi-statement round trip. Each
+# statement takes the order id once.
+ORDER_DETAIL_QUERIES = """
+    SELECT o.*, c.Name as Customer_Name, c.Address as Customer_Address, c.Contact as Customer_Contact,
+           i.Invoice_ID, i.Amount, i.Due_Date, i.Status as Invoice_Status
+    FROM Orders o
+    LEFT JOIN Customers c ON o.Customer_ID = c.Customer_ID
+    LEFT JOIN Invoices i ON o.Order_ID = i.Order_ID
+    WHERE o.Order_ID = %s;
+
+    SELECT oi.Quantity, p.Product_ID, p.Name, p.SKU
+    FROM order_items oi
+    JOIN Products p ON oi.Product_ID = p.Product_ID
+    WHERE oi.Order_ID = %s;
+
+    SELECT s.*, v.Type as Vehicle_Type, v.License_Plate
+    FROM Shipments s
+    LEFT JOIN Vehicles v ON s.Vehicle_ID = v.Vehicle_ID
+    WHERE s.Order_ID = %s
+"""
+
+# With allocation on, a fourth statement lists which warehouses fill each line.
+ORDER_ALLOCATIONS_QUERY = """;
+    SELECT a.Product_ID, w.Name AS Warehouse_Name, a.Quantity
+    FROM order_allocations a
+    JOIN Warehouses w ON a.Warehouse_ID = w.Warehouse_ID
+    WHERE a.Order_ID = %s
+    ORDER BY a.Product_ID, w.Name
+"""
+
+
 @app.route('/orders/<int:order_id>')
 def order_detail(order_id):
     """Shows the full details for a single order."""
@@ -950,60 +1694,25 @@ def order_detail(order_id):
         return redirect(url_for('order_list'))
 
     try:
-        data = {}
-
-        # 1. Get Order, Customer, and Invoice Info
-        # (This query is unchanged)
-        query_order = """
-            SELECT o.*, c.Name as Customer_Name, c.Address as Customer_Address, c.Contact as Customer_Contact,
-                   i.Invoice_ID, i.Amount, i.Due_Date, i.Status as Invoice_Status
-            FROM Orders o
-            LEFT JOIN Customers c ON o.Customer_ID = c.Customer_ID
-            LEFT JOIN Invoices i ON o.Order_ID = i.Order_ID
-            WHERE o.Order_ID = %s
-        """
-        cursor.execute(query_order, (order_id,))
-        data['order'] = cursor.fetchone()
-
-        if not data['order']:
+        # 1. Order/customer/invoice, items and shipments in one round trip.
+        #    The "Add Item" picker looks products up through product_search.
+        if allocation.enabled():
+            cursor.execute(ORDER_DETAIL_QUERIES + ORDER_ALLOCATIONS_QUERY, (order_id,) * 4)
+            (_, order), (_, items), (_, shipments), (_, allocated) = cursor.fetchsets()
+        else:
+            cursor.execute(ORDER_DETAIL_QUERIES, (order_id, order_id, order_id))
+            (_, order), (_, items), (_, shipments) = cursor.fetchsets()
+            allocated = []
+        allocations = {}
+        for row in allocated:
+            allocations.setdefault(row['Product_ID'], []).append(row)
+
+        if not order:
             flash("Order not found!", "warning")
             return redirect(url_for('order_list'))
 
-        # 2. Get Order Items (Products in the order)
-        # (This query is unchanged)
-        query_items = """
-            SELECT oi.Quantity, p.Product_ID, p.Name, p.SKU
-            FROM order_items oi
-            JOIN Products p ON oi.Product_ID = p.Product_ID
-            WHERE oi.Order_ID = %s
-        """
-        cursor.execute(query_items, (order_id,))
-        data['items'] = cursor.fetchall()
-
-        # 3. Get Shipment Info
-        # (This query is unchanged)
-        query_shipment = """
-            SELECT s.*, v.Type as Vehicle_Type, v.License_Plate
-            FROM Shipments s
-            LEFT JOIN Vehicles v ON s.Vehicle_ID = v.Vehicle_ID
-            WHERE s.Order_ID = %s
-        """
-        cursor.execute(query_shipment, (order_id,))
-        data['shipments'] = cursor.fetchall()
-
-        # 4. --- !! NEW !! ---
-        # Get all products for the "Add Item" dropdown
-        # (Assumes Products.UnitPrice exists!)
-        query_all_products = """
-            SELECT Product_ID, Name, UnitPrice 
-            FROM Products 
-            ORDER BY Name
-        """
-        cursor.execute(query_all_products)
-        data['all_products'] = cursor.fetchall()
-        # --- END NEW ---
-
-        return render_template('order_detail.html', **data)
+        return render_template('order_detail.html', order=order[0], items=items, shipments=shipments,
+                               allocations=allocations)
 
     except mysql.connector.Error as err:
         flash(f"Database error: {err}", "danger")
@@ -1015,167 +1724,625 @@ def order_detail(order_id):
 # ADVANCED REPORTS ROUTES
 # ##############################################################################
 
+# Report ids, titles and SQL from the presentation, ordered as on the reports page.
+# 'aggregate_query' is used instead of 'query' when the incremental aggregate
+# tables are enabled (see aggregates.py). 'tables' lists every base table a
+# report's result depends on, so writes to them can invalidate its cached
+# result; 'ttl' (seconds) bounds staleness from writes made elsewhere and
+# from CURDATE() moving on.
+REPORTS = {
+    'top_customers': {
+        'title': "Top 5 Customers by Purchase Value",
+        'query': """
+            SELECT c.Name, SUM(i.Amount) AS total_spent
+            FROM Customers c
+            JOIN Orders o ON c.Customer_ID = o.Customer_ID
+            JOIN Invoices i ON o.Order_ID = i.Order_ID
+            WHERE i.Status = 'Paid'
+            GROUP BY c.Name
+            ORDER BY total_spent DESC
+            LIMIT 5
+        """,
+        'aggregate_query': """
+            SELECT c.Name, SUM(t.Total_Paid) AS total_spent
+            FROM customer_paid_totals t
+            JOIN Customers c ON t.Customer_ID = c.Customer_ID
+            WHERE t.Total_Paid <> 0
+            GROUP BY c.Name
+            ORDER BY total_spent DESC
+            LIMIT 5
+        """,
+        'tables': ('Customers', 'Orders', 'Invoices'),
+        'ttl': 900,
+    },
+    'low_stock': {
+        'title': "Low-Stock Products (Stock < 100)",
+        'query': """
+            SELECT p.Name, w.Name as warehouse_name, wi.Stock
+            FROM warehouse_inventory wi
+            JOIN Products p ON wi.Product_ID = p.Product_ID
+            JOIN Warehouses w ON wi.Warehouse_ID = w.Warehouse_ID
+            WHERE wi.Stock < 100
+            ORDER BY wi.Stock ASC
+        """,
+        'tables': ('warehouse_inventory', 'Products', 'Warehouses'),
+        'ttl': 300,
+    },
+    'delayed_shipments': {
+        'title': "Delayed Shipments (En Route past Arrival Date)",
+        'query': """
+            SELECT s.Shipment_ID, o.Order_ID, s.Destination, s.Departure_Date, s.Arrival_Date
+            FROM Shipments s
+            JOIN Orders o ON s.Order_ID = o.Order_ID
+            WHERE s.Status = 'En Route' AND s.Arrival_Date < CURDATE()
+        """,
+        'tables': ('Shipments', 'Orders'),
+        'ttl': 300,
+    },
+    'warehouse_revenue': {
+        'title': "Total Paid Revenue Per Warehouse",
+        # Each paid order's amount is split across its lines by line value, and
+        # each product's revenue across the warehouses stocking it by share of
+        # stock. Aggregating per order and per product before joining keeps every
+        # invoice counted once instead of once per line per stocking warehouse.
+        'query': """
+            SELECT w.Name AS warehouse_name, ROUND(SUM(pr.Revenue * wi.Stock / ps.Total_Stock), 2) AS total_revenue
+            FROM (
+                SELECT lv.Product_ID, SUM(po.Paid_Amount * lv.Line_Value / ov.Order_Value) AS Revenue
+                FROM (
+                    SELECT i.Order_ID, SUM(i.Amount) AS Paid_Amount
+                    FROM Invoices i
+                    JOIN Orders o ON i.Order_ID = o.Order_ID
+                    WHERE i.Status = 'Paid'
+                    GROUP BY i.Order_ID
+                ) po
+                JOIN (
+                    SELECT oi.Order_ID, oi.Product_ID, oi.Quantity * p.UnitPrice AS Line_Value
+                    FROM order_items oi
+                    JOIN Products p ON oi.Product_ID = p.Product_ID
+                ) lv ON po.Order_ID = lv.Order_ID
+                JOIN (
+                    SELECT oi.Order_ID, SUM(oi.Quantity * p.UnitPrice) AS Order_Value
+                    FROM order_items oi
+                    JOIN Products p ON oi.Product_ID = p.Product_ID
+                    GROUP BY oi.Order_ID
+                ) ov ON po.Order_ID = ov.Order_ID
+                WHERE ov.Order_Value > 0
+                GROUP BY lv.Product_ID
+            ) pr
+            JOIN (
+                SELECT Product_ID, SUM(Stock) AS Total_Stock
+                FROM warehouse_inventory
+                GROUP BY Product_ID
+                HAVING SUM(Stock) > 0
+            ) ps ON pr.Product_ID = ps.Product_ID
+            JOIN warehouse_inventory wi ON pr.Product_ID = wi.Product_ID
+            JOIN Warehouses w ON wi.Warehouse_ID = w.Warehouse_ID
+            GROUP BY w.Name
+            ORDER BY total_revenue DESC
+        """,
+        'aggregate_query': """
+            SELECT w.Name AS warehouse_name, ROUND(SUM(pr.Revenue * wi.Stock / ps.Total_Stock), 2) AS total_revenue
+            FROM product_paid_revenue pr
+            JOIN (
+                SELECT Product_ID, SUM(Stock) AS Total_Stock
+                FROM warehouse_inventory
+                GROUP BY Product_ID
+                HAVING SUM(Stock) > 0
+            ) ps ON pr.Product_ID = ps.Product_ID
+            JOIN warehouse_inventory wi ON pr.Product_ID = wi.Product_ID
+            JOIN Warehouses w ON wi.Warehouse_ID = w.Warehouse_ID
+            WHERE pr.Revenue <> 0
+            GROUP BY w.Name
+            ORDER BY total_revenue DESC
+        """,
+        'tables': ('Invoices', 'Orders', 'order_items', 'Products', 'warehouse_inventory', 'Warehouses'),
+        'ttl': 900,
+    },
+    'overdue_invoices': {
+        'title': "Overdue Pending Invoices",
+        'query': """
+            SELECT Invoice_ID, Order_ID, Amount, Due_Date
+            FROM Invoices
+            WHERE Status = 'Pending' AND Due_Date < CURDATE()
+            ORDER BY Due_Date ASC
+        """,
+        'tables': ('Invoices',),
+        'ttl': 300,
+    },
+    'demand_forecast': {
+        'title': "Demand Forecast (Top 100 Products, from `flask forecast run`)",
+        'query': """
+            SELECT p.Name, p.SKU, f.Model, f.Frequency, f.Next_Period, f.Horizon_Total, f.Backtest_MAE,
+                   f.History_Total, f.Generated_At
+            FROM demand_forecast_summary f
+            JOIN Products p ON f.Product_ID = p.Product_ID
+            ORDER BY f.Horizon_Total DESC
+            LIMIT 100
+        """,
+        'tables': ('demand_forecast_summary', 'Products'),
+        'ttl': 900,
+    },
+    'reorder_recommendations': {
+        'title': "Reorder Recommendations (Top 200, from `flask replenish run`)",
+        'query': """
+            SELECT w.Name AS warehouse_name, p.Name, p.SKU, r.Stock, r.Daily_Demand, r.Safety_Stock,
+                   r.Reorder_Point, r.Order_Up_To, r.Recommended_Qty, r.Computed_At
+            FROM reorder_points r
+            JOIN Products p ON r.Product_ID = p.Product_ID
+            JOIN Warehouses w ON r.Warehouse_ID = w.Warehouse_ID
+            WHERE r.Recommended_Qty > 0
+            ORDER BY r.Recommended_Qty DESC
+            LIMIT 200
+        """,
+        'tables': ('reorder_points', 'Products', 'Warehouses'),
+        'ttl': 900,
+    },
+    'product_suppliers': {
+        'title': "All Products and Their Suppliers",
+        'query': """
+            SELECT p.Name AS product_name, m.Name AS manufacturer_name, s.Name AS supplier_name
+            FROM Products p
+            JOIN Manufacturers m ON p.Manufacturer_ID = m.Manufacturer_ID
+            JOIN manufacturer_suppliers ms ON m.Manufacturer_ID = ms.Manufacturer_ID
+            JOIN Suppliers s ON ms.Supplier_ID = s.Supplier_ID
+            ORDER BY p.Name
+        """,
+        'tables': ('Products', 'Manufacturers', 'manufacturer_suppliers', 'Suppliers'),
+        'ttl': 900,
+    },
+    'vehicle_usage': {
+        'title': "Vehicle Shipment Frequency",
+        'query': """
+            SELECT v.Vehicle_ID, v.Type, v.License_Plate, COUNT(s.Shipment_ID) AS number_of_shipments
+            FROM Vehicles v
+            LEFT JOIN Shipments s ON v.Vehicle_ID = s.Vehicle_ID
+            GROUP BY v.Vehicle_ID, v.Type, v.License_Plate
+            ORDER BY number_of_shipments DESC
+        """,
+        'tables': ('Vehicles', 'Shipments'),
+        'ttl': 900,
+    },
+    'dispatch_plan': {
+        'title': "Dispatch Plan (Pending Shipments by Vehicle, from `flask dispatch plan`)",
+        'query': """
+            SELECT s.Departure_Date, v.License_Plate, v.Type, s.Destination, COUNT(DISTINCT s.Order_ID) AS orders,
+                   SUM(oi.Quantity) AS load_units, v.Capacity,
+                   ROUND(100 * SUM(oi.Quantity) / v.Capacity, 1) AS utilization_pct
+            FROM Shipments s
+            JOIN Vehicles v ON s.Vehicle_ID = v.Vehicle_ID
+            JOIN order_items oi ON s.Order_ID = oi.Order_ID
+            WHERE s.Status = 'Pending'
+            GROUP BY s.Departure_Date, v.Vehicle_ID, v.License_Plate, v.Type, s.Destination, v.Capacity
+            ORDER BY s.Departure_Date DESC, v.License_Plate
+            LIMIT 200
+        """,
+        'tables': ('Shipments', 'Vehicles', 'order_items'),
+        'ttl': 300,
+    },
+    'popular_products': {
+        'title': "Most Popular Products (by Quantity Ordered)",
+        'query': """
+            SELECT p.Name, SUM(oi.Quantity) AS total_quantity_ordered
+            FROM order_items oi
+            JOIN Products p ON oi.Product_ID = p.Product_ID
+            GROUP BY p.Name
+            ORDER BY total_quantity_ordered DESC
+        """,
+        'aggregate_query': """
+            SELECT p.Name, SUM(t.Total_Quantity) AS total_quantity_ordered
+            FROM product_order_totals t
+            JOIN Products p ON t.Product_ID = p.Product_ID
+            WHERE t.Total_Quantity <> 0
+            GROUP BY p.Name
+            ORDER BY total_quantity_ordered DESC
+        """,
+        'tables': ('order_items', 'Products'),
+        'ttl': 900,
+    },
+    'avg_ship_duration': {
+        'title': "Average Shipment Duration",
+        'query': """
+            SELECT AVG(DATEDIFF(Arrival_Date, Departure_Date)) AS average_shipping_days
+            FROM Shipments
+            WHERE Arrival_Date IS NOT NULL AND Departure_Date IS NOT NULL
+        """,
+        'tables': ('Shipments',),
+        'ttl': 900,
+    },
+    'manufacturer_products': {
+        'title': "Product Count by Manufacturer",
+        'query': """
+            SELECT m.Name, COUNT(p.Product_ID) AS number_of_products
+            FROM Manufacturers m
+            JOIN Products p ON m.Manufacturer_ID = p.Manufacturer_ID
+            GROUP BY m.Name
+            ORDER BY number_of_products DESC
+        """,
+        'tables': ('Manufacturers', 'Products'),
+        'ttl': 900,
+    },
+}
+
+# Rows pulled from the server per round trip while streaming a report.
+REPORT_BATCH_SIZE = 500
+
+# Report results are cached per worker under the versions of the tables they
+# read (see report_key()), so a write recorded by invalidate_tables() in any
+# process (a request, or a `flask forecast/replenish/dispatch` run) stales them
+# in every worker. Without shared table versions that only holds within the
+# writing process, and other workers refresh when the report's ttl runs out.
+# Results larger than REPORT_CACHE_MAX_ROWS are streamed without being cached,
+# and the cache as a whole holds at most REPORT_CACHE_TOTAL_ROWS rows, evicting
+# the least recently used reports (and superseded versions) first.
+REPORT_CACHE_MAX_ROWS = int(os.environ.get('REPORT_CACHE_MAX_ROWS', 10000))
+report_cache = TTLCache(max_entries=2 * len(REPORTS),
+                        max_cost=int(os.environ.get('REPORT_CACHE_TOTAL_ROWS', 50000)))
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def execute_report(cursor, report_name):
+    """Runs a report's query on an unbuffered cursor and returns its column names.
+
+    Rows are left on the server so they can be pulled in batches by
+    iter_report_rows() instead of being materialized with fetchall().
+    """
+    report = REPORTS[report_name]
+    if aggregates.enabled() and 'aggregate_query' in report:
+        cursor.execute(report['aggregate_query'])
+    else:
+        cursor.execute(report['query'])
+    return [column[0] for column in cursor.description or []]
+
+
+def iter_report_rows(cursor, report_name):
+    """Yields a report's rows in fetchmany() batches, then closes the cursor."""
+    try:
+        while True:
+            batch = cursor.fetchmany(REPORT_BATCH_SIZE)
+            if not batch:
+                break
+            for row in batch:
+                # Special case for AVG
+                if report_name == 'avg_ship_duration' and row['average_shipping_days'] is not None:
+                    row = {'average_shipping_days': f"{float(row['average_shipping_days']):.2f} days"}
+                yield row
+    finally:
+        cursor.close()
+
+
+def report_key(report_name):
+    """Returns a report's cache key: its name and the versions of the tables it reads."""
+    versions = tuple(table_versions.get(table) for table in REPORTS[report_name]['tables'])
+    return report_name, table_versions.token, versions
+
+
+def stream_report(cursor, report_name, report_headers, key, cacheable=True):
+    """Streams a report's rows and caches the complete result if it is small enough."""
+    cached = [] if cacheable else None
+    try:
+        for row in iter_report_rows(cursor, report_name):
+            if cached is not None:
+                cached.append(row)
+                if len(cached) > REPORT_CACHE_MAX_ROWS:
+                    cached = None
+            yield row
+    except mysql.connector.Error:
+        # Headers are already sent, so the best we can do is log and end the stream.
+        app.logger.exception("Database error while streaming report %s", report_name)
+        return
+    if cached is not None:
+        report_cache.set(key, (report_headers, cached), ttl=REPORTS[report_name]['ttl'], cost=max(len(cached), 1))
+
+
+def open_report(report_name):
+    """Returns (headers, rows) for a report, served from the cache when possible.
+
+    On a miss the query is executed and the rows are streamed from the server.
+    Returns None if no database connection could be made; query errors raise
+    mysql.connector.Error.
+    """
+    # Read before the query runs, so rows from before a write that lands
+    # mid-query are stored under the superseded versions and never served.
+    key = report_key(report_name)
+    cached = report_cache.get(key)
+    if cached is not None:
+        report_headers, rows = cached
+        return report_headers, iter(rows)
+
+    cnx, cursor = get_db_connection()
+    if cnx is None:
+        return None
+    try:
+        report_headers = execute_report(cursor, report_name)
+    except mysql.connector.Error:
+        close_connection(cnx, cursor)
+        raise
+    # Rows from a lagging replica are served to this request only, never cached.
+    cacheable = db.served_by_primary()
+    return report_headers, stream_report(cursor, report_name, report_headers, key, cacheable)
+
+
+def invalidate_tables(*tables):
+    """Records a write to the given tables.
+
+    Bumps their versions, which stales cached reference data, pages and
+    reports that read from them. Call after committing a write. With shared
+    versions every worker sees the bump on its next lookup; otherwise other
+    workers catch up when their TTL expires.
+    """
+    for table in tables:
+        table_versions.bump(table)
+
+
+def iter_csv(headers, rows):
+    """Encodes rows as CSV text, one chunk per REPORT_BATCH_SIZE rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([row[header] for header in headers])
+        if count % REPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows):
+    """Encodes each row as one JSON object per line."""
+    for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+
 @app.route('/reports')
 def reports_index():
     """Shows the main reports page with a list of available reports."""
-    report_list = [
-        {'id': 'top_customers', 'name': 'Top 5 Customers by Purchase Value'},
-        {'id': 'low_stock', 'name': 'Low-Stock Products (Stock < 100)'},
-        {'id': 'delayed_shipments', 'name': 'Delayed Shipments (En Route past Arrival Date)'},
-        {'id': 'warehouse_revenue', 'name': 'Total Paid Revenue Per Warehouse'},
-        {'id': 'overdue_invoices', 'name': 'Overdue Pending Invoices'},
-        {'id': 'product_suppliers', 'name': 'All Products and Their Suppliers'},
-        {'id': 'vehicle_usage', 'name': 'Vehicle Shipment Frequency'},
-        {'id': 'popular_products', 'name': 'Most Popular Products (by Quantity Ordered)'},
-        {'id': 'avg_ship_duration', 'name': 'Average Shipment Duration'},
-        {'id': 'manufacturer_products', 'name': 'Product Count by Manufacturer'},
-    ]
-    return render_template('reports.html', report_list=report_list)
+    report_list = [{'id': report_id, 'name': report['title']} for report_id, report in REPORTS.items()]
+    return render_template('reports.html', report_list=report_list, export_formats=EXPORT_FORMATS)
 
 
 @app.route('/reports/<string:report_name>')
+@cached_page(lambda report_name: REPORTS.get(report_name, {}).get('tables', ()))
 def run_report(report_name):
-    """Runs and displays a specific advanced report."""
-    cnx, cursor = get_db_connection()
-    if cnx is None:
+    """Runs a specific advanced report (or reuses its cached result) and streams it into the page."""
+    if report_name not in REPORTS:
+        flash("Unknown report selected", "warning")
         return redirect(url_for('reports_index'))
 
-    query = ""
-    report_title = ""
+    try:
+        opened = open_report(report_name)
+    except mysql.connector.Error as err:
+        flash(f"Database error running report: {err}", "danger")
+        return redirect(url_for('reports_index'))
+    if opened is None:
+        return redirect(url_for('reports_index'))
+    report_headers, rows = opened
+
+    return Response(stream_with_context(stream_template(
+        'report_detail.html',
+        report_name=report_name,
+        report_title=REPORTS[report_name]['title'],
+        report_headers=report_headers,
+        report_data=rows,
+        export_formats=EXPORT_FORMATS,
+    )))
+
+
+@app.route('/reports/<string:report_name>/export.<string:fmt>')
+def export_report(report_name, fmt):
+    """Streams a report as CSV or newline-delimited JSON for download."""
+    if report_name not in REPORTS or fmt not in EXPORT_FORMATS:
+        flash("Unknown report or export format selected", "warning")
+        return redirect(url_for('reports_index'))
 
     try:
-        # Match the report_name to the corresponding SQL query from your presentation
-        if report_name == 'top_customers':
-            report_title = "Top 5 Customers by Purchase Value"
-            query = """
-                SELECT c.Name, SUM(i.Amount) AS total_spent
-                FROM Customers c
-                JOIN Orders o ON c.Customer_ID = o.Customer_ID
-                JOIN Invoices i ON o.Order_ID = i.Order_ID
-                WHERE i.Status = 'Paid'
-                GROUP BY c.Name
-                ORDER BY total_spent DESC
-                LIMIT 5
-            """
+        opened = open_report(report_name)
+    except mysql.connector.Error as err:
+        flash(f"Database error running report: {err}", "danger")
+        return redirect(url_for('reports_index'))
+    if opened is None:
+        return redirect(url_for('reports_index'))
+    report_headers, rows = opened
 
-        elif report_name == 'low_stock':
-            report_title = "Low-Stock Products (Stock < 100)"
-            query = """
-                SELECT p.Name, w.Name as warehouse_name, wi.Stock
-                FROM warehouse_inventory wi
-                JOIN Products p ON wi.Product_ID = p.Product_ID
-                JOIN Warehouses w ON wi.Warehouse_ID = w.Warehouse_ID
-                WHERE wi.Stock < 100
-                ORDER BY wi.Stock ASC
-            """
+    body = iter_csv(report_headers, rows) if fmt == 'csv' else iter_ndjson(rows)
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{report_name}.{fmt}"'},
+    )
 
-        elif report_name == 'delayed_shipments':
-            report_title = "Delayed Shipments (En Route past Arrival Date)"
-            query = """
-                SELECT s.Shipment_ID, o.Order_ID, s.Destination, s.Departure_Date, s.Arrival_Date
-                FROM Shipments s
-                JOIN Orders o ON s.Order_ID = o.Order_ID
-                WHERE s.Status = 'En Route' AND s.Arrival_Date < CURDATE()
-            """
 
-        elif report_name == 'warehouse_revenue':
-            report_title = "Total Paid Revenue Per Warehouse"
-            query = """
-                SELECT w.Name AS warehouse_name, SUM(i.Amount) AS total_revenue
-                FROM Invoices i
-                JOIN Orders o ON i.Order_ID = o.Order_ID
-                JOIN order_items oi ON o.Order_ID = oi.Order_ID
-                JOIN warehouse_inventory wi ON oi.Product_ID = wi.Product_ID
-                JOIN Warehouses w ON wi.Warehouse_ID = w.Warehouse_ID
-                WHERE i.Status = 'Paid'
-                GROUP BY w.Name
-                ORDER BY total_revenue DESC
-            """
+@app.route('/_cache/reports')
+def report_cache_stats():
+    """Reports hit/miss counts and size of this worker's report cache."""
+    stats = report_cache.stats()
+    stats['pid'] = os.getpid()
+    return stats
 
-        elif report_name == 'overdue_invoices':
-            report_title = "Overdue Pending Invoices"
-            query = """
-                SELECT Invoice_ID, Order_ID, Amount, Due_Date
-                FROM Invoices
-                WHERE Status = 'Pending' AND Due_Date < CURDATE()
-                ORDER BY Due_Date ASC
-            """
 
-        elif report_name == 'product_suppliers':
-            report_title = "All Products and Their Suppliers"
-            query = """
-                SELECT p.Name AS product_name, m.Name AS manufacturer_name, s.Name AS supplier_name
-                FROM Products p
-                JOIN Manufacturers m ON p.Manufacturer_ID = m.Manufacturer_ID
-                JOIN manufacturer_suppliers ms ON m.Manufacturer_ID = ms.Manufacturer_ID
-                JOIN Suppliers s ON ms.Supplier_ID = s.Supplier_ID
-                ORDER BY p.Name
-            """
+# ##############################################################################
+# BULK CSV IMPORT ROUTES
+# ##############################################################################
 
-        elif report_name == 'vehicle_usage':
-            report_title = "Vehicle Shipment Frequency"
-            query = """
-                SELECT v.Vehicle_ID, v.Type, v.License_Plate, COUNT(s.Shipment_ID) AS number_of_shipments
-                FROM Vehicles v
-                LEFT JOIN Shipments s ON v.Vehicle_ID = s.Vehicle_ID
-                GROUP BY v.Vehicle_ID, v.Type, v.License_Plate
-                ORDER BY number_of_shipments DESC
-            """
+# Uploads, job records and rejected-row files. Must be shared by all workers so
+# whichever one serves a poll can read the job.
+IMPORT_DIR = os.environ.get('IMPORT_DIR', os.path.join(app.instance_path, 'imports'))
 
-        elif report_name == 'popular_products':
-            report_title = "Most Popular Products (by Quantity Ordered)"
-            query = """
-                SELECT p.Name, SUM(oi.Quantity) AS total_quantity_ordered
-                FROM order_items oi
-                JOIN Products p ON oi.Product_ID = p.Product_ID
-                GROUP BY p.Name
-                ORDER BY total_quantity_ordered DESC
-            """
 
-        elif report_name == 'avg_ship_duration':
-            report_title = "Average Shipment Duration"
-            query = """
-                SELECT AVG(DATEDIFF(Arrival_Date, Departure_Date)) AS average_shipping_days
-                FROM Shipments
-                WHERE Arrival_Date IS NOT NULL AND Departure_Date IS NOT NULL
-            """
+@app.route('/import/<string:entity>', methods=['GET', 'POST'])
+def import_upload(entity):
+    """Accepts a CSV upload and starts importing it in the background."""
+    if entity not in imports.IMPORT_ENTITIES:
+        flash("Unknown import type selected", "warning")
+        return redirect(url_for('index'))
+    spec = imports.IMPORT_ENTITIES[entity]
+    list_endpoint = f"{entity[:-1]}_list"
 
-        elif report_name == 'manufacturer_products':
-            report_title = "Product Count by Manufacturer"
-            query = """
-                SELECT m.Name, COUNT(p.Product_ID) AS number_of_products
-                FROM Manufacturers m
-                JOIN Products p ON m.Manufacturer_ID = p.Manufacturer_ID
-                GROUP BY m.Name
-                ORDER BY number_of_products DESC
-            """
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if upload is None or not upload.filename:
+            flash("Please choose a CSV file to import.", "warning")
+            return redirect(url_for('import_upload', entity=entity))
+        job = imports.start_import(IMPORT_DIR, entity, upload, db.get_pool(DB_CONFIG), invalidate_tables)
+        flash(f"Import of '{upload.filename}' started.", "success")
+        return redirect(url_for('import_status', job_id=job.id))
+
+    return render_template('import_form.html', entity=entity, columns=list(spec['columns']),
+                           required=spec['required'], list_endpoint=list_endpoint)
+
+
+@app.route('/import/jobs/<string:job_id>')
+def import_status(job_id):
+    """Shows the progress of an import, refreshing until it finishes."""
+    job = imports.ImportJob.load(IMPORT_DIR, job_id)
+    if job is None:
+        flash("Import job not found.", "warning")
+        return redirect(url_for('index'))
+    return render_template('import_status.html', job=job, list_endpoint=f"{job.entity[:-1]}_list")
 
-        else:
-            flash("Unknown report selected", "warning")
-            return redirect(url_for('reports_index'))
 
-        cursor.execute(query)
-        report_data = cursor.fetchall()
+@app.route('/import/jobs/<string:job_id>.json')
+def import_status_json(job_id):
+    """Returns the progress of an import for polling clients."""
+    job = imports.ImportJob.load(IMPORT_DIR, job_id)
+    if job is None:
+        return jsonify({'error': "Import job not found"}), 404
+    return job.to_dict()
 
-        report_headers = [i[0] for i in cursor.description] if report_data else []
 
-        # Special case for AVG
-        if report_name == 'avg_ship_duration' and report_data:
-            avg_days = report_data[0]['average_shipping_days']
-            report_data = [{'average_shipping_days': f"{float(avg_days):.2f} days"}]
+@app.route('/import/jobs/<string:job_id>/rejected.csv')
+def import_rejected(job_id):
+    """Downloads the rows an import skipped, with the reason for each."""
+    job = imports.ImportJob.load(IMPORT_DIR, job_id)
+    if job is None or not os.path.exists(job.rejected_path):
+        flash("No rejected rows for this import.", "warning")
+        return redirect(url_for('index'))
+    return send_file(job.rejected_path, mimetype='text/csv', as_attachment=True,
+                     download_name=f"{job.entity}-rejected.csv")
 
-        return render_template(
-            'report_detail.html',
-            report_title=report_title,
-            report_headers=report_headers,
-            report_data=report_data
-        )
 
-    except mysql.connector.Error as err:
-        flash(f"Database error running report: {err}", "danger")
-        return redirect(url_for('reports_index'))
+# ##############################################################################
+# BULK DATA EXPORT ROUTES
+# ##############################################################################
+
+# Exportable tables. Rows are streamed in `key` order. Keys in this app are
+# supplied by the client (forms, order_add, CSV imports), so they are no
+# watermark. Tables with a date instead take ?since=YYYY-MM-DD and export the
+# rows dated on or after it, through the `since` condition: orders by
+# Orders.Date, order_items by their order's Date. `since` is inclusive, so a
+# nightly sync passing the date of its last run gets that day's rows again and
+# should upsert by key. Rows changed later under an older date (a status
+# update, an order backdated on entry) need a full export.
+EXPORT_TABLES = {
+    'customers': {'key': 'Customer_ID', 'query': "SELECT * FROM Customers"},
+    'products': {'key': 'Product_ID', 'query': "SELECT * FROM Products"},
+    'suppliers': {'key': 'Supplier_ID', 'query': "SELECT * FROM Suppliers"},
+    'manufacturers': {'key': 'Manufacturer_ID', 'query': "SELECT * FROM Manufacturers"},
+    'warehouses': {'key': 'Warehouse_ID', 'query': "SELECT * FROM Warehouses"},
+    'vehicles': {'key': 'Vehicle_ID', 'query': "SELECT * FROM Vehicles"},
+    'orders': {
+        'key': 'Order_ID',
+        'alias': 'o',
+        'query': """
+            SELECT o.Order_ID, o.Customer_ID, o.Date, o.Status, c.Name as Customer_Name,
+                   i.Invoice_ID, i.Amount, i.Due_Date, i.Status as Invoice_Status
+            FROM Orders o
+            LEFT JOIN Customers c ON o.Customer_ID = c.Customer_ID
+            LEFT JOIN Invoices i ON o.Order_ID = i.Order_ID
+        """,
+        'since': "o.Date >= %s",
+    },
+    'order_items': {
+        'key': 'Order_ID',
+        'query': "SELECT Order_ID, Product_ID, Quantity FROM order_items",
+        'order_by': 'Order_ID, Product_ID',
+        'since': "Order_ID IN (SELECT Order_ID FROM Orders WHERE Date >= %s)",
+    },
+}
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+
+
+def iter_export_rows(cursor, table):
+    """Yields rows from an unbuffered cursor in fetchmany() batches, then closes it."""
+    try:
+        while True:
+            batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not batch:
+                break
+            yield from batch
+    except mysql.connector.Error:
+        # Headers are already sent; a truncated file is the only signal we can give.
+        app.logger.exception("Database error while exporting %s", table)
     finally:
+        cursor.close()
+
+
+def iter_gzip(chunks):
+    """Compresses a stream of text chunks into a single gzip member."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.route('/export/<string:table>')
+def export_table(table):
+    """Streams a table as CSV or NDJSON, optionally gzipped.
+
+    Query args: format=csv|ndjson, gzip=1, and since=YYYY-MM-DD for the tables
+    that support it (see EXPORT_TABLES).
+    """
+    export = EXPORT_TABLES.get(table)
+    fmt = request.args.get('format', 'csv')
+    if export is None or fmt not in EXPORT_FORMATS:
+        return jsonify({'error': "Unknown table or export format"}), 404
+    since = request.args.get('since')
+    if since is not None:
+        if 'since' not in export:
+            return jsonify({'error': f"{table} has no date to export incrementally from; "
+                                     f"export the whole table"}), 400
+        try:
+            since = datetime.date.fromisoformat(since)
+        except ValueError:
+            return jsonify({'error': "since must be a date (YYYY-MM-DD)"}), 400
+    compress = request.args.get('gzip') == '1'
+
+    cnx, cursor = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': "Database unavailable"}), 503
+
+    key = f"{export['alias']}.{export['key']}" if 'alias' in export else export['key']
+    try:
+        if since is None:
+            cursor.execute(f"{export['query']} ORDER BY {export.get('order_by', key)}")
+        else:
+            cursor.execute(f"{export['query']} WHERE {export['since']} ORDER BY {export.get('order_by', key)}",
+                           (since,))
+        headers = [column[0] for column in cursor.description or []]
+    except mysql.connector.Error as err:
         close_connection(cnx, cursor)
+        return jsonify({'error': f"Database error: {err}"}), 500
+
+    rows = iter_export_rows(cursor, table)
+    body = iter_csv(headers, rows) if fmt == 'csv' else iter_ndjson(rows)
+    filename = f"{table}.{fmt}"
+    response_headers = {}
+    if compress:
+        body = iter_gzip(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = EXPORT_FORMATS[fmt]
+    response_headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=response_headers)
 
 
 # ##############################################################################
@@ -0,0 +1,231 @@
+"""Hammers a few hot products with concurrent order adds and removes, then checks stock.
+
+--threads clients add and remove lines of --hot products on a sample of orders
+for --duration seconds, through the real routes (add_item, remove_item and the
+bulk JSON endpoint). Afterwards it checks that no stock went negative, that
+every line's allocations equal its quantity, and that stock plus allocations
+still equals what the hot products started with. Deadlocks, lock wait timeouts
+and write conflicts are counted from the profiler; the run fails if any request
+gave up on one, or if more than --max-conflict-rate of the writes hit one.
+
+    python -m bench.allocation_stress                              # embedded SQLite stand-in
+    python -m bench.allocation_stress --mysql --threads 32         # DB_* database (tables are recreated!)
+    python -m bench.allocation_stress --policy split --stock 50
+
+The stand-in serializes writers, so it proves the bookkeeping; lock ordering
+and deadlock behaviour need --mysql.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+from bench import data, standin
+from bench.suite import ROOT, git_commit, summarize
+
+
+def hot_products(cnx, count):
+    """Returns the `count` lowest product ids that are stocked somewhere."""
+    cursor = cnx.cursor()
+    cursor.execute("SELECT DISTINCT Product_ID FROM warehouse_inventory ORDER BY Product_ID")
+    product_ids = [product_id for product_id, in cursor.fetchall()][:count]
+    cursor.close()
+    return product_ids
+
+
+def prepare(cnx, product_ids, stock):
+    """Gives the hot products `stock` per warehouse and no lines. Returns their total stock."""
+    marks = ", ".join(["%s"] * len(product_ids))
+    cursor = cnx.cursor()
+    cursor.execute(f"UPDATE warehouse_inventory SET Stock = %s WHERE Product_ID IN ({marks})",
+                   [stock] + product_ids)
+    cursor.execute(f"DELETE FROM order_items WHERE Product_ID IN ({marks})", product_ids)
+    cursor.execute(f"DELETE FROM order_allocations WHERE Product_ID IN ({marks})", product_ids)
+    cursor.execute(f"SELECT Product_ID, SUM(Stock) FROM warehouse_inventory WHERE Product_ID IN ({marks}) "
+                   f"GROUP BY Product_ID", product_ids)
+    totals = dict(cursor.fetchall())
+    cnx.commit()
+    cursor.close()
+    return totals
+
+
+def verify(cnx, product_ids, initial):
+    """Returns a list of invariant violations for the hot products."""
+    import allocation
+    problems = [f"{problem} {key}: {detail}" for problem, key, detail in allocation.check(cnx)]
+    marks = ", ".join(["%s"] * len(product_ids))
+    cursor = cnx.cursor()
+    cursor.execute(f"SELECT Product_ID, SUM(Stock) FROM warehouse_inventory WHERE Product_ID IN ({marks}) "
+                   f"GROUP BY Product_ID", product_ids)
+    stock = dict(cursor.fetchall())
+    cursor.execute(f"SELECT Product_ID, SUM(Quantity) FROM order_allocations WHERE Product_ID IN ({marks}) "
+                   f"GROUP BY Product_ID", product_ids)
+    allocated = dict(cursor.fetchall())
+    for product_id in product_ids:
+        if stock.get(product_id, 0) + allocated.get(product_id, 0) != initial[product_id]:
+            problems.append(f"product {product_id}: {stock.get(product_id, 0)} in stock + "
+                            f"{allocated.get(product_id, 0)} allocated != {initial[product_id]} at start")
+    cursor.execute(f"""
+        SELECT oi.Order_ID, oi.Product_ID, oi.Quantity, SUM(a.Quantity)
+        FROM order_items oi
+        LEFT JOIN order_allocations a ON oi.Order_ID = a.Order_ID AND oi.Product_ID = a.Product_ID
+        WHERE oi.Product_ID IN ({marks})
+        GROUP BY oi.Order_ID, oi.Product_ID, oi.Quantity
+    """, product_ids)
+    for order_id, product_id, quantity, line_allocated in cursor.fetchall():
+        if (line_allocated or 0) != quantity:
+            problems.append(f"order {order_id} product {product_id}: {quantity} ordered, "
+                            f"{line_allocated or 0} allocated")
+    cursor.close()
+    return problems, {str(product_id): {'stock': stock.get(product_id, 0), 'allocated': allocated.get(product_id, 0)}
+                      for product_id in product_ids}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000, help="order_items rows in the generated dataset")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mysql', action='store_true', help="use the DB_* database instead of the stand-in")
+    parser.add_argument('--sqlite', metavar='PATH', help="stand-in database file (default under instance/)")
+    parser.add_argument('--policy', default='most_stock', help="ALLOCATION_POLICY for the run")
+    parser.add_argument('--hot', type=int, default=3, help="products every client competes for")
+    parser.add_argument('--stock', type=int, default=100, help="starting stock of each hot product per warehouse")
+    parser.add_argument('--orders', type=int, default=50, help="orders the clients add lines to")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help="seconds of load")
+    parser.add_argument('--max-conflict-rate', type=float, default=0.05,
+                        help="fail if more than this share of writes hit a deadlock/lock timeout")
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    os.environ['ALLOCATION_POLICY'] = args.policy
+    # One connection per client, so the clients wait on row locks rather than the pool.
+    os.environ.setdefault('DB_POOL_MAX', str(args.threads))
+
+    import mysql.connector
+    if not args.mysql:
+        path = args.sqlite or os.path.join(ROOT, 'instance', f'allocation-{args.rows}-{args.seed}.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with contextlib.closing(sqlite3.connect(path)) as seed_cnx:
+            data.generate(seed_cnx, args.rows, args.seed, placeholder='?', log=log)
+        standin.install(path)
+
+    import app as application
+    import db
+    import profiler
+    app = application.app
+    app.config['TESTING'] = True
+
+    cnx = mysql.connector.connect(**application.DB_CONFIG)
+    if args.mysql:
+        data.generate(cnx, args.rows, args.seed, log=log)
+    product_ids = hot_products(cnx, args.hot)
+    initial = prepare(cnx, product_ids, args.stock)
+    cursor = cnx.cursor()
+    cursor.execute("SELECT Order_ID FROM Orders ORDER BY Order_ID")
+    order_ids = random.Random(args.seed).sample([order_id for order_id, in cursor.fetchall()], args.orders)
+    cursor.close()
+    cnx.close()
+    log(f"hot products {product_ids}, {sum(initial.values())} units, policy {args.policy}")
+
+    conflicts_before = profiler.QUERY_ERRORS.values()
+    latencies, outcomes = {}, Counter()
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + args.duration
+
+    def worker(number):
+        rng = random.Random(f"{args.seed}:{number}")
+        client = app.test_client()
+        while time.perf_counter() < stop_at:
+            order_id, product_id = rng.choice(order_ids), rng.choice(product_ids)
+            roll = rng.random()
+            started = time.perf_counter()
+            if roll < 0.15:
+                # Several hot products in one transaction, in arbitrary order.
+                lines = [{'product_id': p, 'quantity': rng.randint(1, 5)}
+                         for p in rng.sample(product_ids, min(2, len(product_ids)))]
+                response = client.post(f'/orders/{order_id}/items/bulk', json=lines)
+                kind = 'bulk'
+                outcome = {200: 'applied', 422: 'rejected', 409: 'rejected'}.get(response.status_code, 'error')
+            else:
+                if roll < 0.65:
+                    kind = 'add_item'
+                    response = client.post(f'/orders/{order_id}/add_item',
+                                           data={'product_id': product_id, 'quantity': rng.randint(1, 5)})
+                else:
+                    kind = 'remove_item'
+                    response = client.post(f'/orders/{order_id}/remove_item/{product_id}')
+                with client.session_transaction() as session:
+                    categories = [category for category, _ in session.pop('_flashes', [])]
+                outcome = ('error' if 'danger' in categories else
+                           'rejected' if 'warning' in categories else 'applied')
+            elapsed = time.perf_counter() - started
+            response.close()
+            with lock:
+                latencies.setdefault(kind, []).append(elapsed)
+                outcomes[(kind, outcome)] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    conflicts = Counter()
+    for labels, count in profiler.QUERY_ERRORS.values().items():
+        errno = labels[-1]
+        if errno.isdigit() and int(errno) in db.RETRYABLE_ERRNOS:
+            conflicts[errno] += count - conflicts_before.get(labels, 0)
+    writes = sum(outcomes.values())
+    failed = sum(count for (_, outcome), count in outcomes.items() if outcome == 'error')
+
+    cnx = mysql.connector.connect(**application.DB_CONFIG)
+    problems, final = verify(cnx, product_ids, initial)
+    cnx.close()
+    conflict_rate = sum(conflicts.values()) / writes if writes else 0
+    if failed:
+        problems.append(f"{failed} request(s) failed with a database error")
+    if conflict_rate > args.max_conflict_rate:
+        problems.append(f"conflict rate {conflict_rate:.1%} above {args.max_conflict_rate:.1%}")
+
+    output = {
+        'meta': {
+            'commit': git_commit(),
+            'backend': 'mysql' if args.mysql else 'sqlite-standin',
+            'policy': args.policy,
+            'threads': args.threads,
+            'duration': args.duration,
+            'hot_products': product_ids,
+            'stock_per_warehouse': args.stock,
+        },
+        'requests': writes,
+        'requests_per_second': round(writes / args.duration, 1),
+        'outcomes': {f"{kind} {outcome}": count for (kind, outcome), count in sorted(outcomes.items())},
+        'latency': {kind: summarize(values, Counter()) for kind, values in latencies.items()},
+        'conflicts': dict(conflicts),
+        'conflict_rate': round(conflict_rate, 4),
+        'final': final,
+        'problems': problems,
+    }
+    text = json.dumps(output, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for problem in problems:
+        log(f"FAIL: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""Deterministic synthetic supply-chain dataset for benchmarks.
+
+Every table the app reads is filled from a seed, scaled by the number of
+order_items rows requested (1k to 10M), and written in batches with
+executemany() so the generator never holds a whole table in memory. Tables
+and indexes come from the app's migrations (schema.py), whose DDL is plain SQL
+accepted by both MySQL/TiDB and SQLite.
+
+    python -m bench.data --rows 100000 --sqlite bench.db
+    python -m bench.data --rows 10000000 --mysql
+"""
+import argparse
+import datetime
+import random
+import sqlite3
+import time
+
+import schema
+
+TABLES = ['Shipments', 'Invoices', 'order_items', 'Orders', 'Vehicles', 'warehouse_inventory', 'Warehouses',
+          'Products', 'manufacturer_suppliers', 'Suppliers', 'Manufacturers', 'Customers']
+# Tables the app's features fill in; dropped with the rest, left empty.
+EXTRA_TABLES = ['order_allocations', 'stock_thresholds', 'stock_alerts', 'demand_forecasts', 'demand_forecast_summary',
+                'reorder_points']
+
+# Every date is relative to this, so reports that compare with CURDATE() give
+# the same answer on any later day.
+EPOCH = datetime.date(2024, 1, 1)
+DAYS = 365
+
+ORDER_STATUSES = ['Pending', 'Processing', 'Shipped', 'Delivered']
+INVOICE_STATUSES = ['Paid', 'Paid', 'Paid', 'Pending', 'Cancelled']
+SHIPMENT_STATUSES = ['Delivered', 'Delivered', 'En Route', 'Pending']
+VEHICLE_TYPES = ['Truck', 'Van', 'Lorry', 'Trailer']
+CITIES = ['Pune', 'Mumbai', 'Delhi', 'Chennai', 'Kolkata', 'Bengaluru', 'Hyderabad', 'Ahmedabad']
+
+
+def scale(rows):
+    """Returns the row count of every table for `rows` order_items rows."""
+    orders = max(rows // 4, 10)
+    products = max(rows // 100, 20)
+    manufacturers = max(products // 50, 5)
+    warehouses = min(max(rows // 50000, 3), 200)
+    return {
+        'order_items': rows,
+        'Orders': orders,
+        'Invoices': orders,
+        'Shipments': orders * 7 // 10,
+        'Customers': max(rows // 50, 10),
+        'Products': products,
+        'Manufacturers': manufacturers,
+        'Suppliers': max(manufacturers * 2, 5),
+        'Warehouses': warehouses,
+        'Vehicles': max(rows // 2000, 5),
+    }
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _day(rng):
+    return EPOCH + datetime.timedelta(days=rng.randrange(DAYS))
+
+
+def _rows(counts, seed):
+    """Returns (table, column count, row generator) triples in foreign-key order."""
+    # One generator per table, so changing one table's size leaves the others alone.
+    def rng(table):
+        return random.Random(f"{seed}:{table}")
+
+    def customers(r=rng('Customers')):
+        for i in range(1, counts['Customers'] + 1):
+            yield (i, f"Customer {i:07d}", f"{r.randint(1, 999)} {r.choice(CITIES)} Road",
+                   f"+91{r.randint(7000000000, 9999999999)}")
+
+    def manufacturers(r=rng('Manufacturers')):
+        for i in range(1, counts['Manufacturers'] + 1):
+            yield i, f"Manufacturer {i:05d}", f"mfr{i}@example.com", r.choice(CITIES)
+
+    def suppliers(r=rng('Suppliers')):
+        for i in range(1, counts['Suppliers'] + 1):
+            yield i, f"Supplier {i:05d}", f"sup{i}@example.com", r.choice(CITIES)
+
+    def manufacturer_suppliers(r=rng('manufacturer_suppliers')):
+        for m in range(1, counts['Manufacturers'] + 1):
+            for s in r.sample(range(1, counts['Suppliers'] + 1), 2):
+                yield m, s
+
+    def products(r=rng('Products')):
+        for i in range(1, counts['Products'] + 1):
+            yield (i, f"{r.choice(['Bolt', 'Valve', 'Gear', 'Pump', 'Sensor', 'Panel'])} {i:07d}",
+                   f"Synthetic product {i}", f"SKU-{i:08d}", r.randint(1, counts['Manufacturers']),
+                   round(r.uniform(1, 500), 2))
+
+    def warehouses(r=rng('Warehouses')):
+        for i in range(1, counts['Warehouses'] + 1):
+            yield i, f"Warehouse {i:03d}", r.choice(CITIES), r.randint(10000, 1000000)
+
+    def inventory(r=rng('warehouse_inventory')):
+        stocked_in = min(3, counts['Warehouses'])
+        for p in range(1, counts['Products'] + 1):
+            for w in r.sample(range(1, counts['Warehouses'] + 1), stocked_in):
+                yield w, p, r.randint(0, 1000)
+
+    def vehicles(r=rng('Vehicles')):
+        for i in range(1, counts['Vehicles'] + 1):
+            yield (i, r.choice(VEHICLE_TYPES), f"MH{r.randint(1, 50):02d}-{i:06d}", r.randint(500, 20000),
+                   r.choice(['Available', 'In Use', 'Maintenance']))
+
+    def orders(r=rng('Orders')):
+        for i in range(1, counts['Orders'] + 1):
+            yield i, r.randint(1, counts['Customers']), _day(r), r.choice(ORDER_STATUSES)
+
+    # Lines are spread evenly over orders so they add up to exactly `rows`.
+    def order_items(r=rng('order_items')):
+        per_order, extra = divmod(counts['order_items'], counts['Orders'])
+        for order_id in range(1, counts['Orders'] + 1):
+            lines = min(per_order + (order_id <= extra), counts['Products'])
+            for product_id in r.sample(range(1, counts['Products'] + 1), lines):
+                yield order_id, product_id, r.randint(1, 20)
+
+    # Amounts are nominal; the app keeps Invoices.Amount in step with its lines,
+    # but the benchmark only needs realistic magnitudes.
+    def invoices(r=rng('Invoices')):
+        for i in range(1, counts['Invoices'] + 1):
+            issued = _day(r)
+            yield i, i, round(r.uniform(10, 20000), 2), r.choice(INVOICE_STATUSES), issued + datetime.timedelta(days=30)
+
+    def shipments(r=rng('Shipments')):
+        for i in range(1, counts['Shipments'] + 1):
+            departure = _day(r)
+            yield (i, r.randint(1, counts['Orders']), r.randint(1, counts['Vehicles']), r.choice(CITIES),
+                   r.choice(CITIES), departure, departure + datetime.timedelta(days=r.randint(1, 14)),
+                   r.choice(SHIPMENT_STATUSES))
+
+    return [
+        ('Customers', 4, customers()),
+        ('Manufacturers', 4, manufacturers()),
+        ('Suppliers', 4, suppliers()),
+        ('manufacturer_suppliers', 2, manufacturer_suppliers()),
+        ('Products', 6, products()),
+        ('Warehouses', 4, warehouses()),
+        ('warehouse_inventory', 3, inventory()),
+        ('Vehicles', 5, vehicles()),
+        ('Orders', 4, orders()),
+        ('order_items', 3, order_items()),
+        ('Invoices', 5, invoices()),
+        ('Shipments', 8, shipments()),
+    ]
+
+
+def generate(cnx, rows, seed=42, placeholder='%s', batch_size=5000, log=None):
+    """Drops every table on `cnx`, migrates a fresh schema and fills it. Returns row counts.
+
+    `placeholder` is the driver's parameter marker: '%s' for mysql.connector,
+    '?' for sqlite3.
+    """
+    cursor = cnx.cursor()
+    for table in TABLES + EXTRA_TABLES + ['schema_migrations']:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cnx.commit()
+    schema.migrate(cnx, placeholder=placeholder)
+
+    written = {}
+    for table, width, table_rows in _rows(scale(rows), seed):
+        started = time.perf_counter()
+        insert = f"INSERT INTO {table} VALUES ({', '.join([placeholder] * width)})"
+        count = 0
+        for batch in _batched(table_rows, batch_size):
+            cursor.executemany(insert, batch)
+            cnx.commit()
+            count += len(batch)
+        written[table] = count
+        if log:
+            log(f"{table}: {count} rows in {time.perf_counter() - started:.1f}s")
+    cursor.close()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help="order_items rows; other tables scale from it")
+    parser.add_argument('--seed', type=int, default=42)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--sqlite', metavar='PATH', help="write to this SQLite file")
+    target.add_argument('--mysql', action='store_true',
+                        help="write to the DB_* database from .env (drops and recreates its tables!)")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        cnx = sqlite3.connect(args.sqlite)
+        placeholder = '?'
+    else:
+        import mysql.connector
+        from app import DB_CONFIG
+        cnx = mysql.connector.connect(**DB_CONFIG)
+        placeholder = '%s'
+    generate(cnx, args.rows, args.seed, placeholder, log=print)
+    cnx.close()
+
+
+if __name__ == '__main__':
+    main()
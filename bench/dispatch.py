@@ -0,0 +1,132 @@
+"""Compares the dispatch planner's strategies on generated orders and prints JSON.
+
+For each --orders size, orders get 1-8 lines of 1-20 units (a few are bulk
+orders of hundreds), to destinations drawn unevenly from bench.data.CITIES. The
+fleet mixes vans, trucks, lorries and trailers and holds --fleet-ratio times
+the units ordered. Every strategy plans the same data --repeat times. The
+output has the best time and the plan's quality: vehicles used, utilization
+of those vehicles and of the whole fleet, and the orders and units left
+behind.
+
+first_fit_decreasing is also checked. Each REGRESSIONS plan must leave behind
+exactly the orders listed for it, and no generated run may leave behind an
+order that fits a vehicle left idle. The run fails otherwise.
+
+    python -m bench.dispatch
+    python -m bench.dispatch --orders 1000,10000,50000 --fleet-ratio 0.8
+
+Only dispatch.plan() is timed; `flask dispatch plan --dry-run` adds the
+database reads.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+
+import dispatch
+from bench import data
+from bench.suite import git_commit
+
+FLEET = [('Van', 300, 4), ('Truck', 800, 3), ('Lorry', 1500, 2), ('Trailer', 3000, 1)]  # type, capacity, weight
+
+# Small plans first_fit_decreasing once got wrong: (name, orders, vehicles,
+# the orders it should leave unplanned).
+REGRESSIONS = [
+    # The busier lane put its 5s on the only vehicle that holds order 100,
+    # leaving it behind while seven vans could have carried the 5s.
+    ('bulk order behind a busier lane',
+     [(order_id, 'A', 5) for order_id in range(11)] + [(100, 'B', 50)],
+     [(1, 60)] + [(vehicle_id, 10) for vehicle_id in range(2, 9)],
+     set()),
+]
+
+
+def generate(orders, fleet_ratio, seed):
+    """Returns (orders, vehicles) as dispatch.plan() takes them."""
+    r = random.Random(f"{seed}:{orders}")
+    weights = [1 / (rank + 1) for rank in range(len(data.CITIES))]  # a few busy lanes, a long tail
+    generated = []
+    for order_id in range(1, orders + 1):
+        if r.random() < 0.03:
+            load = r.randint(200, 1200)
+        else:
+            load = sum(r.randint(1, 20) for _ in range(r.randint(1, 8)))
+        generated.append((order_id, r.choices(data.CITIES, weights)[0], load))
+
+    units = sum(load for _, _, load in generated)
+    mean_capacity = sum(capacity * weight for _, capacity, weight in FLEET) / sum(weight for *_, weight in FLEET)
+    vehicles = [(vehicle_id, r.choices([capacity for _, capacity, _ in FLEET], [weight for *_, weight in FLEET])[0])
+                for vehicle_id in range(1, math.ceil(units * fleet_ratio / mean_capacity) + 1)]
+    return generated, vehicles
+
+
+def stranded(orders, vehicles, trips, unplanned):
+    """Returns the unplanned orders that would fit a vehicle the plan left idle."""
+    used = {trip['vehicle_id'] for trip in trips}
+    idle = max((capacity for vehicle_id, capacity in vehicles if vehicle_id not in used), default=0)
+    return sorted(order_id for order_id, _, load in orders if order_id in unplanned and load <= idle)
+
+
+def check_regressions():
+    """Returns a list of problems with first_fit_decreasing's plans for REGRESSIONS."""
+    problems = []
+    for name, orders, vehicles, expected in REGRESSIONS:
+        trips, unplanned = dispatch.plan(orders, vehicles, 'first_fit_decreasing')
+        if set(unplanned) != expected:
+            problems.append(f"{name}: left behind {sorted(unplanned)}, expected {sorted(expected)}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', default='1000,5000,20000', help="comma-separated order counts")
+    parser.add_argument('--fleet-ratio', type=float, default=1.2, help="fleet capacity / units ordered")
+    parser.add_argument('--strategies', default=','.join(dispatch.STRATEGIES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    problems = check_regressions()
+    runs = []
+    for size in [int(size) for size in args.orders.split(',')]:
+        orders, vehicles = generate(size, args.fleet_ratio, args.seed)
+        results = {}
+        for strategy in args.strategies.split(','):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                trips, unplanned = dispatch.plan(orders, vehicles, strategy)
+                timings.append(time.perf_counter() - started)
+            results[strategy] = {'seconds': round(min(timings), 4),
+                                 **dispatch.quality(orders, vehicles, trips, unplanned)}
+            if strategy == 'first_fit_decreasing':
+                problems += [f"{size} orders: order {order_id} left behind with a vehicle idle"
+                             for order_id in stranded(orders, vehicles, trips, unplanned)]
+            stats = results[strategy]
+            print(f"{size} orders, {strategy}: {stats['vehicles_used']} of {stats['vehicles']} vehicles, "
+                  f"utilization {stats['utilization']} (fleet {stats['fleet_utilization']}), "
+                  f"unplanned {stats['orders_unplanned']} orders / {stats['units_unplanned']} units, "
+                  f"{min(timings):.3f}s", file=sys.stderr)
+        runs.append({'orders': size, 'vehicles': len(vehicles), 'strategies': results})
+
+    output = {
+        'meta': {'commit': git_commit(), 'seed': args.seed, 'fleet_ratio': args.fleet_ratio, 'repeat': args.repeat},
+        'runs': runs,
+        'problems': problems,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for problem in problems:
+        print(f"FAIL: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""Load test comparing the gunicorn serving modes in gunicorn.conf.py.
+
+For each mode, starts gunicorn on a local port, keeps --concurrency clients
+requesting the given paths for --duration seconds, then prints throughput,
+latency percentiles and status counts per mode as JSON. The app talks to the
+database configured in .env, so DB latency is whatever that host gives, or with
+--standin to a generated SQLite stand-in that sleeps --latency-ms per statement.
+
+    python -m bench.load_test --modes sync,threads,gevent --concurrency 200 \\
+        /orders /customers /orders/1 /reports/top_customers
+    python -m bench.load_test --standin --latency-ms 50 --concurrency 50
+
+Modes whose worker class cannot be imported (gevent when it is not installed)
+are skipped and listed under "skipped". With --url, one run is made against an
+already running server instead.
+"""
+import argparse
+import contextlib
+import importlib.util
+import http.client
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from bench import data
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules each SERVE_MODE's worker class needs beyond gunicorn itself.
+MODE_MODULES = {'gevent': 'gevent'}
+
+
+def request(host, port, path, timeout):
+    """Issues one GET without following redirects; returns the status code."""
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def run_load(url, paths, concurrency, duration, warmup, timeout):
+    """Keeps `concurrency` clients busy for warmup + duration seconds."""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    cycle = itertools.cycle(paths)
+    cycle_lock = threading.Lock()
+    measure_from = time.monotonic() + warmup
+    stop_at = measure_from + duration
+    latencies, statuses = [], Counter()
+    results_lock = threading.Lock()
+
+    def client():
+        while True:
+            started = time.monotonic()
+            if started >= stop_at:
+                return
+            with cycle_lock:
+                path = next(cycle)
+            try:
+                status = request(host, port, path, timeout)
+            except OSError as err:
+                status = type(err).__name__
+            if started >= measure_from:
+                elapsed = time.monotonic() - started
+                with results_lock:
+                    latencies.append(elapsed)
+                    statuses[str(status)] += 1
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if not latencies:
+        return {'requests': 0, 'statuses': {}}
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * 1000, 1),
+            'p50': round(cuts[49] * 1000, 1),
+            'p95': round(cuts[94] * 1000, 1),
+            'p99': round(cuts[98] * 1000, 1),
+            'max': round(max(latencies) * 1000, 1),
+        },
+        'statuses': dict(statuses),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_listening(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not start listening within {timeout}s")
+
+
+def mode_available(mode):
+    module = MODE_MODULES.get(mode)
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def serve(mode, workers, standin=None, latency_ms=0):
+    """Starts gunicorn in the given mode; returns (process, url).
+
+    With `standin`, the app serves that SQLite file through bench.standin_app.
+    """
+    port = free_port()
+    env = dict(os.environ, SERVE_MODE=mode, BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers))
+    target = 'app:app'
+    if standin:
+        env.update(STANDIN_DB=standin, STANDIN_LATENCY_MS=str(latency_ms))
+        target = 'bench.standin_app:app'
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', target],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_listening(port, process)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process, f'http://127.0.0.1:{port}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', default=['/orders', '/customers', '/products'])
+    parser.add_argument('--modes', default='sync,threads,gevent', help="comma-separated SERVE_MODE values")
+    parser.add_argument('--url', help="test this running server instead of starting gunicorn")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers per mode")
+    parser.add_argument('--concurrency', type=int, default=100, help="parallel clients")
+    parser.add_argument('--duration', type=float, default=20, help="measured seconds per run")
+    parser.add_argument('--warmup', type=float, default=3, help="unmeasured seconds before each run")
+    parser.add_argument('--timeout', type=float, default=30, help="per-request timeout")
+    parser.add_argument('--standin', nargs='?', const='', metavar='PATH',
+                        help="serve a SQLite stand-in (default file under instance/, generated if missing)")
+    parser.add_argument('--rows', type=int, default=20000, help="order_items rows when generating the stand-in")
+    parser.add_argument('--latency-ms', type=float, default=0, help="stand-in sleep per statement")
+    args = parser.parse_args(argv)
+
+    standin = None
+    if args.standin is not None:
+        standin = args.standin or os.path.join(ROOT, 'instance', f'load-{args.rows}.db')
+        if not os.path.exists(standin):
+            os.makedirs(os.path.dirname(standin), exist_ok=True)
+            with contextlib.closing(sqlite3.connect(standin)) as seed_cnx:
+                data.generate(seed_cnx, args.rows, placeholder='?')
+
+    load = dict(paths=args.paths, concurrency=args.concurrency, duration=args.duration,
+                warmup=args.warmup, timeout=args.timeout)
+    result = {'paths': args.paths, 'concurrency': args.concurrency, 'duration': args.duration,
+              'backend': f"sqlite-standin, {args.latency_ms} ms/statement" if standin else 'DB_* database'}
+    if args.url:
+        result['runs'] = {args.url: run_load(args.url, **load)}
+    else:
+        result['workers'] = args.workers
+        result['runs'], result['skipped'] = {}, []
+        for mode in args.modes.split(','):
+            if not mode_available(mode):
+                print(f"skipping {mode}: {MODE_MODULES[mode]} is not installed", file=sys.stderr)
+                result['skipped'].append(mode)
+                continue
+            process, url = serve(mode, args.workers, standin, args.latency_ms)
+            try:
+                result['runs'][mode] = run_load(url, **load)
+            finally:
+                process.terminate()
+                process.wait()
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""An embedded SQLite stand-in for the parts of mysql.connector the app uses.
+
+install(path) replaces mysql.connector.connect so the unmodified app runs on a
+local SQLite file. Statements are rewritten for the handful of MySQL-isms in
+app.py (%s markers, CURDATE(), DATEDIFF(), FOR UPDATE, ON DUPLICATE KEY UPDATE,
+LIKE's backslash escape, multi-statement execute), SQLite errors are raised as
+mysql.connector errors, and DATE/DECIMAL columns come back as date/Decimal.
+
+Timings from it show relative costs between routes and commits; absolute
+numbers and anything depending on MySQL's optimizer need the real database.
+install(path, latency=0.05) adds a sleep per statement to mimic a network
+round trip; gevent's patched sleep yields, like a socket wait would.
+"""
+import datetime
+import re
+import sqlite3
+import time
+from decimal import Decimal
+from functools import partial
+
+import mysql.connector
+from mysql.connector import errorcode, errors
+
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_converter('DATE', lambda raw: datetime.date.fromisoformat(raw.decode()))
+sqlite3.register_converter('DECIMAL', lambda raw: Decimal(raw.decode()))
+
+_REWRITES = [
+    (re.compile(r'\bCURDATE\(\)', re.I), "date('now')"),
+    (re.compile(r'\bDATEDIFF\(([^,()]+),\s*([^()]+)\)', re.I), r"(julianday(\1) - julianday(\2))"),
+    (re.compile(r'\s+FOR\s+UPDATE\b', re.I), ""),
+    (re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.I), "ON CONFLICT DO UPDATE SET"),
+    (re.compile(r'\bVALUES\((\w+)\)', re.I), r"excluded.\1"),
+    (re.compile(r'\bLIKE\s+%s', re.I), r"LIKE ? ESCAPE '\\'"),
+    (re.compile(r'%s'), "?"),
+]
+
+
+def translate(operation):
+    """Rewrites one MySQL statement into SQLite's dialect."""
+    for pattern, replacement in _REWRITES:
+        operation = pattern.sub(replacement, operation)
+    return operation
+
+
+def _mysql_error(err):
+    message = str(err)
+    if isinstance(err, sqlite3.IntegrityError):
+        return errors.IntegrityError(msg=message, errno=errorcode.ER_DUP_ENTRY)
+    if 'locked' in message or 'busy' in message:
+        return errors.DatabaseError(msg=message, errno=errorcode.ER_LOCK_WAIT_TIMEOUT)
+    if isinstance(err, sqlite3.OperationalError):
+        return errors.ProgrammingError(msg=message, errno=errorcode.ER_PARSE_ERROR)
+    return errors.DatabaseError(msg=message)
+
+
+class Cursor:
+    """A buffered cursor; rows are tuples, or dicts with dictionary=True."""
+
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._dictionary = dictionary
+        self._sets = []        # [(statement, description, rows)] from the last execute
+        self._rows = []
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self.statement = None
+
+    def _run(self, cursor, operation, params):
+        if self._connection.autocommit is False and not self._connection.raw.in_transaction:
+            # mysql.connector has autocommit off: every statement joins a transaction.
+            cursor.execute("BEGIN")
+        cursor.execute(operation, params)
+        rows = cursor.fetchall()
+        if cursor.description and self._dictionary:
+            names = [column[0] for column in cursor.description]
+            rows = [dict(zip(names, row)) for row in rows]
+        return cursor.description, rows
+
+    def execute(self, operation, params=None, map_results=False):
+        params = list(params or [])
+        if self._connection.latency:
+            time.sleep(self._connection.latency)
+        statements = [part for part in translate(operation).split(';') if part.strip()]
+        cursor = self._connection.raw.cursor()
+        self._sets = []
+        try:
+            for statement in statements:
+                count = statement.count('?')
+                description, rows = self._run(cursor, statement, params[:count])
+                params = params[count:]
+                self._sets.append((statement, description, rows))
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+        finally:
+            self.rowcount, self.lastrowid = cursor.rowcount, cursor.lastrowid
+            cursor.close()
+        self.statement = operation
+        self._select(0)
+
+    def executemany(self, operation, seq_params):
+        if self._connection.latency:
+            time.sleep(self._connection.latency)
+        cursor = self._connection.raw.cursor()
+        try:
+            if not self._connection.raw.in_transaction:
+                cursor.execute("BEGIN")
+            cursor.executemany(translate(operation), [list(params) for params in seq_params])
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+        finally:
+            self.rowcount = cursor.rowcount
+            cursor.close()
+        self._sets, self._rows, self.description = [], [], None
+
+    def _select(self, index):
+        _, self.description, rows = self._sets[index] if index < len(self._sets) else (None, None, [])
+        self._rows = list(rows)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=1):
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchsets(self):
+        for statement, _, rows in self._sets:
+            yield statement, list(rows)
+
+    def __iter__(self):
+        while self._rows:
+            yield self._rows.pop(0)
+
+    def close(self):
+        self._sets, self._rows = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Connection:
+    """Just enough of MySQLConnection for the pool, the routes and the jobs."""
+
+    autocommit = False
+
+    def __init__(self, path, latency=0):
+        self.latency = latency
+        self.raw = sqlite3.connect(path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES,
+                                   isolation_level=None, check_same_thread=False)
+        self.raw.execute("PRAGMA journal_mode=WAL")
+
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+
+    def cursor(self, dictionary=False, buffered=None, **kwargs):
+        return Cursor(self, dictionary=dictionary)
+
+    def start_transaction(self, **kwargs):
+        if self.raw.in_transaction:
+            raise errors.ProgrammingError("Transaction already in progress")
+        self.raw.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def ping(self, reconnect=False, **kwargs):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self.raw.close()
+
+
+def connect(path, latency=0, **db_config):
+    return Connection(path, latency)
+
+
+def install(path, latency=0):
+    """Makes every mysql.connector.connect() call open the SQLite file at `path`.
+
+    `latency` is slept (in seconds) before every statement.
+    """
+    mysql.connector.connect = partial(connect, path, latency)
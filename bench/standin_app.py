@@ -0,0 +1,11 @@
+"""WSGI entry point serving the app from the SQLite stand-in, for bench.load_test.
+
+    STANDIN_DB=instance/bench.db STANDIN_LATENCY_MS=50 gunicorn -c gunicorn.conf.py bench.standin_app:app
+"""
+import os
+
+from bench import standin
+
+standin.install(os.environ['STANDIN_DB'], latency=float(os.environ.get('STANDIN_LATENCY_MS', 0)) / 1000)
+
+from app import app  # noqa: E402  (must import after the stand-in is installed)
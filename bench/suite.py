@@ -0,0 +1,230 @@
+"""Times every page of the app against a synthetic dataset and prints JSON.
+
+Each route is requested through Flask's test client --repeat times in a row
+(reports both with an empty and a warm report cache), then a mix of the read
+routes is run from --concurrency threads for --duration seconds. The output
+records the commit, backend and dataset so runs can be compared across commits.
+
+    python -m bench.suite --rows 100000                      # embedded SQLite stand-in
+    python -m bench.suite --mysql --rows 1000000 --generate  # DB_* database (tables are recreated!)
+    python -m bench.suite --mysql                            # existing DB_* data
+
+POST /orders/<id>/add_item adds lines to the sampled orders; the stand-in runs
+on a fresh copy of its generated file each time, a MySQL database keeps them.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+from bench import data, standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIST_ROUTES = ['/customers', '/products', '/suppliers', '/manufacturers', '/warehouses', '/vehicles', '/orders',
+               '/products?q=Gear', '/orders?q=Customer+00001', '/orders?status=Pending']
+
+
+def summarize(latencies, statuses):
+    """Returns count, mean and percentile latencies in milliseconds, plus status counts."""
+    ms = sorted(seconds * 1000 for seconds in latencies)
+    if not ms:
+        return {'count': 0, 'statuses': dict(statuses)}
+    cuts = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+    return {
+        'count': len(ms),
+        'mean_ms': round(statistics.fmean(ms), 2),
+        'min_ms': round(ms[0], 2),
+        'p50_ms': round(cuts[49], 2),
+        'p95_ms': round(cuts[94], 2),
+        'max_ms': round(ms[-1], 2),
+        'statuses': dict(statuses),
+    }
+
+
+def timed_request(client, method, path, form=None):
+    """Issues one request, reading the whole (possibly streamed) body."""
+    started = time.perf_counter()
+    response = client.open(path, method=method, data=form)
+    response.get_data()
+    elapsed = time.perf_counter() - started
+    response.close()
+    return elapsed, response.status_code
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def id_range(cnx, table, column):
+    cursor = cnx.cursor()
+    cursor.execute(f"SELECT MIN({column}), MAX({column}), COUNT(*) FROM {table}")
+    low, high, count = cursor.fetchone()
+    cursor.close()
+    return low, high, count
+
+
+def row_counts(cnx):
+    cursor = cnx.cursor()
+    counts = {}
+    for table in data.TABLES:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        counts[table] = cursor.fetchone()[0]
+    cursor.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help="order_items rows in the generated dataset")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mysql', action='store_true', help="use the DB_* database instead of the stand-in")
+    parser.add_argument('--sqlite', metavar='PATH', help="stand-in database file (default under instance/)")
+    parser.add_argument('--generate', action='store_true', help="(re)generate the dataset first")
+    parser.add_argument('--repeat', type=int, default=5, help="sequential requests per route")
+    parser.add_argument('--samples', type=int, default=5, help="distinct orders for per-order routes")
+    parser.add_argument('--concurrency', type=int, default=8, help="threads in the concurrent phase (0 skips it)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of concurrent load")
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    import mysql.connector
+    if args.mysql:
+        backend = 'mysql'
+    else:
+        # add_item writes to the database, so every run starts from a copy of the generated file.
+        backend = 'sqlite-standin'
+        path = args.sqlite or os.path.join(ROOT, 'instance', f'bench-{args.rows}-{args.seed}.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if args.generate or not os.path.exists(path):
+            started = time.perf_counter()
+            with contextlib.closing(sqlite3.connect(path)) as seed_cnx:
+                data.generate(seed_cnx, args.rows, args.seed, placeholder='?', log=log)
+            log(f"generated in {time.perf_counter() - started:.1f}s")
+        work_path = path + '.run'
+        shutil.copyfile(path, work_path)
+        standin.install(work_path)
+
+    import app as application
+    app = application.app
+    app.config['TESTING'] = True
+
+    cnx = mysql.connector.connect(**application.DB_CONFIG)
+    if args.mysql and args.generate:
+        started = time.perf_counter()
+        data.generate(cnx, args.rows, args.seed, log=log)
+        log(f"generated in {time.perf_counter() - started:.1f}s")
+    first_order, last_order, order_count = id_range(cnx, 'Orders', 'Order_ID')
+    first_product, last_product, product_count = id_range(cnx, 'Products', 'Product_ID')
+    dataset = row_counts(cnx)
+    cnx.close()
+
+    rng = random.Random(args.seed)
+    order_ids = rng.sample(range(first_order, last_order + 1), min(args.samples, order_count))
+    product_ids = rng.sample(range(first_product, last_product + 1), min(args.samples, product_count))
+
+    client = app.test_client()
+    results = {}
+
+    def run(name, method, paths, forms=None, before=None):
+        forms = forms or [None] * len(paths)
+        timed_request(client, method, paths[0], forms[0])  # warm-up
+        latencies, statuses = [], Counter()
+        for path, form in itertools.islice(itertools.cycle(zip(paths, forms)), args.repeat * len(paths)):
+            if before:
+                before()
+            elapsed, status = timed_request(client, method, path, form)
+            latencies.append(elapsed)
+            statuses[status] += 1
+        results[name] = summarize(latencies, statuses)
+        log(f"{name}: p50 {results[name].get('p50_ms')} ms {dict(statuses)}")
+
+    for path in LIST_ROUTES:
+        run(f"GET {path}", 'GET', [path])
+    run("GET /orders/<id>", 'GET', [f'/orders/{order_id}' for order_id in order_ids])
+    run("GET /products/search", 'GET', ['/products/search?q=Gear', '/products/search?q=Pump+00'])
+    for report_id in application.REPORTS:
+        run(f"GET /reports/{report_id} (cold)", 'GET', [f'/reports/{report_id}'],
+            before=lambda: (application.report_cache.clear(), application.page_cache.clear()))
+        run(f"GET /reports/{report_id} (cached)", 'GET', [f'/reports/{report_id}'])
+    run("POST /orders/<id>/add_item", 'POST',
+        [f'/orders/{order_id}/add_item' for order_id in order_ids],
+        [{'product_id': product_id, 'quantity': 1} for product_id in product_ids])
+
+    concurrent = None
+    if args.concurrency > 0:
+        mix = LIST_ROUTES + [f'/orders/{order_id}' for order_id in order_ids] + \
+              [f'/reports/{report_id}' for report_id in application.REPORTS]
+        latencies = {path: [] for path in mix}
+        statuses = {path: Counter() for path in mix}
+        lock = threading.Lock()
+        stop_at = time.perf_counter() + args.duration
+
+        def worker(offset):
+            worker_client = app.test_client()
+            for path in itertools.islice(itertools.cycle(mix), offset, None):
+                if time.perf_counter() >= stop_at:
+                    return
+                elapsed, status = timed_request(worker_client, 'GET', path)
+                with lock:
+                    latencies[path].append(elapsed)
+                    statuses[path][status] += 1
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        total = sum(len(values) for values in latencies.values())
+        concurrent = {
+            'threads': args.concurrency,
+            'duration': args.duration,
+            'requests': total,
+            'requests_per_second': round(total / args.duration, 1),
+            'overall': summarize(list(itertools.chain(*latencies.values())),
+                                 sum(statuses.values(), Counter())),
+            'routes': {path: summarize(latencies[path], statuses[path]) for path in mix},
+        }
+
+    output = {
+        'meta': {
+            'commit': git_commit(),
+            'backend': backend,
+            'rows': args.rows,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'dataset': dataset,
+        'routes': results,
+        'concurrent': concurrent,
+    }
+    text = json.dumps(output, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Before/after benchmark for the warehouse_revenue report.
+
+Builds a synthetic dataset in SQLite (an embedded stand-in for MySQL/TiDB) and
+times the original fan-out query against the pre-aggregated attribution query
+and the summary-table query from app.REPORTS, printing row counts, timings and
+totals as JSON.
+
+    python -m bench.warehouse_revenue --lines 2000000
+"""
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import time
+
+import aggregates
+from app import REPORTS
+
+# The query warehouse_revenue ran before attribution was introduced. It joins
+# invoices to order lines and stock rows on Product_ID alone.
+LEGACY_QUERY = """
+    SELECT w.Name AS warehouse_name, SUM(i.Amount) AS total_revenue
+    FROM Invoices i
+    JOIN Orders o ON i.Order_ID = o.Order_ID
+    JOIN order_items oi ON o.Order_ID = oi.Order_ID
+    JOIN warehouse_inventory wi ON oi.Product_ID = wi.Product_ID
+    JOIN Warehouses w ON wi.Warehouse_ID = w.Warehouse_ID
+    WHERE i.Status = 'Paid'
+    GROUP BY w.Name
+    ORDER BY total_revenue DESC
+"""
+
+LEGACY_JOIN_ROWS = """
+    SELECT COUNT(*)
+    FROM Invoices i
+    JOIN Orders o ON i.Order_ID = o.Order_ID
+    JOIN order_items oi ON o.Order_ID = oi.Order_ID
+    JOIN warehouse_inventory wi ON oi.Product_ID = wi.Product_ID
+    WHERE i.Status = 'Paid'
+"""
+
+SCHEMA = """
+    CREATE TABLE Warehouses (Warehouse_ID INTEGER PRIMARY KEY, Name TEXT, Location TEXT, Capacity INTEGER);
+    CREATE TABLE Products (Product_ID INTEGER PRIMARY KEY, Name TEXT, UnitPrice REAL);
+    CREATE TABLE warehouse_inventory (Warehouse_ID INTEGER, Product_ID INTEGER, Stock INTEGER,
+                                      PRIMARY KEY (Warehouse_ID, Product_ID));
+    CREATE INDEX wi_product ON warehouse_inventory (Product_ID);
+    CREATE TABLE Orders (Order_ID INTEGER PRIMARY KEY, Customer_ID INTEGER, Date TEXT, Status TEXT);
+    CREATE TABLE order_items (Order_ID INTEGER, Product_ID INTEGER, Quantity INTEGER,
+                              PRIMARY KEY (Order_ID, Product_ID));
+    CREATE TABLE Invoices (Invoice_ID INTEGER PRIMARY KEY, Order_ID INTEGER, Amount REAL, Status TEXT,
+                           Due_Date TEXT);
+    CREATE INDEX invoices_order ON Invoices (Order_ID);
+"""
+
+
+def generate(cnx, lines, products, warehouses, lines_per_order, stocked_in, seed):
+    """Fills the tables deterministically and returns the total paid amount."""
+    rng = random.Random(seed)
+    cnx.executescript(SCHEMA)
+    cnx.executemany("INSERT INTO Warehouses VALUES (?, ?, ?, ?)",
+                    [(w, f"Warehouse {w}", "Nowhere", 100000) for w in range(1, warehouses + 1)])
+    prices = {p: round(rng.uniform(1, 500), 2) for p in range(1, products + 1)}
+    cnx.executemany("INSERT INTO Products VALUES (?, ?, ?)",
+                    [(p, f"Product {p}", price) for p, price in prices.items()])
+    cnx.executemany(
+        "INSERT INTO warehouse_inventory VALUES (?, ?, ?)",
+        [(w, p, rng.randint(0, 1000))
+         for p in prices
+         for w in rng.sample(range(1, warehouses + 1), min(stocked_in, warehouses))])
+
+    paid_total = 0.0
+    order_id = 0
+    remaining = lines
+    while remaining > 0:
+        batch_orders, batch_items, batch_invoices = [], [], []
+        for _ in range(10000):
+            if remaining <= 0:
+                break
+            order_id += 1
+            count = min(remaining, rng.randint(1, 2 * lines_per_order - 1))
+            remaining -= count
+            amount = 0.0
+            for product_id in rng.sample(range(1, products + 1), count):
+                quantity = rng.randint(1, 20)
+                amount += quantity * prices[product_id]
+                batch_items.append((order_id, product_id, quantity))
+            status = 'Paid' if rng.random() < 0.6 else 'Pending'
+            if status == 'Paid':
+                paid_total += amount
+            batch_orders.append((order_id, rng.randint(1, 1000), '2024-01-01', 'Shipped'))
+            batch_invoices.append((order_id, order_id, round(amount, 2), status, '2024-02-01'))
+        cnx.executemany("INSERT INTO Orders VALUES (?, ?, ?, ?)", batch_orders)
+        cnx.executemany("INSERT INTO order_items VALUES (?, ?, ?)", batch_items)
+        cnx.executemany("INSERT INTO Invoices VALUES (?, ?, ?, ?, ?)", batch_invoices)
+    cnx.commit()
+    return paid_total
+
+
+def timed(cnx, query):
+    started = time.perf_counter()
+    rows = cnx.execute(query).fetchall()
+    return rows, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1000000, help="order_items rows to generate")
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--warehouses', type=int, default=20)
+    parser.add_argument('--lines-per-order', type=int, default=5)
+    parser.add_argument('--stocked-in', type=int, default=4, help="warehouses stocking each product")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database', default=':memory:', help="SQLite file to build the dataset in")
+    parser.add_argument('--skip-legacy', action='store_true', help="do not run the fan-out query")
+    args = parser.parse_args(argv)
+
+    cnx = sqlite3.connect(args.database)
+    started = time.perf_counter()
+    paid_total = generate(cnx, args.lines, args.products, args.warehouses, args.lines_per_order,
+                          args.stocked_in, args.seed)
+    result = {
+        'dataset': {
+            'order_items': args.lines,
+            'orders': cnx.execute("SELECT COUNT(*) FROM Orders").fetchone()[0],
+            'products': args.products,
+            'warehouses': args.warehouses,
+            'inventory_rows': cnx.execute("SELECT COUNT(*) FROM warehouse_inventory").fetchone()[0],
+            'paid_total': round(paid_total, 2),
+            'generate_seconds': round(time.perf_counter() - started, 3),
+        },
+    }
+
+    if not args.skip_legacy:
+        join_rows = cnx.execute(LEGACY_JOIN_ROWS).fetchone()[0]
+        rows, seconds = timed(cnx, LEGACY_QUERY)
+        result['before'] = {
+            'joined_rows': join_rows,
+            'seconds': round(seconds, 3),
+            'attributed_total': round(sum(row[1] for row in rows), 2),
+        }
+
+    rows, seconds = timed(cnx, REPORTS['warehouse_revenue']['query'])
+    result['after'] = {
+        # Per-line rows feed the per-product aggregate; the stock split only
+        # touches one row per (product, stocking warehouse).
+        'joined_rows': args.lines + result['dataset']['inventory_rows'],
+        'seconds': round(seconds, 3),
+        'attributed_total': round(sum(row[1] for row in rows), 2),
+    }
+
+    # REAL rather than aggregates.SCHEMA's DECIMAL: SQLite would store whole-number
+    # revenues as integers and the stock split would then use integer division.
+    cnx.execute("CREATE TABLE product_paid_revenue (Product_ID INTEGER PRIMARY KEY, Revenue REAL)")
+    started = time.perf_counter()
+    cnx.execute("INSERT INTO product_paid_revenue (Product_ID, Revenue)" + aggregates._EXPECTED_REVENUE)
+    rebuild_seconds = time.perf_counter() - started
+    rows, seconds = timed(cnx, REPORTS['warehouse_revenue']['aggregate_query'])
+    result['summary_table'] = {
+        'joined_rows': result['dataset']['inventory_rows'],
+        'rebuild_seconds': round(rebuild_seconds, 3),
+        'seconds': round(seconds, 3),
+        'attributed_total': round(sum(row[1] for row in rows), 2),
+    }
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class TTLCache:
+    """A thread-safe LRU cache with per-entry expiry and a bound on total cost.
+
+    Each entry carries a cost (e.g. its row count) and the least recently used
+    entries are evicted once either ``max_entries`` or ``max_cost`` would be
+    exceeded. Writers that compute a value slowly should read ``epoch(key)``
+    first and pass it to ``set()``, so a result computed before an invalidation
+    is not stored after it.
+    """
+
+    def __init__(self, max_entries=128, max_cost=None):
+        self.max_entries = max_entries
+        self.max_cost = max_cost
+        self._entries = OrderedDict()  # key -> (value, expires_at, cost)
+        self._epochs = {}
+        self._generation = 0
+        self._cost = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0,
+                       'invalidations': 0, 'stale_writes': 0}
+
+    def get(self, key, default=None):
+        """Returns the cached value, or ``default`` if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            value, expires_at, cost = entry
+            if expires_at <= time.monotonic():
+                self._drop(key)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def epoch(self, key):
+        """Returns a token that changes whenever ``key`` is invalidated."""
+        with self._lock:
+            return self._generation, self._epochs.get(key, 0)
+
+    def set(self, key, value, ttl, cost=1, epoch=None):
+        """Stores a value for ``ttl`` seconds. Returns False if it was not stored."""
+        with self._lock:
+            if epoch is not None and epoch != (self._generation, self._epochs.get(key, 0)):
+                self._stats['stale_writes'] += 1
+                return False
+            if self.max_cost is not None and cost > self.max_cost:
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.monotonic() + ttl, cost)
+            self._cost += cost
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     (self.max_cost is not None and self._cost > self.max_cost)):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats['evictions'] += 1
+            return True
+
+    def invalidate(self, *keys):
+        """Drops the given keys and bumps their epochs."""
+        with self._lock:
+            for key in keys:
+                self._epochs[key] = self._epochs.get(key, 0) + 1
+                if key in self._entries:
+                    self._drop(key)
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        """Invalidates every key, including ones still being computed."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._cost = 0
+            self._stats['invalidations'] += 1
+
+    def _drop(self, key):
+        _, _, cost = self._entries.pop(key)
+        self._cost -= cost
+
+    def stats(self):
+        """Returns hit/miss counters and current size."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            lookups = snapshot['hits'] + snapshot['misses']
+            snapshot.update({
+                'entries': len(self._entries),
+                'cost': self._cost,
+                'max_entries': self.max_entries,
+                'max_cost': self.max_cost,
+                'hit_ratio': round(snapshot['hits'] / lookups, 4) if lookups else None,
+            })
+        return snapshot
+
+
+class LocalVersions:
+    """Per-name version counters visible to this process only."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._nonce = os.urandom(4).hex()
+
+    @property
+    def token(self):
+        """Identifies this set of counters; equal versions only compare within one token."""
+        # Forked workers inherit the counters but then bump them separately.
+        return f"{os.getpid()}-{self._nonce}"
+
+    def get(self, name):
+        return self._versions.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+
+class SharedVersions:
+    """Per-name version counters in a memory-mapped file shared by every process.
+
+    Reads are a plain memory load, so they can be done on every cache lookup.
+    Names hash into a fixed number of 8-byte slots; two names sharing a slot
+    only cause some extra invalidations. Bumps are serialized with flock().
+    """
+
+    SLOTS = 64
+    SLOT_SIZE = 8
+
+    def __init__(self, path):
+        import fcntl  # Unix only; local development falls back to LocalVersions
+        self._fcntl = fcntl
+        size = self.SLOTS * self.SLOT_SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked():
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # A recreated file restarts every counter, so versions from the old one must not match.
+        stat = os.fstat(self._fd)
+        self.token = f"{stat.st_dev}-{stat.st_ino}"
+
+    def _offset(self, name):
+        return (zlib.crc32(name.encode()) % self.SLOTS) * self.SLOT_SIZE
+
+    @contextmanager
+    def _locked(self):
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def get(self, name):
+        return struct.unpack_from('<Q', self._map, self._offset(name))[0]
+
+    def bump(self, name):
+        offset = self._offset(name)
+        with self._locked():
+            value = struct.unpack_from('<Q', self._map, offset)[0]
+            struct.pack_into('<Q', self._map, offset, value + 1)
+
+
+_MISSING = object()
+
+
+class VersionedCache:
+    """A TTLCache whose keys embed a per-namespace version.
+
+    Invalidating a namespace bumps its version, so every entry loaded under an
+    older version becomes unreachable and ages out of the LRU. With
+    SharedVersions the bump is seen by all workers on their next lookup. A
+    value is stored under the version read before it was loaded, so a load
+    that races with an invalidation can never be served afterwards.
+    """
+
+    def __init__(self, versions, ttl, max_entries=256, max_cost=None):
+        self.versions = versions
+        self.ttl = ttl
+        self._cache = TTLCache(max_entries=max_entries, max_cost=max_cost)
+
+    def get_or_load(self, namespace, key, load, cost=len):
+        """Returns the cached value for ``key`` in ``namespace``, calling ``load()`` on a miss."""
+        full_key = (namespace, self.versions.get(namespace), key)
+        value = self._cache.get(full_key, _MISSING)
+        if value is _MISSING:
+            value = load()
+            self._cache.set(full_key, value, self.ttl, cost=max(cost(value), 1))
+        return value
+
+    def invalidate(self, *namespaces):
+        """Makes every entry in the given namespaces stale, in all sharing processes."""
+        for namespace in namespaces:
+            self.versions.bump(namespace)
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,524 @@
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from flask import g, request, session
+from mysql.connector import errorcode, errors
+
+
+# ##############################################################################
+# CONNECTION POOL
+# ##############################################################################
+
+class PoolTimeout(errors.PoolError):
+    """Raised when no connection could be borrowed within the wait timeout."""
+
+
+class ConnectionPool:
+    """A bounded pool of MySQL connections shared by the threads of one worker.
+
+    Connections are opened lazily up to ``max_size``, pinged on borrow when they
+    have been idle for longer than ``ping_after`` seconds, and recycled once they
+    exceed ``max_lifetime`` or sit idle beyond ``max_idle`` (while above
+    ``min_size``). If given, ``wrap(cnx)`` is applied to each new connection
+    and the pool hands out what it returns.
+    """
+
+    def __init__(self, db_config, min_size=1, max_size=5, max_idle=300, max_lifetime=3600,
+                 ping_after=5, wait_timeout=10, wrap=None):
+        self.db_config = dict(db_config)
+        self.wrap = wrap
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.wait_timeout = wait_timeout
+
+        self._idle = deque()  # (cnx, created_at, last_used), most recently used on the right
+        self._created = {}    # id(cnx) -> created_at, for every open connection
+        self._pending = 0     # slots reserved by threads that are still connecting
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'connects': 0,
+            'health_check_failures': 0,
+            'recycled': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    # --- borrowing --------------------------------------------------------
+
+    def acquire(self, timeout=None):
+        """Borrows a healthy connection, opening a new one if below max_size."""
+        timeout = self.wait_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            with self._cond:
+                entry = None
+                while entry is None:
+                    if self._idle:
+                        entry = self._idle.pop()
+                    elif len(self._created) + self._pending < self.max_size:
+                        # Reserve the slot, then connect outside the lock.
+                        self._pending += 1
+                        break
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats['timeouts'] += 1
+                            raise PoolTimeout(
+                                f"Timed out after {timeout}s waiting for a database connection "
+                                f"({self.max_size} in use)")
+                        self._cond.wait(remaining)
+
+            if entry is None:
+                cnx = self._connect_reserved()
+            else:
+                cnx = self._check_idle(entry)
+                if cnx is None:
+                    continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._stats['checkouts'] += 1
+                self._stats['wait_seconds_total'] += waited
+                self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+            return cnx
+
+    def release(self, cnx):
+        """Returns a borrowed connection, rolling back any open transaction."""
+        try:
+            if cnx.in_transaction:
+                cnx.rollback()
+        except mysql.connector.Error:
+            self._discard(cnx)
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            created_at = self._created.get(id(cnx))
+            if created_at is None or now - created_at > self.max_lifetime:
+                if created_at is not None:
+                    self._stats['recycled'] += 1
+                    self._created.pop(id(cnx))
+                self._cond.notify()
+                self._close_quietly(cnx)
+                return
+            self._idle.append((cnx, created_at, now))
+            self._evict_idle(now)
+            self._cond.notify()
+
+    # --- internals --------------------------------------------------------
+
+    def _connect_reserved(self):
+        """Opens a connection for a slot reserved in acquire()."""
+        try:
+            cnx = mysql.connector.connect(**self.db_config)
+            if self.wrap is not None:
+                cnx = self.wrap(cnx)
+        except BaseException:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._pending -= 1
+            self._created[id(cnx)] = time.monotonic()
+            self._stats['connects'] += 1
+        return cnx
+
+    def _check_idle(self, entry):
+        """Validates an idle connection; returns None if it had to be dropped."""
+        cnx, created_at, last_used = entry
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            with self._cond:
+                self._stats['recycled'] += 1
+            self._discard(cnx)
+            return None
+        if now - last_used > self.ping_after:
+            try:
+                cnx.ping(reconnect=False)
+            except mysql.connector.Error:
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+                self._discard(cnx)
+                return None
+        return cnx
+
+    def _evict_idle(self, now):
+        """Closes the stalest idle connections beyond min_size. Caller holds the lock."""
+        while self._idle and len(self._created) > self.min_size:
+            cnx, _, last_used = self._idle[0]
+            if now - last_used <= self.max_idle:
+                break
+            self._idle.popleft()
+            self._created.pop(id(cnx), None)
+            self._stats['recycled'] += 1
+            self._close_quietly(cnx)
+
+    def _discard(self, cnx):
+        with self._cond:
+            self._created.pop(id(cnx), None)
+            self._cond.notify()
+        self._close_quietly(cnx)
+
+    @staticmethod
+    def _close_quietly(cnx):
+        try:
+            cnx.close()
+        except mysql.connector.Error:
+            pass
+
+    def stats(self):
+        """Returns a snapshot of pool size and checkout counters."""
+        with self._cond:
+            snapshot = dict(self._stats)
+            size = len(self._created)
+            snapshot.update({
+                'size': size,
+                'idle': len(self._idle),
+                'in_use': size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        return snapshot
+
+    def close(self):
+        """Closes every idle connection (borrowed ones close on release)."""
+        with self._cond:
+            while self._idle:
+                cnx, _, _ = self._idle.pop()
+                self._created.pop(id(cnx), None)
+                self._close_quietly(cnx)
+            self.max_lifetime = -1
+
+
+# ##############################################################################
+# PER-WORKER POOL AND REQUEST-SCOPED HANDLE
+# ##############################################################################
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def pool_settings():
+    """Reads pool sizing from the environment.
+
+    DB_POOL_MAX is the per-worker cap. If DB_POOL_MAX_TOTAL is set instead, it
+    is split across the gunicorn workers given by WEB_CONCURRENCY so the whole
+    deployment stays under the server's connection limit.
+    """
+    max_size = _env_int('DB_POOL_MAX', 5)
+    if os.environ.get('DB_POOL_MAX_TOTAL'):
+        workers = max(_env_int('WEB_CONCURRENCY', 1), 1)
+        max_size = max(_env_int('DB_POOL_MAX_TOTAL', max_size) // workers, 1)
+    return {
+        'min_size': min(_env_int('DB_POOL_MIN', 1), max_size),
+        'max_size': max_size,
+        'max_idle': _env_int('DB_POOL_MAX_IDLE', 300),
+        'max_lifetime': _env_int('DB_POOL_MAX_LIFETIME', 3600),
+        'ping_after': _env_int('DB_POOL_PING_AFTER', 5),
+        'wait_timeout': _env_int('DB_POOL_WAIT_TIMEOUT', 10),
+    }
+
+
+_pools = {}       # name ('primary' or 'replica:host:port') -> ConnectionPool
+_pools_pid = None
+_pool_lock = threading.Lock()
+_connection_wrapper = None
+
+
+def wrap_connections(wrapper):
+    """Applies ``wrapper(cnx)`` to every connection pools open from now on."""
+    global _connection_wrapper
+    _connection_wrapper = wrapper
+
+
+def _named_pool(name, db_config):
+    """Returns this process's pool for one database, creating it after a fork if necessary."""
+    global _pools, _pools_pid
+    pid = os.getpid()
+    pool = _pools.get(name) if _pools_pid == pid else None
+    if pool is None:
+        with _pool_lock:
+            if _pools_pid != pid:
+                # Connections inherited from a pre-fork parent must not be shared.
+                _pools, _pools_pid = {}, pid
+            pool = _pools.get(name)
+            if pool is None:
+                pool = _pools[name] = ConnectionPool(db_config, wrap=_connection_wrapper, **pool_settings())
+    return pool
+
+
+def get_pool(db_config):
+    """Returns this process's pool for the primary database."""
+    return _named_pool('primary', db_config)
+
+
+def get_connection(db_config):
+    """Borrows one connection for the current request, reusing it on later calls.
+
+    Requests to replica routes (see init_app) that are not pinned to the
+    primary are served from a replica when one is configured and reachable.
+    """
+    if 'db_cnx' not in g:
+        started = time.perf_counter()
+        g.db_config = db_config
+        g.db_target, g.db_pool, g.db_cnx = _borrow(db_config)
+        if g.db_target != 'primary':
+            g.db_cnx = _ReplicaConnection(g.db_cnx)
+        g.db_acquire_seconds = time.perf_counter() - started
+    return g.db_cnx
+
+
+def served_by_primary():
+    """True unless this request's reads came from a replica, which may lag behind.
+
+    Anything cached for other requests must only be stored when this is true.
+    """
+    return g.get('db_target', 'primary') == 'primary'
+
+
+def release_connection(exc=None):
+    """Teardown hook that returns the request's connection to the pool it came from."""
+    cnx = g.pop('db_cnx', None)
+    pool = g.pop('db_pool', None)
+    if isinstance(cnx, _ReplicaConnection):
+        cnx = cnx.raw
+    if cnx is not None and pool is not None:
+        pool.release(cnx)
+
+
+def init_app(app, db_config, replica_routes=()):
+    """Registers the request teardown, replica routing and the pool stats endpoint.
+
+    GET requests to the endpoints in `replica_routes` read from the replicas in
+    DB_REPLICA_HOSTS. After a request that wrote through the primary, the same
+    browser session reads from the primary for DB_STICKY_SECONDS so it sees its
+    own writes despite replication lag.
+    """
+    app.teardown_appcontext(release_connection)
+    _replica_routes.update(replica_routes)
+
+    @app.after_request
+    def pin_to_primary_after_write(response):
+        if (request.method not in ('GET', 'HEAD') and g.get('db_target') == 'primary'
+                and STICKY_SECONDS > 0 and replica_configs(db_config)):
+            session['db_primary_until'] = time.time() + STICKY_SECONDS
+        return response
+
+    @app.route('/_db/pool')
+    def db_pool_stats():
+        """Reports pool size, checkout counts and wait time for this worker."""
+        stats = get_pool(db_config).stats()
+        stats['pid'] = os.getpid()
+        stats['replicas'] = {name: dict(_named_pool(name, config).stats(), down=_is_down(name))
+                             for name, config in replica_configs(db_config).items()}
+        return stats
+
+
+# ##############################################################################
+# READ REPLICAS
+# ##############################################################################
+
+# How long a replica that failed to connect (or failed a statement) is skipped,
+# and how long a session keeps reading from the primary after it wrote.
+REPLICA_RETRY_SECONDS = _env_int('DB_REPLICA_RETRY', 30)
+STICKY_SECONDS = _env_int('DB_STICKY_SECONDS', 5)
+
+_replica_routes = set()
+_replica_configs = None
+_replica_turn = itertools.count()
+_replica_down_until = {}  # name -> time.monotonic() when it may be tried again
+
+
+def replica_configs(db_config):
+    """Returns {name: config} for the replicas in DB_REPLICA_HOSTS ("host[:port],...").
+
+    Replicas share the primary's database name and credentials unless
+    DB_REPLICA_USER / DB_REPLICA_PASSWORD are set.
+    """
+    global _replica_configs
+    if _replica_configs is None:
+        configs = {}
+        for entry in os.environ.get('DB_REPLICA_HOSTS', '').split(','):
+            host, _, port = entry.strip().partition(':')
+            if not host:
+                continue
+            config = dict(db_config, host=host, port=int(port) if port else db_config.get('port', 3306))
+            if os.environ.get('DB_REPLICA_USER'):
+                config['user'] = os.environ['DB_REPLICA_USER']
+            if os.environ.get('DB_REPLICA_PASSWORD'):
+                config['password'] = os.environ['DB_REPLICA_PASSWORD']
+            configs[f"replica:{host}:{config['port']}"] = config
+        _replica_configs = configs
+    return _replica_configs
+
+
+def _is_down(name):
+    return _replica_down_until.get(name, 0) > time.monotonic()
+
+
+def _reads_from_replica():
+    return (request.endpoint in _replica_routes and request.method in ('GET', 'HEAD')
+            and session.get('db_primary_until', 0) <= time.time())
+
+
+def _borrow(db_config):
+    """Returns (target name, pool, connection) for the current request."""
+    replicas = replica_configs(db_config) if _reads_from_replica() else {}
+    if replicas:
+        names = list(replicas)
+        # Round-robin over the replicas, starting one further along each time.
+        start = next(_replica_turn) % len(names)
+        for name in names[start:] + names[:start]:
+            if _is_down(name):
+                continue
+            pool = _named_pool(name, replicas[name])
+            try:
+                return name, pool, pool.acquire()
+            except PoolTimeout:
+                continue  # busy, not broken
+            except mysql.connector.Error:
+                _replica_down_until[name] = time.monotonic() + REPLICA_RETRY_SECONDS
+    pool = get_pool(db_config)
+    return 'primary', pool, pool.acquire()
+
+
+# A statement that fails on a replica with one of these (on top of connection
+# errors) is run again elsewhere: the replica is missing the table, e.g. it is
+# behind on migrations.
+_REPLICA_ERRNOS = {errorcode.ER_NO_SUCH_TABLE}
+
+
+def _fail_over(err):
+    """Moves the request off the replica a statement just failed on.
+
+    Returns False (the error should propagate) when the request is already on
+    the primary or the error is not the replica's fault. Otherwise the replica
+    is skipped for REPLICA_RETRY_SECONDS, its connection is dropped and the
+    request's connection switches to the next replica, or the primary.
+    """
+    target = g.get('db_target', 'primary')
+    if target == 'primary' or not (isinstance(err, (errors.InterfaceError, errors.OperationalError))
+                                   or err.errno in _REPLICA_ERRNOS):
+        return False
+    _replica_down_until[target] = time.monotonic() + REPLICA_RETRY_SECONDS
+    g.db_pool._discard(g.db_cnx.raw)
+    g.db_target, g.db_pool, g.db_cnx.raw = _borrow(g.db_config)
+    return True
+
+
+class _ReplicaConnection:
+    """The request's replica connection. Its cursors fail over on a statement error.
+
+    The request keeps this one object while the connection behind it may change
+    (see _fail_over), so views and cached prepared statements never notice.
+    """
+
+    def __init__(self, cnx):
+        self.raw = cnx
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    # statements.py keeps prepared cursors on the pooled connection, not on this wrapper.
+    @property
+    def _prepared_cursors(self):
+        return getattr(self.raw, '_prepared_cursors', None)
+
+    @_prepared_cursors.setter
+    def _prepared_cursors(self, cursors):
+        self.raw._prepared_cursors = cursors
+
+    def cursor(self, *args, **kwargs):
+        return _ReplicaCursor(self.raw.cursor(*args, **kwargs), args, kwargs)
+
+
+class _ReplicaCursor:
+    """Runs execute() again on the request's next connection when a replica fails it.
+
+    Only whole statements are retried; an error while fetching rows propagates.
+    """
+
+    def __init__(self, cursor, args, kwargs):
+        self._cursor = cursor
+        self._args, self._kwargs = args, kwargs
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        while True:
+            try:
+                return self._cursor.execute(operation, params, *args, **kwargs)
+            except mysql.connector.Error as err:
+                if not _fail_over(err):
+                    raise
+                self._cursor = g.db_cnx.raw.cursor(*self._args, **self._kwargs)
+
+
+# ##############################################################################
+# TRANSACTIONS
+# ##############################################################################
+
+# Errors after which the whole transaction can simply be run again.
+# 9007 is TiDB's write-conflict error under optimistic locking.
+RETRYABLE_ERRNOS = {errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT, 9007}
+
+
+def run_in_transaction(cnx, work, attempts=3, backoff=0.05):
+    """Runs ``work(cursor)`` in one explicit transaction on ``cnx`` and commits it.
+
+    On a deadlock, lock wait timeout or write conflict the transaction is rolled
+    back and ``work`` runs again (up to ``attempts`` times, with jittered
+    backoff). Everything ``work`` runs on ``cnx`` is part of the transaction and
+    rolled back with it: the cursor it is given, other cursors on ``cnx`` and
+    statements.execute/query(cnx, ...). So ``work`` must not commit, write
+    through another connection, or do anything outside the database that
+    cannot safely happen twice. Returns whatever ``work`` returns; other errors
+    roll back and propagate.
+    """
+    for attempt in range(1, attempts + 1):
+        cursor = cnx.cursor(dictionary=True)
+        try:
+            cnx.start_transaction()
+            result = work(cursor)
+            cnx.commit()
+            return result
+        except mysql.connector.Error as err:
+            try:
+                cnx.rollback()
+            except mysql.connector.Error:
+                pass
+            if err.errno not in RETRYABLE_ERRNOS or attempt == attempts:
+                raise
+            time.sleep(backoff * attempt * random.uniform(0.5, 1.5))
+        except Exception:
+            # e.g. allocation.OutOfStock: work refused the change, so nothing it wrote may commit.
+            try:
+                cnx.rollback()
+            except mysql.connector.Error:
+                pass
+            raise
+        finally:
+            cursor.close()
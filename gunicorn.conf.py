@@ -0,0 +1,44 @@
+"""gunicorn settings: gunicorn -c gunicorn.conf.py app:app
+
+SERVE_MODE picks how a worker overlaps requests while they wait on the database:
+
+    sync    one request per worker at a time (gunicorn's default)
+    threads WEB_THREADS requests per worker on OS threads (gthread worker)
+    gevent  WORKER_CONNECTIONS requests per worker on one event loop; the
+            MySQL driver runs in pure-Python mode so its socket reads yield to
+            the loop instead of blocking it (requires `pip install gevent`)
+
+In every mode each worker's connection pool is sized to the requests it can
+have in flight, unless DB_POOL_MAX / DB_POOL_MAX_TOTAL say otherwise.
+"""
+import multiprocessing
+import os
+
+SERVE_MODE = os.environ.get('SERVE_MODE', 'sync')
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+
+# db.pool_settings() splits DB_POOL_MAX_TOTAL across WEB_CONCURRENCY workers.
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+
+if SERVE_MODE == 'sync':
+    worker_class = 'sync'
+    in_flight = 1
+elif SERVE_MODE == 'threads':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WEB_THREADS', 32))
+    in_flight = threads
+elif SERVE_MODE == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 500))
+    in_flight = worker_connections
+    # The C extension does blocking socket I/O that gevent cannot patch.
+    os.environ.setdefault('DB_USE_PURE', '1')
+else:
+    raise RuntimeError(f"Unknown SERVE_MODE {SERVE_MODE!r}; use sync, threads or gevent")
+
+# Requests beyond the pool size wait in ConnectionPool.acquire(). Past a few
+# dozen connections per worker the database, not the pool, is the bottleneck.
+os.environ.setdefault('DB_POOL_MAX', str(min(in_flight, 50)))
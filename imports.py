@@ -0,0 +1,282 @@
+import csv
+import datetime
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import mysql.connector
+
+import db
+
+
+# ##############################################################################
+# BULK CSV IMPORT
+# ##############################################################################
+#
+# An uploaded CSV is saved to IMPORT_DIR and parsed row by row on a background
+# thread. Rows are validated against ID sets loaded once per job (existing keys
+# and foreign keys), then inserted with executemany() in transactions of
+# IMPORT_BATCH_SIZE rows. Rejected rows go to a CSV next to the upload with the
+# reason appended. Job state lives in a JSON file so any worker can report it.
+
+# CSV header (case-insensitive, same names as the add forms) -> table column.
+IMPORT_ENTITIES = {
+    'customers': {
+        'table': 'Customers',
+        'key': 'customer_id',
+        'columns': {'customer_id': 'Customer_ID', 'name': 'Name', 'address': 'Address', 'contact': 'Contact'},
+        'required': ('customer_id', 'name'),
+        'integers': ('customer_id',),
+    },
+    'products': {
+        'table': 'Products',
+        'key': 'product_id',
+        'columns': {'product_id': 'Product_ID', 'name': 'Name', 'description': 'Description', 'sku': 'SKU',
+                    'manufacturer_id': 'Manufacturer_ID', 'unit_price': 'UnitPrice'},
+        'required': ('product_id', 'name', 'sku', 'manufacturer_id'),
+        'integers': ('product_id', 'manufacturer_id'),
+        'decimals': ('unit_price',),
+        'foreign_keys': {'manufacturer_id': "SELECT Manufacturer_ID FROM Manufacturers"},
+    },
+    'suppliers': {
+        'table': 'Suppliers',
+        'key': 'supplier_id',
+        'columns': {'supplier_id': 'Supplier_ID', 'name': 'Name', 'contact': 'Contact', 'address': 'Address'},
+        'required': ('supplier_id', 'name'),
+        'integers': ('supplier_id',),
+    },
+    'manufacturers': {
+        'table': 'Manufacturers',
+        'key': 'manufacturer_id',
+        'columns': {'manufacturer_id': 'Manufacturer_ID', 'name': 'Name', 'contact': 'Contact',
+                    'address': 'Address'},
+        'required': ('manufacturer_id', 'name'),
+        'integers': ('manufacturer_id',),
+    },
+    'warehouses': {
+        'table': 'Warehouses',
+        'key': 'warehouse_id',
+        'columns': {'warehouse_id': 'Warehouse_ID', 'name': 'Name', 'location': 'Location',
+                    'capacity': 'Capacity'},
+        'required': ('warehouse_id', 'name'),
+        'integers': ('warehouse_id', 'capacity'),
+    },
+    'vehicles': {
+        'table': 'Vehicles',
+        'key': 'vehicle_id',
+        'columns': {'vehicle_id': 'Vehicle_ID', 'type': 'Type', 'license_plate': 'License_Plate',
+                    'capacity': 'Capacity', 'status': 'Status'},
+        'required': ('vehicle_id', 'type', 'license_plate'),
+        'integers': ('vehicle_id', 'capacity'),
+    },
+}
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('IMPORT_WORKERS', 1)),
+                               thread_name_prefix='csv-import')
+
+
+class ImportJob:
+    """Progress of one import, persisted as <id>.json in the import directory."""
+
+    FIELDS = ('id', 'entity', 'filename', 'status', 'rows_read', 'rows_inserted', 'rows_rejected',
+              'error', 'created_at', 'finished_at')
+
+    def __init__(self, directory, **state):
+        self.directory = directory
+        self.id = state.get('id') or uuid.uuid4().hex
+        self.entity = state.get('entity')
+        self.filename = state.get('filename')
+        self.status = state.get('status', 'queued')
+        self.rows_read = state.get('rows_read', 0)
+        self.rows_inserted = state.get('rows_inserted', 0)
+        self.rows_rejected = state.get('rows_rejected', 0)
+        self.error = state.get('error')
+        self.created_at = state.get('created_at') or datetime.datetime.now().isoformat(timespec='seconds')
+        self.finished_at = state.get('finished_at')
+
+    @property
+    def upload_path(self):
+        return os.path.join(self.directory, f"{self.id}.csv")
+
+    @property
+    def rejected_path(self):
+        return os.path.join(self.directory, f"{self.id}.rejected.csv")
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def save(self):
+        """Writes the job state atomically so pollers never see a partial file."""
+        path = os.path.join(self.directory, f"{self.id}.json")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory, job_id):
+        """Returns the saved job, or None if the id is unknown."""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(directory, f"{job_id}.json")) as f:
+                return cls(directory, **json.load(f))
+        except FileNotFoundError:
+            return None
+
+
+def start_import(directory, entity, upload, pool, on_commit):
+    """Saves an uploaded file and queues it for import. Returns the ImportJob.
+
+    `pool` is the worker's db.ConnectionPool and `on_commit(table)` is called
+    after every committed batch (e.g. to invalidate cached reports).
+    """
+    os.makedirs(directory, exist_ok=True)
+    job = ImportJob(directory, entity=entity, filename=upload.filename)
+    upload.save(job.upload_path)
+    job.save()
+    _executor.submit(_run_import, job, pool, on_commit)
+    return job
+
+
+def _run_import(job, pool, on_commit):
+    job.status = 'running'
+    job.save()
+    try:
+        _import_rows(job, pool, on_commit)
+        job.status = 'done'
+    except Exception as err:  # reported to the user through the job record
+        job.status = 'failed'
+        job.error = str(err)
+    job.finished_at = datetime.datetime.now().isoformat(timespec='seconds')
+    job.save()
+
+
+def _load_id_set(cnx, query):
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(query)
+        return {row[0] for row in cursor}
+    finally:
+        cursor.close()
+
+
+def _import_rows(job, pool, on_commit):
+    spec = IMPORT_ENTITIES[job.entity]
+    cnx = pool.acquire()
+    try:
+        # Keys already present are rejected up front rather than failing a batch.
+        existing = _load_id_set(cnx, f"SELECT {spec['columns'][spec['key']]} FROM {spec['table']}")
+        references = {field: _load_id_set(cnx, query)
+                      for field, query in spec.get('foreign_keys', {}).items()}
+        cnx.commit()
+
+        with open(job.upload_path, newline='', encoding='utf-8-sig') as source, \
+                open(job.rejected_path, 'w', newline='') as rejected_file:
+            reader = csv.reader(source)
+            header = next(reader, None)
+            if header is None:
+                raise ValueError("The file is empty")
+            fields = [name.strip().lower() for name in header]
+            missing = [name for name in spec['required'] if name not in fields]
+            if missing:
+                raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+            unknown = [name for name in fields if name not in spec['columns']]
+            if unknown:
+                raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+
+            rejected = csv.writer(rejected_file)
+            rejected.writerow(header + ['error'])
+            insert = "INSERT INTO {} ({}) VALUES ({})".format(
+                spec['table'], ", ".join(spec['columns'][name] for name in fields),
+                ", ".join(["%s"] * len(fields)))
+
+            batch = []
+            for raw in reader:
+                job.rows_read += 1
+                try:
+                    values = _validate_row(spec, fields, raw, existing, references)
+                except ValueError as err:
+                    rejected.writerow(raw + [str(err)])
+                    job.rows_rejected += 1
+                    continue
+                existing.add(values[fields.index(spec['key'])])
+                batch.append((raw, values))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    _flush(cnx, insert, batch, job, rejected)
+                    on_commit(spec['table'])
+                    batch = []
+            if batch:
+                _flush(cnx, insert, batch, job, rejected)
+                on_commit(spec['table'])
+    finally:
+        pool.release(cnx)
+
+
+def _validate_row(spec, fields, raw, existing, references):
+    """Converts one CSV row to insert values; raises ValueError with the reason."""
+    if len(raw) != len(fields):
+        raise ValueError(f"expected {len(fields)} values, got {len(raw)}")
+    values = []
+    for name, text in zip(fields, raw):
+        text = text.strip()
+        if not text:
+            if name in spec['required']:
+                raise ValueError(f"{name} is required")
+            values.append(None)
+            continue
+        if name in spec['integers']:
+            try:
+                value = int(text)
+            except ValueError:
+                raise ValueError(f"{name} must be an integer")
+        elif name in spec.get('decimals', ()):
+            try:
+                value = Decimal(text)
+            except InvalidOperation:
+                raise ValueError(f"{name} must be a number")
+        else:
+            value = text
+        if name in references and value not in references[name]:
+            raise ValueError(f"{name} {value} does not exist")
+        values.append(value)
+    if values[fields.index(spec['key'])] in existing:
+        raise ValueError(f"{spec['key']} {values[fields.index(spec['key'])]} already exists")
+    return values
+
+
+def _flush(cnx, insert, batch, job, rejected):
+    """Inserts one batch in one transaction, isolating bad rows if the batch fails."""
+    try:
+        db.run_in_transaction(cnx, lambda cursor: cursor.executemany(insert, [values for _, values in batch]))
+        job.rows_inserted += len(batch)
+        job.save()
+        return
+    except mysql.connector.Error:
+        pass
+
+    # Something in the batch violates a constraint we could not check up front
+    # (e.g. a unique SKU); retry row by row so only the offending rows are lost.
+    cursor = cnx.cursor()
+    try:
+        cnx.start_transaction()
+        try:
+            for raw, values in batch:
+                try:
+                    cursor.execute(insert, values)
+                    job.rows_inserted += 1
+                except mysql.connector.Error as err:
+                    rejected.writerow(raw + [err.msg])
+                    job.rows_rejected += 1
+            cnx.commit()
+        except mysql.connector.Error:
+            cnx.rollback()
+            raise
+    finally:
+        cursor.close()
+    job.save()
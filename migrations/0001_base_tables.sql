@@ -0,0 +1,93 @@
+-- The tables app.py reads and writes, as they exist in the deployed database.
+-- IF NOT EXISTS makes this a no-op there; it creates them on a fresh database.
+
+CREATE TABLE IF NOT EXISTS Customers (
+    Customer_ID INT PRIMARY KEY,
+    Name VARCHAR(100) NOT NULL,
+    Address VARCHAR(255),
+    Contact VARCHAR(100)
+);
+
+CREATE TABLE IF NOT EXISTS Manufacturers (
+    Manufacturer_ID INT PRIMARY KEY,
+    Name VARCHAR(100) NOT NULL,
+    Contact VARCHAR(100),
+    Address VARCHAR(255)
+);
+
+CREATE TABLE IF NOT EXISTS Suppliers (
+    Supplier_ID INT PRIMARY KEY,
+    Name VARCHAR(100) NOT NULL,
+    Contact VARCHAR(100),
+    Address VARCHAR(255)
+);
+
+CREATE TABLE IF NOT EXISTS manufacturer_suppliers (
+    Manufacturer_ID INT NOT NULL,
+    Supplier_ID INT NOT NULL,
+    PRIMARY KEY (Manufacturer_ID, Supplier_ID)
+);
+
+CREATE TABLE IF NOT EXISTS Products (
+    Product_ID INT PRIMARY KEY,
+    Name VARCHAR(100) NOT NULL,
+    Description VARCHAR(255),
+    SKU VARCHAR(50),
+    Manufacturer_ID INT,
+    UnitPrice DECIMAL(10, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS Warehouses (
+    Warehouse_ID INT PRIMARY KEY,
+    Name VARCHAR(100) NOT NULL,
+    Location VARCHAR(255),
+    Capacity INT
+);
+
+CREATE TABLE IF NOT EXISTS warehouse_inventory (
+    Warehouse_ID INT NOT NULL,
+    Product_ID INT NOT NULL,
+    Stock INT NOT NULL,
+    PRIMARY KEY (Warehouse_ID, Product_ID)
+);
+
+CREATE TABLE IF NOT EXISTS Vehicles (
+    Vehicle_ID INT PRIMARY KEY,
+    Type VARCHAR(50),
+    License_Plate VARCHAR(20),
+    Capacity INT,
+    Status VARCHAR(20)
+);
+
+CREATE TABLE IF NOT EXISTS Orders (
+    Order_ID INT PRIMARY KEY,
+    Customer_ID INT,
+    Date DATE,
+    Status VARCHAR(20)
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    Order_ID INT NOT NULL,
+    Product_ID INT NOT NULL,
+    Quantity INT NOT NULL,
+    PRIMARY KEY (Order_ID, Product_ID)
+);
+
+CREATE TABLE IF NOT EXISTS Invoices (
+    Invoice_ID INT PRIMARY KEY,
+    Order_ID INT,
+    Amount DECIMAL(14, 2),
+    Status VARCHAR(20),
+    Due_Date DATE
+);
+
+CREATE TABLE IF NOT EXISTS Shipments (
+    Shipment_ID INT PRIMARY KEY,
+    Order_ID INT,
+    Vehicle_ID INT,
+    Origin VARCHAR(255),
+    Destination VARCHAR(255),
+    Departure_Date DATE,
+    Arrival_Date DATE,
+    Status VARCHAR(20)
+);
@@ -0,0 +1,36 @@
+-- Indexes for the statements app.py runs; `flask schema advise` checks their plans.
+
+-- List pages: keyset pagination orders by (Name, id), and `q` is a Name prefix.
+CREATE INDEX idx_customers_name ON Customers (Name, Customer_ID);
+CREATE INDEX idx_suppliers_name ON Suppliers (Name, Supplier_ID);
+CREATE INDEX idx_manufacturers_name ON Manufacturers (Name, Manufacturer_ID);
+CREATE INDEX idx_warehouses_name ON Warehouses (Name, Warehouse_ID);
+CREATE INDEX idx_vehicles_type_plate ON Vehicles (Type, License_Plate, Vehicle_ID);
+CREATE INDEX idx_products_name ON Products (Name, Product_ID);
+
+-- Product list's manufacturer filter, manufacturer_products and product_suppliers.
+CREATE INDEX idx_products_manufacturer ON Products (Manufacturer_ID);
+CREATE INDEX idx_manufacturer_suppliers_supplier ON manufacturer_suppliers (Supplier_ID);
+
+-- Order list: newest first, optionally for one customer or status.
+CREATE INDEX idx_orders_date ON Orders (Date, Order_ID);
+CREATE INDEX idx_orders_customer_date ON Orders (Customer_ID, Date, Order_ID);
+CREATE INDEX idx_orders_status_date ON Orders (Status, Date, Order_ID);
+
+-- popular_products and the revenue split read (Product_ID, Quantity) without
+-- touching the rows; lookups by Order_ID use the primary key.
+CREATE INDEX idx_order_items_product ON order_items (Product_ID, Quantity);
+
+-- Order joins (order detail, top_customers, warehouse_revenue) covered by the
+-- index, and overdue_invoices as a range on (Status, Due_Date).
+CREATE INDEX idx_invoices_order ON Invoices (Order_ID, Status, Amount);
+CREATE INDEX idx_invoices_status_due ON Invoices (Status, Due_Date);
+
+-- Order detail, delayed_shipments and vehicle_usage.
+CREATE INDEX idx_shipments_order ON Shipments (Order_ID);
+CREATE INDEX idx_shipments_status_arrival ON Shipments (Status, Arrival_Date);
+CREATE INDEX idx_shipments_vehicle ON Shipments (Vehicle_ID);
+
+-- low_stock as a range on Stock; per-product stock totals for warehouse_revenue.
+CREATE INDEX idx_inventory_stock ON warehouse_inventory (Stock);
+CREATE INDEX idx_inventory_product ON warehouse_inventory (Product_ID, Stock);
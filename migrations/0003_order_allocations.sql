@@ -0,0 +1,16 @@
+-- Stock reserved for each order line, per fulfilling warehouse (allocation.py).
+CREATE TABLE IF NOT EXISTS order_allocations (
+    Order_ID INT NOT NULL,
+    Product_ID INT NOT NULL,
+    Warehouse_ID INT NOT NULL,
+    Quantity INT NOT NULL,
+    PRIMARY KEY (Order_ID, Product_ID, Warehouse_ID)
+);
+
+-- Stock checks: what is reserved from one warehouse's shelf of a product.
+CREATE INDEX idx_allocations_inventory ON order_allocations (Warehouse_ID, Product_ID, Quantity);
+
+-- Allocation locks a product's stock rows in Warehouse_ID order, the same order
+-- releases update them in, so concurrent orders for a hot product queue instead
+-- of deadlocking.
+CREATE INDEX idx_inventory_product_warehouse ON warehouse_inventory (Product_ID, Warehouse_ID);
@@ -0,0 +1,24 @@
+-- Reorder levels for low-stock alerts (alerts.py). Warehouse_ID 0 sets the
+-- product's level in every warehouse without a row of its own.
+CREATE TABLE IF NOT EXISTS stock_thresholds (
+    Product_ID INT NOT NULL,
+    Warehouse_ID INT NOT NULL,
+    Reorder_Level INT NOT NULL,
+    PRIMARY KEY (Product_ID, Warehouse_ID)
+);
+
+-- Outbox of threshold crossings, written in the transaction that moved the stock.
+CREATE TABLE IF NOT EXISTS stock_alerts (
+    Alert_ID CHAR(32) NOT NULL PRIMARY KEY,
+    Warehouse_ID INT NOT NULL,
+    Product_ID INT NOT NULL,
+    Kind VARCHAR(10) NOT NULL,
+    Stock INT NOT NULL,
+    Reorder_Level INT NOT NULL,
+    Created_At DATETIME NOT NULL,
+    Delivered_At DATETIME NULL
+);
+
+-- The dispatcher reads the last minute of alerts; `flask alerts deliver` the undelivered ones.
+CREATE INDEX idx_stock_alerts_created ON stock_alerts (Created_At);
+CREATE INDEX idx_stock_alerts_delivered ON stock_alerts (Delivered_At);
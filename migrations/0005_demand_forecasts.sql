@@ -0,0 +1,22 @@
+-- Demand forecasts written by `flask forecast run` (forecast.py): one row per
+-- product and future period, plus the chosen model and its backtest error.
+CREATE TABLE IF NOT EXISTS demand_forecasts (
+    Product_ID INT NOT NULL,
+    Period_Start DATE NOT NULL,
+    Quantity DECIMAL(12, 2) NOT NULL,
+    PRIMARY KEY (Product_ID, Period_Start)
+);
+
+CREATE TABLE IF NOT EXISTS demand_forecast_summary (
+    Product_ID INT NOT NULL PRIMARY KEY,
+    Model VARCHAR(30) NOT NULL,
+    Frequency VARCHAR(10) NOT NULL,
+    Next_Period DECIMAL(12, 2) NOT NULL,
+    Horizon_Total DECIMAL(14, 2) NOT NULL,
+    Backtest_MAE DECIMAL(12, 2),
+    History_Total BIGINT NOT NULL,
+    Generated_At DATETIME NOT NULL
+);
+
+-- The forecast report lists the products with the most demand ahead.
+CREATE INDEX idx_forecast_summary_total ON demand_forecast_summary (Horizon_Total);
@@ -0,0 +1,18 @@
+-- Replenishment plan written by `flask replenish run` (replenishment.py): one
+-- row per stocked (warehouse, product).
+CREATE TABLE IF NOT EXISTS reorder_points (
+    Warehouse_ID INT NOT NULL,
+    Product_ID INT NOT NULL,
+    Stock INT NOT NULL,
+    Daily_Demand DECIMAL(12, 3) NOT NULL,
+    Safety_Stock INT NOT NULL,
+    Reorder_Point INT NOT NULL,
+    Order_Up_To INT NOT NULL,
+    Recommended_Qty INT NOT NULL,
+    Computed_At DATETIME NOT NULL,
+    PRIMARY KEY (Warehouse_ID, Product_ID)
+);
+
+-- The job replaces product ranges; the report lists the largest recommended orders.
+CREATE INDEX idx_reorder_points_product ON reorder_points (Product_ID);
+CREATE INDEX idx_reorder_points_qty ON reorder_points (Recommended_Qty);
@@ -0,0 +1,4 @@
+-- Delivery lease for stock alerts (alerts.py): a worker claims an alert until
+-- Claimed_Until, and Delivered_At is only set once every sink took it. A failed
+-- or abandoned delivery is retried once the lease runs out.
+ALTER TABLE stock_alerts ADD COLUMN Claimed_Until DATETIME NULL;
@@ -0,0 +1,345 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+
+import mysql.connector
+from flask import Response, before_render_template, g, request, template_rendered
+
+import db
+
+
+# ##############################################################################
+# METRICS
+# ##############################################################################
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_text(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return ",".join(pairs)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self):
+        """Returns a copy of {label values: count}."""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{{{_label_text(self.labels, label_values)}}} {value}"
+
+
+class Histogram:
+    """Cumulative bucket counts plus sum and count per label set."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            labels = _label_text(self.labels, label_values)
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}'
+            yield f"{self.name}_sum{{{labels}}} {series[-2]}"
+            yield f"{self.name}_count{{{labels}}} {series[-1]}"
+
+
+QUERY_SECONDS = Histogram('scm_db_query_seconds', "Statement latency, execute plus fetch.",
+                          ('route', 'statement'))
+QUERY_ROWS = Counter('scm_db_query_rows_total', "Rows fetched by statements.", ('route', 'statement'))
+QUERY_BYTES = Counter('scm_db_query_bytes_total', "Approximate bytes of column data fetched.",
+                      ('route', 'statement'))
+QUERY_ERRORS = Counter('scm_db_query_errors_total', "Statements that raised a database error.",
+                       ('route', 'statement', 'errno'))
+SLOW_QUERIES = Counter('scm_db_slow_queries_total', "Statements slower than SLOW_QUERY_MS.",
+                       ('route', 'statement'))
+ACQUIRE_SECONDS = Histogram('scm_db_acquire_seconds', "Time to borrow the request's pooled connection.",
+                            ('route',))
+RENDER_SECONDS = Histogram('scm_template_render_seconds', "Jinja render time (streamed pages include "
+                           "the fetches they interleave with).", ('route', 'template'))
+REQUEST_SECONDS = Histogram('scm_request_seconds', "Time until the view returned a response.",
+                            ('route', 'method', 'status'))
+
+METRICS = (QUERY_SECONDS, QUERY_ROWS, QUERY_BYTES, QUERY_ERRORS, SLOW_QUERIES, ACQUIRE_SECONDS,
+           RENDER_SECONDS, REQUEST_SECONDS)
+
+
+def render_metrics(pool_stats=None):
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    for key, value in (pool_stats or {}).items():
+        name = f"scm_db_pool_{key}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ##############################################################################
+# STATEMENT PROFILING
+# ##############################################################################
+
+SLOW_QUERY_SECONDS = int(os.environ.get('SLOW_QUERY_MS', 200)) / 1000
+# Run EXPLAIN for slow SELECTs issued by these endpoints (see init_app).
+EXPLAIN_ROUTES = set()
+
+slow_log = logging.getLogger('scm.slow_query')
+if os.environ.get('SLOW_QUERY_LOG'):
+    _handler = logging.FileHandler(os.environ['SLOW_QUERY_LOG'])
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(process)d %(message)s'))
+    slow_log.addHandler(_handler)
+    slow_log.setLevel(logging.INFO)
+
+# The endpoint statements are attributed to. Background work has no request.
+current_route = contextvars.ContextVar('current_route', default='background')
+
+_VERB = re.compile(r'^\s*(\w+)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)', re.IGNORECASE)
+
+
+def statement_label(operation):
+    """Summarizes SQL as "VERB Table", e.g. "SELECT Products", to keep labels few."""
+    verb = _VERB.match(operation)
+    table = _TABLE.search(operation)
+    label = verb.group(1).upper() if verb else '?'
+    return f"{label} {table.group(1)}" if table else label
+
+
+def _row_bytes(row):
+    values = row.values() if isinstance(row, dict) else row
+    size = 0
+    for value in values:
+        if isinstance(value, (str, bytes, bytearray)):
+            size += len(value)
+        elif value is not None:
+            size += 8
+    return size
+
+
+class _Statement:
+    __slots__ = ('operation', 'params', 'route', 'label', 'seconds', 'rows', 'bytes')
+
+    def __init__(self, operation, params, seconds):
+        self.operation = operation
+        self.params = params
+        self.route = current_route.get()
+        self.label = statement_label(operation)
+        self.seconds = seconds
+        self.rows = 0
+        self.bytes = 0
+
+
+class ProfiledCursor:
+    """Wraps a cursor, timing each statement from execute() until the next one or close()."""
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+        self._statement = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self, method, operation, params, *args, **kwargs):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return method(operation, params, *args, **kwargs)
+        except mysql.connector.Error as err:
+            QUERY_ERRORS.inc((current_route.get(), statement_label(operation), str(err.errno)))
+            raise
+        finally:
+            self._statement = _Statement(operation, params, time.perf_counter() - started)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        return self._run(self._cursor.execute, operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        return self._run(self._cursor.executemany, operation, seq_params, *args, **kwargs)
+
+    def _fetched(self, rows, started):
+        statement = self._statement
+        if statement is not None:
+            statement.seconds += time.perf_counter() - started
+            statement.rows += len(rows)
+            statement.bytes += sum(_row_bytes(row) for row in rows)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched([row] if row is not None else [], started)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._fetched(rows, started)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(rows, started)
+        return rows
+
+    def fetchsets(self):
+        started = time.perf_counter()
+        for statement, rows in self._cursor.fetchsets():
+            self._fetched(rows, started)
+            yield statement, rows
+            started = time.perf_counter()
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        try:
+            return self._cursor.close()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        labels = (statement.route, statement.label)
+        QUERY_SECONDS.observe(labels, statement.seconds)
+        if statement.rows:
+            QUERY_ROWS.inc(labels, statement.rows)
+            QUERY_BYTES.inc(labels, statement.bytes)
+        if statement.seconds >= SLOW_QUERY_SECONDS:
+            SLOW_QUERIES.inc(labels)
+            self._log_slow(statement)
+
+    def _log_slow(self, statement):
+        sql = " ".join(statement.operation.split())
+        slow_log.warning("slow query %.1f ms route=%s rows=%d bytes=%d sql=%s",
+                         statement.seconds * 1000, statement.route, statement.rows, statement.bytes,
+                         sql[:2000])
+        if statement.route in EXPLAIN_ROUTES and statement.label.startswith('SELECT'):
+            cursor = self._connection.raw.cursor(dictionary=True)
+            try:
+                cursor.execute("EXPLAIN " + statement.operation, statement.params)
+                slow_log.warning("explain route=%s plan=%s", statement.route, cursor.fetchall())
+            except mysql.connector.Error as err:
+                slow_log.warning("explain failed route=%s: %s", statement.route, err)
+            finally:
+                cursor.close()
+
+
+class ProfiledConnection:
+    """Wraps a connection so every cursor it opens is profiled."""
+
+    def __init__(self, cnx):
+        self.raw = cnx
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def cursor(self, *args, **kwargs):
+        return ProfiledCursor(self.raw.cursor(*args, **kwargs), self)
+
+
+# ##############################################################################
+# FLASK INTEGRATION
+# ##############################################################################
+
+def init_app(app, db_config, explain_routes=()):
+    """Profiles every pooled connection and request, and serves /_metrics.
+
+    Statements slower than SLOW_QUERY_MS are logged to the 'scm.slow_query'
+    logger (and SLOW_QUERY_LOG, if set). With PROFILE_EXPLAIN=1, slow SELECTs
+    from `explain_routes` are followed by an EXPLAIN whose plan is logged too.
+    Metrics are kept per worker process.
+    """
+    db.wrap_connections(ProfiledConnection)
+    if os.environ.get('PROFILE_EXPLAIN') == '1':
+        EXPLAIN_ROUTES.update(explain_routes)
+
+    @app.before_request
+    def start_request_timer():
+        g.profile_started = time.perf_counter()
+        current_route.set(request.endpoint or 'unknown')
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('profile_started', None)
+        if started is not None:
+            REQUEST_SECONDS.observe((current_route.get(), request.method, str(response.status_code)),
+                                    time.perf_counter() - started)
+        acquired = g.pop('db_acquire_seconds', None)
+        if acquired is not None:
+            ACQUIRE_SECONDS.observe((current_route.get(),), acquired)
+        return response
+
+    def render_started(sender, template, **extra):
+        g.setdefault('render_started', {})[template.name] = time.perf_counter()
+
+    def render_finished(sender, template, **extra):
+        started = g.get('render_started', {}).pop(template.name, None)
+        if started is not None:
+            RENDER_SECONDS.observe((current_route.get(), template.name), time.perf_counter() - started)
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    @app.route('/_metrics')
+    def metrics():
+        """Exposes this worker's query, render and request metrics to Prometheus."""
+        stats = db.get_pool(db_config).stats()
+        return Response(render_metrics(stats), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,288 @@
+import datetime
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import click
+import mysql.connector
+import numpy as np
+
+import forecast
+
+
+# ##############################################################################
+# REORDER POINTS
+# ##############################################################################
+#
+# `flask replenish run` computes, for every stocked (warehouse, product):
+#
+#   daily demand   the product's forecast rate (demand_forecasts, from `flask
+#                  forecast run`), else its mean over the last --history-days
+#   safety stock   z(service level) x std of daily demand x sqrt(lead days)
+#   reorder point  demand over the lead time + safety stock
+#   order-up-to    demand over lead + review days + safety stock
+#   recommended    order-up-to - stock, once stock is at or below the reorder
+#                  point
+#
+# Orders are not tied to warehouses, so each warehouse takes the product's
+# demand and safety stock in proportion to its share of the stock (the split
+# warehouse_revenue uses).
+#
+# The parent process loads the inputs once into shared-memory arrays (demand
+# history, forecast rates, inventory rows) and the output arrays live there
+# too. --workers processes attach to them by name and each computes whole
+# partitions of products, so nothing but (start, end) is pickled. Results are
+# then written back one product range per transaction.
+
+LEAD_DAYS = 7
+REVIEW_DAYS = 7
+SERVICE_LEVEL = 0.95
+HISTORY_DAYS = 182
+PARTITION_SIZE = 5000
+WRITE_BATCH_SIZE = 5000
+
+
+# --- shared memory ----------------------------------------------------------
+
+class SharedArrays:
+    """Named NumPy arrays in shared memory, unlinked when the block exits."""
+
+    def __init__(self):
+        self.arrays, self.spec, self._blocks = {}, {}, []
+
+    def create(self, name, shape, dtype):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self._blocks.append(block)
+        self.spec[name] = (block.name, shape, dtype.str)
+        array = self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array.fill(0)
+        return array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.arrays.clear()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+
+
+_attached = {}
+_attached_blocks = []
+
+
+def _attach(spec):
+    """Process-pool initializer: maps the parent's arrays into this worker."""
+    for name, (block_name, shape, dtype) in spec.items():
+        # Workers share the parent's resource tracker, so the parent's unlink
+        # covers this registration too.
+        block = shared_memory.SharedMemory(name=block_name)
+        _attached_blocks.append(block)
+        _attached[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+# --- computation ------------------------------------------------------------
+
+def compute_partition(start, end, lead_days, review_days, z, arrays=None):
+    """Fills the output arrays for products [start, end). Returns the rows computed.
+
+    Runs in a pool worker (on the attached arrays) or in-process with `arrays`.
+    """
+    a = _attached if arrays is None else arrays
+    history = a['history'][start:end]
+    mean = history.mean(axis=1)
+    std = history.std(axis=1, ddof=1) if history.shape[1] > 1 else np.zeros_like(mean)
+    rate = np.where(np.isnan(a['forecast_rate'][start:end]), mean, a['forecast_rate'][start:end])
+
+    rows = slice(int(a['row_start'][start]), int(a['row_start'][end]))
+    product = a['row_product'][rows] - start
+    stock = a['row_stock'][rows].astype(np.float64)
+    held = np.bincount(product, weights=stock.clip(min=0), minlength=end - start)
+    stocked_in = np.bincount(product, minlength=end - start)
+    share = np.where(held[product] > 0, stock.clip(min=0) / np.where(held > 0, held, 1)[product],
+                     1 / np.maximum(stocked_in[product], 1))
+
+    daily = rate[product] * share
+    safety = np.ceil(z * std[product] * np.sqrt(lead_days) * share)
+    reorder_point = np.ceil(daily * lead_days) + safety
+    order_up_to = np.ceil(daily * (lead_days + review_days)) + safety
+    recommended = np.where(stock <= reorder_point, np.maximum(order_up_to - stock, 0), 0)
+
+    a['daily_demand'][rows] = daily
+    a['safety_stock'][rows] = safety
+    a['reorder_point'][rows] = reorder_point
+    a['order_up_to'][rows] = order_up_to
+    a['recommended'][rows] = recommended
+    return rows.stop - rows.start
+
+
+# --- loading and writing ----------------------------------------------------
+
+def _load_inventory(cnx, product_ids, shared):
+    """Reads warehouse_inventory into row arrays ordered by product, then warehouse."""
+    cursor = cnx.cursor(buffered=True)
+    cursor.execute("SELECT Product_ID, Warehouse_ID, Stock FROM warehouse_inventory ORDER BY Product_ID, Warehouse_ID")
+    inventory = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+    cursor.close()
+    index = np.searchsorted(product_ids, inventory[:, 0]).clip(max=len(product_ids) - 1)
+    inventory = inventory[product_ids[index] == inventory[:, 0]]  # rows of products missing from Products
+    row_product = np.searchsorted(product_ids, inventory[:, 0])
+
+    shared.create('row_product', (len(inventory),), np.int64)[:] = row_product
+    shared.create('row_warehouse', (len(inventory),), np.int64)[:] = inventory[:, 1]
+    shared.create('row_stock', (len(inventory),), np.int64)[:] = inventory[:, 2]
+    # row_start[p] is the first inventory row of product p (CSR offsets).
+    shared.create('row_start', (len(product_ids) + 1,), np.int64)[:] = np.searchsorted(
+        row_product, np.arange(len(product_ids) + 1))
+    return len(inventory)
+
+
+def _load_forecast_rates(cnx, product_ids, shared):
+    """Fills forecast_rate with each product's forecast daily demand (NaN if none)."""
+    rates = shared.create('forecast_rate', (len(product_ids),), np.float64)
+    rates.fill(np.nan)
+    cursor = cnx.cursor(buffered=True)
+    try:
+        cursor.execute("""
+            SELECT f.Product_ID, s.Frequency, SUM(f.Quantity), COUNT(*)
+            FROM demand_forecasts f
+            JOIN demand_forecast_summary s ON f.Product_ID = s.Product_ID
+            GROUP BY f.Product_ID, s.Frequency
+        """)
+        found = cursor.fetchall()
+    except mysql.connector.Error as err:
+        if err.errno != mysql.connector.errorcode.ER_NO_SUCH_TABLE:
+            raise
+        found = []  # forecasts were never migrated; history means are used
+    finally:
+        cursor.close()
+    for product_id, frequency, total, periods in found:
+        index = np.searchsorted(product_ids, product_id)
+        if index < len(product_ids) and product_ids[index] == product_id:
+            rates[index] = float(total) / (periods * forecast.FREQUENCIES[frequency]['days'])
+    return len(found)
+
+
+def _write(cnx, low, high, rows, computed_at):
+    cursor = cnx.cursor()
+    try:
+        cnx.commit()
+        cnx.start_transaction()
+        cursor.execute("DELETE FROM reorder_points WHERE Product_ID BETWEEN %s AND %s", (low, high))
+        for offset in range(0, len(rows), WRITE_BATCH_SIZE):
+            cursor.executemany("""
+                INSERT INTO reorder_points (Warehouse_ID, Product_ID, Stock, Daily_Demand, Safety_Stock,
+                                            Reorder_Point, Order_Up_To, Recommended_Qty, Computed_At)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, [row + (computed_at,) for row in rows[offset:offset + WRITE_BATCH_SIZE]])
+        cnx.commit()
+    except mysql.connector.Error:
+        cnx.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def run(cnx, workers=None, lead_days=LEAD_DAYS, review_days=REVIEW_DAYS, service_level=SERVICE_LEVEL,
+        history_days=HISTORY_DAYS, partition_size=PARTITION_SIZE, log=None):
+    """Computes and stores reorder points for every stocked (warehouse, product). Returns run statistics."""
+    workers = workers or os.cpu_count() or 1
+    z = statistics.NormalDist().inv_cdf(service_level)
+    timings, started = {}, time.perf_counter()
+
+    cursor = cnx.cursor(buffered=True)
+    cursor.execute("SELECT Product_ID FROM Products ORDER BY Product_ID")
+    product_ids = np.array([product_id for product_id, in cursor.fetchall()], dtype=np.int64)
+    cursor.execute("SELECT Date FROM Orders ORDER BY Date DESC LIMIT 1")
+    latest = cursor.fetchone()
+    cursor.close()
+    as_of = latest[0] if latest else datetime.date.today()
+    stats = {'products': len(product_ids), 'rows': 0, 'reorder': 0, 'workers': workers, 'as_of': as_of}
+    if not len(product_ids):
+        return stats
+
+    with SharedArrays() as shared:
+        history = shared.create('history', (len(product_ids), history_days), np.float32)
+        forecast.load_series(cnx, product_ids, as_of - datetime.timedelta(days=history_days - 1), history_days, 1,
+                             out=history)
+        stats['forecasts'] = _load_forecast_rates(cnx, product_ids, shared)
+        rows = _load_inventory(cnx, product_ids, shared)
+        for name in ('daily_demand', 'safety_stock', 'reorder_point', 'order_up_to', 'recommended'):
+            shared.create(name, (rows,), np.float64)
+        timings['load'] = time.perf_counter() - started
+
+        partitions = [(start, min(start + partition_size, len(product_ids)))
+                      for start in range(0, len(product_ids), partition_size)]
+        computing = time.perf_counter()
+        if workers == 1 or len(partitions) == 1:
+            for start, end in partitions:
+                compute_partition(start, end, lead_days, review_days, z, shared.arrays)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                     initializer=_attach, initargs=(shared.spec,)) as pool:
+                futures = [pool.submit(compute_partition, start, end, lead_days, review_days, z)
+                           for start, end in partitions]
+                for future in futures:
+                    future.result()
+        timings['compute'] = time.perf_counter() - computing
+
+        writing = time.perf_counter()
+        a = shared.arrays
+        computed_at = datetime.datetime.now().replace(microsecond=0)
+        for start, end in partitions:
+            first, last = int(a['row_start'][start]), int(a['row_start'][end])
+            rows_out = list(zip(a['row_warehouse'][first:last].tolist(),
+                                product_ids[a['row_product'][first:last]].tolist(),
+                                a['row_stock'][first:last].tolist(),
+                                a['daily_demand'][first:last].round(3).tolist(),
+                                a['safety_stock'][first:last].astype(np.int64).tolist(),
+                                a['reorder_point'][first:last].astype(np.int64).tolist(),
+                                a['order_up_to'][first:last].astype(np.int64).tolist(),
+                                a['recommended'][first:last].astype(np.int64).tolist()))
+            _write(cnx, int(product_ids[start]), int(product_ids[end - 1]), rows_out, computed_at)
+            if log:
+                log(f"products {product_ids[start]}-{product_ids[end - 1]}: {len(rows_out)} rows written")
+        timings['write'] = time.perf_counter() - writing
+        stats['rows'] = rows
+        stats['reorder'] = int(np.count_nonzero(a['recommended']))
+
+    stats['seconds'] = {step: round(seconds, 2) for step, seconds in timings.items()}
+    return stats
+
+
+def init_app(app, db_config, on_complete=None):
+    """Registers the `flask replenish` command group.
+
+    `on_complete(*tables)` is called with the tables a run wrote, after it commits.
+    """
+
+    @app.cli.group('replenish')
+    def replenish_cli():
+        """Plans stock replenishment from demand and inventory."""
+
+    @replenish_cli.command('run')
+    @click.option('--workers', type=int, help="Processes to compute with (default: one per CPU).")
+    @click.option('--lead-days', type=int, default=LEAD_DAYS, show_default=True)
+    @click.option('--review-days', type=int, default=REVIEW_DAYS, show_default=True)
+    @click.option('--service-level', type=float, default=SERVICE_LEVEL, show_default=True)
+    @click.option('--history-days', type=int, default=HISTORY_DAYS, show_default=True,
+                  help="Days of order history behind the demand variability.")
+    @click.option('--partition-size', type=int, default=PARTITION_SIZE, show_default=True,
+                  help="Products per task (and per write transaction).")
+    def run_command(workers, lead_days, review_days, service_level, history_days, partition_size):
+        """Computes reorder points and recommended order quantities for every stocked product."""
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            stats = run(cnx, workers, lead_days, review_days, service_level, history_days, partition_size,
+                        log=click.echo)
+        finally:
+            cnx.close()
+        if on_complete:
+            on_complete('reorder_points')
+        click.echo(f"{stats['rows']} stock rows planned, {stats['reorder']} to reorder, with {stats['workers']} "
+                   f"worker(s) as of {stats['as_of']} (seconds: {stats.get('seconds')}).")
@@ -0,0 +1,289 @@
+import ast
+import os
+import re
+
+import click
+import mysql.connector
+from mysql.connector import errorcode
+
+
+# ##############################################################################
+# SCHEMA MIGRATIONS
+# ##############################################################################
+#
+# migrations/NNNN_name.sql files are applied in version order, and each applied
+# version is recorded in schema_migrations. Run `flask schema migrate` after
+# pulling; `flask schema status` lists what is pending. Statements are separated
+# by ';' at the end of a line, and '--' lines are comments.
+#
+# DDL commits implicitly, so a migration that fails half way is not rolled back.
+# Tables are created IF NOT EXISTS and an index whose name already exists is
+# skipped, so fixing the cause and migrating again finishes the job.
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+_MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+_CREATE_VERSIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        Version INT NOT NULL PRIMARY KEY,
+        Name VARCHAR(100) NOT NULL,
+        Applied_At TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def split_statements(sql):
+    """Splits a migration file into statements, dropping '--' comment lines."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in re.split(r';\s*$', "\n".join(lines), flags=re.M)
+            if statement.strip()]
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Returns [(version, name, statements)] for every migration file, by version."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            with open(os.path.join(directory, filename)) as f:
+                migrations.append((int(match.group(1)), match.group(2), split_statements(f.read())))
+    migrations.sort()
+    return migrations
+
+
+def applied_versions(cnx):
+    """Returns the set of migration versions recorded in the database."""
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(_CREATE_VERSIONS_TABLE)
+        cursor.execute("SELECT Version FROM schema_migrations")
+        return {version for version, in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def migrate(cnx, target=None, placeholder='%s', directory=MIGRATIONS_DIR, log=None):
+    """Applies pending migrations up to `target` (default: all). Returns their versions.
+
+    `placeholder` is the driver's parameter marker, so bench/data.py can build
+    the same schema in SQLite.
+    """
+    done = applied_versions(cnx)
+    applied = []
+    cursor = cnx.cursor()
+    try:
+        for version, name, statements in load_migrations(directory):
+            if version in done or (target is not None and version > target):
+                continue
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except mysql.connector.Error as err:
+                    if err.errno != errorcode.ER_DUP_KEYNAME:
+                        raise
+            cursor.execute(f"INSERT INTO schema_migrations (Version, Name) VALUES ({placeholder}, {placeholder})",
+                           (version, name))
+            cnx.commit()
+            applied.append(version)
+            if log:
+                log(f"Applied {version:04d}_{name}")
+    finally:
+        cursor.close()
+    return applied
+
+
+# ##############################################################################
+# INDEX ADVISOR
+# ##############################################################################
+#
+# `flask schema advise` finds every SQL string in app.py, EXPLAINs it against the
+# configured database and flags full scans, filesorts and temporary tables. Run
+# it against a database seeded to a realistic size (python -m bench.data --mysql)
+# since the optimizer picks plans from row estimates.
+
+APP_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+# Full scans of tables estimated below this many rows are not worth an index.
+ADVISE_MIN_ROWS = 1000
+
+_STATEMENT_START = re.compile(r'^\s*(SELECT|UPDATE|DELETE|INSERT\b.*\bSELECT)\b', re.I | re.S)
+
+
+class _QueryCollector(ast.NodeVisitor):
+    """Collects (line, scope, sql) for SQL string literals and keyset_page() calls."""
+
+    def __init__(self):
+        self.queries = []
+        self._scopes = ['<module>']
+        self._assigned = [{}]  # per function: variable name -> string constant
+
+    def _add(self, node, sql):
+        self.queries.append((node.lineno, self._scopes[-1], sql))
+
+    def visit_FunctionDef(self, node):
+        self._scopes.append(node.name)
+        self._assigned.append({})
+        self.generic_visit(node)
+        self._assigned.pop()
+        self._scopes.pop()
+
+    def visit_Assign(self, node):
+        if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    self._assigned[-1][target.id] = node.value.value
+        if self._scopes[-1] == '<module>' and isinstance(node.targets[0], ast.Name):
+            self._scopes.append(node.targets[0].id)
+            self.generic_visit(node)
+            self._scopes.pop()
+        else:
+            self.generic_visit(node)
+
+    def visit_JoinedStr(self, node):
+        pass
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, str) and _STATEMENT_START.match(node.value):
+            self._add(node, node.value)
+
+    def visit_Call(self, node):
+        # List pages pass the SELECT ... FROM part and the sort keys separately;
+        # rebuild the first page's query from them.
+        if getattr(node.func, 'id', None) == 'keyset_page' and len(node.args) >= 3:
+            select_sql, order_keys = node.args[1], node.args[2]
+            if isinstance(select_sql, ast.Name):
+                select_sql = self._assigned[-1].get(select_sql.id)
+            else:
+                select_sql = getattr(select_sql, 'value', None)
+            try:
+                keys = ast.literal_eval(order_keys)
+            except ValueError:
+                keys = None
+            if isinstance(select_sql, str) and keys:
+                order_by = ", ".join(f"{column} {direction}" for column, _, direction in keys)
+                self._add(node, f"{select_sql} ORDER BY {order_by} LIMIT %s")
+                # The bare SELECT is part of this query, not a statement of its own.
+                self.queries = [q for q in self.queries if (q[1], q[2]) != (self._scopes[-1], select_sql)]
+                return
+        self.generic_visit(node)
+
+
+def collect_queries(path=APP_SOURCE):
+    """Returns [(line, scope, sql)] for every statement in a Python source file.
+
+    f-strings are skipped; queries built at run time are only seen through the
+    keyset_page() calls that build them.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    collector = _QueryCollector()
+    collector.visit(tree)
+    return collector.queries
+
+
+def explainable(sql):
+    """Splits `sql` into statements with sample values in place of %s markers."""
+    sql = re.sub(r'\bLIMIT\s+%s', 'LIMIT 50', sql, flags=re.I)
+    sql = re.sub(r'\bLIKE\s+%s', "LIKE 'a%'", sql, flags=re.I)
+    sql = sql.replace('%s', "'1'")
+    return [statement.strip() for statement in sql.split(';') if statement.strip()]
+
+
+def plan_findings(plan, min_rows=ADVISE_MIN_ROWS):
+    """Returns human-readable problems in an EXPLAIN result.
+
+    Understands MySQL/MariaDB's tabular EXPLAIN (type/Extra columns) and TiDB's
+    operator tree (id/estRows/access object columns).
+    """
+    findings = []
+    for row in plan:
+        if 'type' in row:
+            table, rows, extra = row.get('table'), row.get('rows') or 0, row.get('Extra') or ''
+            if row['type'] == 'ALL' and rows >= min_rows:
+                findings.append(f"full table scan of {table} (~{rows} rows)")
+            elif row['type'] == 'index' and rows >= min_rows:
+                findings.append(f"full index scan of {table} (~{rows} rows)")
+            if 'Using filesort' in extra:
+                findings.append(f"filesort on {table}")
+            if 'Using temporary' in extra:
+                findings.append(f"temporary table for {table}")
+        elif 'estRows' in row:
+            operator = row['id'].lstrip('└─│ ').split('_')[0]
+            rows = float(row.get('estRows') or 0)
+            table = row.get('access object') or ''
+            if operator in ('TableFullScan', 'IndexFullScan') and rows >= min_rows:
+                findings.append(f"{operator} {table} (~{rows:.0f} rows)")
+            elif operator in ('Sort', 'TopN'):
+                findings.append(f"{operator} (~{rows:.0f} rows) not served by an index")
+    return findings
+
+
+def advise(cnx, queries, min_rows=ADVISE_MIN_ROWS):
+    """EXPLAINs every query. Returns [(line, scope, statement, findings, error)]."""
+    results = []
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        for line, scope, sql in queries:
+            for statement in explainable(sql):
+                try:
+                    cursor.execute("EXPLAIN " + statement)
+                    results.append((line, scope, statement, plan_findings(cursor.fetchall(), min_rows), None))
+                except mysql.connector.Error as err:
+                    results.append((line, scope, statement, [], str(err)))
+    finally:
+        cursor.close()
+    return results
+
+
+def init_app(app, db_config):
+    """Registers the `flask schema` command group."""
+
+    @app.cli.group('schema')
+    def schema_cli():
+        """Applies schema migrations and checks query plans."""
+
+    @schema_cli.command('status')
+    def status_command():
+        """Lists every migration and whether it has been applied."""
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            done = applied_versions(cnx)
+        finally:
+            cnx.close()
+        for version, name, _ in load_migrations():
+            click.echo(f"{'applied' if version in done else 'pending'}  {version:04d}_{name}")
+
+    @schema_cli.command('migrate')
+    @click.option('--to', 'target', type=int, help="Stop after this version.")
+    def migrate_command(target):
+        """Applies pending migrations in version order."""
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            applied = migrate(cnx, target, log=click.echo)
+        finally:
+            cnx.close()
+        click.echo(f"{len(applied)} migration(s) applied." if applied else "Schema is up to date.")
+
+    @schema_cli.command('advise')
+    @click.option('--min-rows', type=int, default=ADVISE_MIN_ROWS, show_default=True,
+                  help="Ignore full scans of tables estimated smaller than this.")
+    @click.option('--all', 'show_all', is_flag=True, help="Also list statements with clean plans.")
+    def advise_command(min_rows, show_all):
+        """EXPLAINs every query in app.py and flags full scans and filesorts."""
+        cnx = mysql.connector.connect(**db_config)
+        try:
+            results = advise(cnx, collect_queries(), min_rows)
+        finally:
+            cnx.close()
+        flagged = 0
+        for line, scope, statement, findings, error in results:
+            if not (findings or error or show_all):
+                continue
+            flagged += bool(findings)
+            click.echo(f"app.py:{line} {scope}: {' '.join(statement.split())[:120]}")
+            for finding in findings:
+                click.echo(f"    ! {finding}")
+            if error:
+                click.echo(f"    explain failed: {error}")
+        click.echo(f"{len(results)} statements explained, {flagged} with findings.")